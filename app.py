@@ -1,18 +1,164 @@
-from flask import Flask, request, jsonify
-from seleniumbase import SB
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from flask_caching import Cache
 import os
+import hashlib
 import json
+import threading
+import time
+import httpx
 from google import genai
 from google.genai import types
+from browser_pool import BrowserPool, PoolSaturated
+from domains import (
+    DomainBlocked, DomainController, DomainUnavailable, NavigationFailed, RobotsDisallowed, page_is_blocked,
+)
+from batch import run_concurrently, url_domain
+from jobs import JobQueue, QueueFull, job_store_from_url
+from singleflight import SingleFlight
+from structured_data import collect_structured_data, confidence, extract_structured_product, is_complete
+from http_fetch import DomainTierMemory, HttpFetcher
+from images import ImageProber, canonicalize_image_urls
+from profiles import ProfileStore
+from refresh import (
+    WATCHED_FIELDS, RefreshScheduler, RefreshStore, diff_results, schedule_store_from_url, structured_hash,
+)
+from readiness import WaitSettings, wait_until_ready
+from interception import InterceptionRules
+from page_scripts import EXTRACTION_BUNDLE, EXTRACTION_WORLD, PageData
+from streaming import EventStream, format_ndjson, format_sse, stream_format
+from gemini_client import GeminiClient, estimate_cost_usd
+from llm_batch import LLMBatcher
+import metrics
+from result_cache import ContentHashCache, MemoryCache, RedisCache, SQLiteCache, TieredCache, normalize_url
 
 app = Flask(__name__)
 CORS(app)  # Allow all CORS requests for now
 
-app.config['CACHE_TYPE'] = 'SimpleCache'
-app.config['CACHE_DEFAULT_TIMEOUT'] = 300  # Cache timeout in seconds
-cache = Cache(app)
+# Result cache: in-process LRU, then SQLite on disk, then Redis when configured
+cache_tiers = [
+    MemoryCache(max_bytes=int(os.getenv("CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))),
+    SQLiteCache(os.getenv("CACHE_DB_PATH", "cache.db"), purge_every=int(os.getenv("CACHE_PURGE_EVERY", "1000"))),
+]
+if os.getenv("CACHE_REDIS_URL"):
+    cache_tiers.append(RedisCache(os.getenv("CACHE_REDIS_URL")))
+cache = TieredCache(cache_tiers)
+
+# Cache lifetimes in seconds. Stale entries are served while a refresh runs.
+CACHE_TTL_AI = int(os.getenv("CACHE_TTL_AI", "3600"))
+CACHE_TTL_MANUAL = int(os.getenv("CACHE_TTL_MANUAL", "900"))
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "3600"))
+
+# Shared Gemini client: pooled connections, concurrency and quota limits, retries
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-05-20")
+gemini_client = GeminiClient.from_env()
+
+PRODUCT_INSTRUCTION = "Extract from the page: product price if available, currency code (ISO 4217), product images, product name"
+PRODUCT_SCHEMA = genai.types.Schema(
+    type=genai.types.Type.OBJECT,
+    required=["product_name"],
+    properties={
+        "price": genai.types.Schema(
+            type=genai.types.Type.NUMBER,
+        ),
+        "currency_code": genai.types.Schema(
+            type=genai.types.Type.STRING,
+        ),
+        "product_name": genai.types.Schema(
+            type=genai.types.Type.STRING,
+        ),
+        "images": genai.types.Schema(
+            type=genai.types.Type.ARRAY,
+            items=genai.types.Schema(
+                type=genai.types.Type.STRING,
+            ),
+        ),
+    },
+)
+
+# Gemini results keyed by a hash of the cleaned HTML, shared with the result cache tiers.
+# The model, prompt and schema version the keys, so changing any of them starts a fresh cache
+llm_cache = ContentHashCache(
+    cache,
+    ttl=int(os.getenv("CACHE_TTL_LLM", str(7 * 24 * 3600))),
+    version=hashlib.sha256(
+        f"{GEMINI_MODEL}\n{PRODUCT_INSTRUCTION}\n{PRODUCT_SCHEMA.model_dump_json(exclude_none=True)}".encode()
+    ).hexdigest()[:16],
+)
+
+# Optional micro-batching: pages arriving within a short window share one Gemini call
+llm_batcher = LLMBatcher.from_env(
+    gemini_client, GEMINI_MODEL, PRODUCT_INSTRUCTION, PRODUCT_SCHEMA
+) if os.getenv("LLM_BATCH_ENABLED", "false").lower() == "true" else None
+
+# Optional size probe: ranged GETs read each image's dimensions and byte size,
+# so broken and icon-sized images are dropped without downloading them
+image_prober = ImageProber(
+    cache,
+    ttl=int(os.getenv("IMAGE_PROBE_TTL", str(7 * 24 * 3600))),
+    max_workers=int(os.getenv("IMAGE_PROBE_CONCURRENCY", "8")),
+    timeout=float(os.getenv("IMAGE_PROBE_TIMEOUT", "3")),
+    min_dimension=int(os.getenv("IMAGE_MIN_DIMENSION", "100")),
+) if os.getenv("IMAGE_PROBE_ENABLED", "false").lower() == "true" else None
+
+# Concurrent scrapes of the same cache key share one browser run
+scrapes_in_flight = SingleFlight()
+
+# Warm browsers shared by all requests instead of one SB() launch per request
+browser_pool = BrowserPool.from_env(init_scripts=[EXTRACTION_BUNDLE], init_world=EXTRACTION_WORLD)
+metrics.REGISTRY.register(metrics.PoolCollector(browser_pool))
+
+# What the AI reads: "condensed" (product-relevant blocks as text, fitted to
+# AI_TOKEN_BUDGET) or "html" (the cleaned HTML, cut at 50,000 characters)
+AI_PAGE_FORMAT = os.getenv("AI_PAGE_FORMAT", "condensed")
+AI_TOKEN_BUDGET = int(os.getenv("AI_TOKEN_BUDGET", "6000"))
+
+# Minimum confidence for structured data (JSON-LD, microdata, meta tags) to replace the AI call
+STRUCTURED_DATA_MIN_CONFIDENCE = float(os.getenv("STRUCTURED_DATA_MIN_CONFIDENCE", "0.8"))
+
+# Plain HTTP fetch tried before the browser; domains that need a browser are remembered
+HTTP_TIER_ENABLED = os.getenv("HTTP_TIER_ENABLED", "true").lower() == "true"
+http_fetcher = HttpFetcher(timeout=float(os.getenv("HTTP_TIMEOUT", "10")))
+tier_memory = DomainTierMemory(
+    cache,
+    ttl=int(os.getenv("TIER_MEMORY_TTL", str(24 * 3600))),
+    demote_after=int(os.getenv("TIER_DEMOTE_AFTER", "3")),
+)
+
+# Selectors learned from AI results, used to skip the AI on domains seen before
+extraction_profiles = ProfileStore(
+    cache,
+    ttl=int(os.getenv("PROFILE_TTL", str(30 * 24 * 3600))),
+    validate_every=int(os.getenv("PROFILE_VALIDATE_EVERY", "20")),
+    max_failures=int(os.getenv("PROFILE_MAX_FAILURES", "2")),
+    max_misses=int(os.getenv("PROFILE_MAX_MISSES", "3")),
+)
+
+# Upper bounds for the page readiness wait, optionally per domain
+wait_settings = WaitSettings.from_env()
+
+# Which requests each page load may make (CDP Fetch interception), optionally per domain
+interception_rules = InterceptionRules.from_env()
+
+# Per-domain concurrency (AIMD), politeness and circuit breaking around every scrape.
+# DOMAIN_STATE_STORE may point at Redis to share domain health across replicas.
+domain_controller = DomainController.from_env()
+
+# Bearer token for the /admin endpoints; without it they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Last result and validators of each URL checked through /refresh
+refresh_store = RefreshStore(cache, ttl=int(os.getenv("REFRESH_STATE_TTL", str(30 * 24 * 3600))))
+# How long a URL whose plain HTTP fetch was blocked goes straight to the browser before HTTP is tried again
+REFRESH_HTTP_RETRY = int(os.getenv("REFRESH_HTTP_RETRY", str(24 * 3600)))
+
+# Limits for /schedules
+SCHEDULE_MAX_URLS = int(os.getenv("SCHEDULE_MAX_URLS", "1000"))
+SCHEDULE_MIN_INTERVAL = int(os.getenv("SCHEDULE_MIN_INTERVAL", "300"))
+
+# Limits for /extract-batch
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", str(browser_pool.size)))
+BATCH_DOMAIN_CONCURRENCY = int(os.getenv("BATCH_DOMAIN_CONCURRENCY", "2"))
 
 
 def clean_url(url):
@@ -28,233 +174,39 @@ def is_valid_url(url):
     return url.startswith('http://') or url.startswith('https://')
 
 
-def extract_metadata(sb):
-    """Extract metadata using JavaScript."""
-    metadata = sb.execute_cdp_cmd("Runtime.evaluate", {
-        "expression": """
-            (() => {
-                const metaTags = document.querySelectorAll('meta[property^="og:"], meta[name]');
-                const metadata = {};
-                metaTags.forEach(meta => {
-                    const key = meta.getAttribute('property') || meta.getAttribute('name');
-                    const value = meta.getAttribute('content');
-                    if (key && value) {
-                        metadata[key] = value;
-                    }
-                });
-                return metadata;
-            })();
-        """,
-        "returnByValue": True
-    })["result"]["value"]
-    return metadata
-
-
 def clean_image_urls(image_urls, base_url):
-    """Remove duplicates and convert relative URLs to absolute URLs."""
-    cleaned_urls = set()
-    for url in image_urls:
-        if not url:
-            continue
-            
-        # Strip any URL parameters or fragments
-        clean_url = url.split('?')[0].split('#')[0]
-        
-        # Handle absolute URLs
-        if clean_url.startswith("https://") or clean_url.startswith("http://"):
-            cleaned_urls.add(clean_url)
-        # Handle relative URLs
-        elif clean_url.startswith("/"):
-            domain = "/".join(base_url.split("/")[:3])
-            cleaned_urls.add(f"{domain}{clean_url}")
-        # Handle protocol-relative URLs
-        elif clean_url.startswith("//"):
-            cleaned_urls.add(f"https:{clean_url}")
-        # Handle relative URLs without leading slash
-        elif not clean_url.startswith(("http://", "https://", "/", "//")):
-            # Extract base directory from URL
-            base_dir = "/".join(base_url.split("/")[:-1]) + "/"
-            cleaned_urls.add(f"{base_dir}{clean_url}")
-    return list(cleaned_urls)
-
-
-def clean_html_for_ai(sb):
-    """Extract only relevant HTML content for AI processing, removing scripts, styles, etc."""
-    cleaned_html = sb.execute_cdp_cmd("Runtime.evaluate", {
-        "expression": """
-            (() => {
-                // Clone the document to avoid modifying the actual page
-                const clonedDoc = document.cloneNode(true);
-                
-                // Remove script tags
-                const scripts = clonedDoc.querySelectorAll('script');
-                scripts.forEach(script => script.remove());
-                
-                // Remove style tags
-                const styles = clonedDoc.querySelectorAll('style');
-                styles.forEach(style => style.remove());
-                
-                // Remove link tags (stylesheets)
-                const links = clonedDoc.querySelectorAll('link[rel="stylesheet"]');
-                links.forEach(link => link.remove());
-                
-                // Remove comments
-                const removeComments = (node) => {
-                    for (let i = node.childNodes.length - 1; i >= 0; i--) {
-                        const child = node.childNodes[i];
-                        if (child.nodeType === 8) { // Comment node
-                            child.remove();
-                        } else if (child.nodeType === 1) { // Element node
-                            removeComments(child);
-                        }
-                    }
-                };
-                removeComments(clonedDoc);
-                
-                // Remove common non-content elements
-                const selectorsToRemove = [
-                    'iframe',
-                    'noscript',
-                    'svg:not([data-product-image])', // Keep product image SVGs
-                    'path',
-                    'defs',
-                    '.analytics-*',
-                    '[class*="tracking"]',
-                    '[class*="analytics"]',
-                    '[id*="tracking"]',
-                    '[id*="analytics"]',
-                    '.cookie-*',
-                    '[class*="cookie"]',
-                    '.gdpr-*',
-                    '[class*="gdpr"]',
-                    'footer',
-                    'header nav', // Keep header but remove navigation
-                    '.navigation',
-                    '.menu',
-                    '.sidebar:not(.product-sidebar)',
-                    '.advertisement',
-                    '.ads',
-                    '[class*="banner"]:not([class*="product"])',
-                    '.popup',
-                    '.modal:not(.product-modal)',
-                    '.overlay:not(.product-overlay)',
-                    '.social-share',
-                    '.social-media',
-                    '[class*="facebook"]',
-                    '[class*="twitter"]',
-                    '[class*="instagram"]',
-                    '[class*="pinterest"]',
-                    '.newsletter',
-                    '.subscription',
-                    '.related-products',
-                    '.recommended-products',
-                    '.recently-viewed',
-                    '.reviews:not(.product-reviews)',
-                    '.comments:not(.product-comments)',
-                    '.chat-widget',
-                    '[id*="chat"]',
-                    '.help-widget'
-                ];
-                
-                selectorsToRemove.forEach(selector => {
-                    try {
-                        const elements = clonedDoc.querySelectorAll(selector);
-                        elements.forEach(el => el.remove());
-                    } catch (e) {
-                        // Ignore selector errors
-                    }
-                });
-                
-                // Remove all inline styles and unnecessary attributes
-                const allElements = clonedDoc.querySelectorAll('*');
-                allElements.forEach(el => {
-                    el.removeAttribute('style');
-                    el.removeAttribute('onclick');
-                    el.removeAttribute('onload');
-                    el.removeAttribute('onerror');
-                    el.removeAttribute('onmouseover');
-                    el.removeAttribute('onmouseout');
-                    el.removeAttribute('data-analytics');
-                    el.removeAttribute('data-tracking');
-                    
-                    // Remove data attributes except for product-related ones
-                    const attrs = Array.from(el.attributes);
-                    attrs.forEach(attr => {
-                        if (attr.name.startsWith('data-') && 
-                            !attr.name.includes('product') && 
-                            !attr.name.includes('price') && 
-                            !attr.name.includes('image') &&
-                            !attr.name.includes('name') &&
-                            !attr.name.includes('sku') &&
-                            !attr.name.includes('currency')) {
-                            el.removeAttribute(attr.name);
-                        }
-                    });
-                });
-                
-                // Keep only essential HTML structure with product-related content
-                let html = clonedDoc.documentElement.outerHTML;
-                
-                // Remove excessive whitespace
-                html = html.replace(/\s+/g, ' ').replace(/> </g, '><').trim();
-                
-                // Limit the HTML size (take first 50KB)
-                const maxLength = 50000;
-                if (html.length > maxLength) {
-                    // Try to find the main product container first
-                    const productSelectors = [
-                        '.product-container',
-                        '.product-details',
-                        '.product-info',
-                        '.product-main',
-                        '[class*="product-page"]',
-                        '[id*="product-container"]',
-                        'main[role="main"]',
-                        'main',
-                        '.content',
-                        '#content'
-                    ];
-                    
-                    for (const selector of productSelectors) {
-                        const productElement = clonedDoc.querySelector(selector);
-                        if (productElement) {
-                            html = productElement.outerHTML;
-                            if (html.length <= maxLength) {
-                                break;
-                            }
-                        }
-                    }
-                    
-                    // If still too long, truncate
-                    if (html.length > maxLength) {
-                        html = html.substring(0, maxLength) + '...';
-                    }
-                }
-                
-                return html;
-            })();
-        """,
-        "returnByValue": True,
-    })["result"]["value"]
-    
-    return cleaned_html
+    """Resolve image URLs and collapse CDN renditions of the same image, keeping page order."""
+    with metrics.stage("image_cleanup"):
+        return canonicalize_image_urls(image_urls, base_url)
 
 
 def extract_product_info_from_html(html_content):
     """Extract product information from HTML using Google Gemini AI."""
+    cached_result = llm_cache.get(html_content)
+    metrics.CACHE_LOOKUPS.labels("llm", "hit" if cached_result else "miss").inc()
+    if cached_result:
+        print(f"AI cache hit - saved {cached_result['_token_usage']['saved_tokens']} tokens")
+        return cached_result
+
     try:
-        client = genai.Client(
-            api_key=os.getenv("GOOGLE_GENAI_API_KEY", ""),
-        )
+        if llm_batcher:
+            # Raises TimeoutError if the batch outlasts every retry; the manual fallback is used then
+            result = llm_batcher.extract(html_content)
+            if result is not None:
+                usage = result['_token_usage']
+                print(f"AI Token Usage (batch of {usage['batch_size']}) - Input: {usage['prompt_tokens']}, "
+                      f"Output: {usage['completion_tokens']}, Saved: {usage['saved_tokens']}")
+                llm_cache.set(html_content, result)
+                return result
 
-        model = "gemini-2.5-flash-preview-05-20"
+        model = GEMINI_MODEL
         
         # Prepare the content for the AI model with cleaned HTML
         contents = [
             types.Content(
                 role="user",
                 parts=[
-                    types.Part.from_text(text=f'Extract from html: product price if available, currency code (ISO 4217), product images, product name:\n{html_content}'),
+                    types.Part.from_text(text=f'{PRODUCT_INSTRUCTION}:\n{html_content}'),
                 ],
             ),
         ]
@@ -264,27 +216,7 @@ def extract_product_info_from_html(html_content):
                 thinking_budget=0,
             ),
             response_mime_type="application/json",
-            response_schema=genai.types.Schema(
-                type=genai.types.Type.OBJECT,
-                required=["product_name"],
-                properties={
-                    "price": genai.types.Schema(
-                        type=genai.types.Type.NUMBER,
-                    ),
-                    "currency_code": genai.types.Schema(
-                        type=genai.types.Type.STRING,
-                    ),
-                    "product_name": genai.types.Schema(
-                        type=genai.types.Type.STRING,
-                    ),
-                    "images": genai.types.Schema(
-                        type=genai.types.Type.ARRAY,
-                        items=genai.types.Schema(
-                            type=genai.types.Type.STRING,
-                        ),
-                    ),
-                },
-            ),
+            response_schema=PRODUCT_SCHEMA,
         )
 
         # Generate content from the AI model
@@ -292,7 +224,7 @@ def extract_product_info_from_html(html_content):
         usage_metadata = None
         
         # Use non-streaming to get usage metadata
-        response = client.models.generate_content(
+        response = gemini_client.generate(
             model=model,
             contents=contents,
             config=generate_content_config,
@@ -316,235 +248,827 @@ def extract_product_info_from_html(html_content):
             # Estimate cost (Gemini pricing as of 2024)
             # Gemini 1.5 Flash: $0.075 per 1M input tokens, $0.30 per 1M output tokens
             if result['_token_usage']['prompt_tokens'] and result['_token_usage']['completion_tokens']:
-                input_cost = (result['_token_usage']['prompt_tokens'] / 1_000_000) * 0.075
-                output_cost = (result['_token_usage']['completion_tokens'] / 1_000_000) * 0.30
-                result['_token_usage']['estimated_cost_usd'] = round(input_cost + output_cost, 6)
+                result['_token_usage']['estimated_cost_usd'] = estimate_cost_usd(
+                    result['_token_usage']['prompt_tokens'], result['_token_usage']['completion_tokens']
+                )
                 print(f"AI Token Usage - Input: {result['_token_usage']['prompt_tokens']}, "
                       f"Output: {result['_token_usage']['completion_tokens']}, "
                       f"Cost: ${result['_token_usage']['estimated_cost_usd']:.6f}")
         
+        llm_cache.set(html_content, result)
         return result
+    except TimeoutError:
+        print("Error extracting product info with AI: batched call timed out")
+        return None
     except Exception as e:
         print(f"Error extracting product info with AI: {e}")
         return None
 
 
+def structured_data_response(product, metadata, url):
+    return {
+        "product_name": product["product_name"],
+        "price": product["price"],
+        "currency": product["currency"],
+        "availability": product["availability"],
+        "image_urls": clean_image_urls(product["images"], url),
+        "metadata": metadata,
+        "extracted_with": "structured_data",
+        "confidence": product["confidence"],
+    }
+
+
+def fetch_with_http(url):
+    """Build the response from a plain HTTP fetch, or return None when the browser is needed."""
+    try:
+        page = http_fetcher.fetch(url)
+    except httpx.HTTPError as e:
+        print(f"HTTP fetch failed for {url}: {e}")
+        return None
+
+    if page is None:
+        tier_memory.incomplete(url)
+        return None
+    if page.blocked:
+        tier_memory.remember(url, "browser")
+        return None
+    if page.status_code >= 400:
+        return None  # A missing page says nothing about whether the domain renders server-side
+
+    structured = collect_structured_data(page.html)
+    product = extract_structured_product(structured)
+    if not is_complete(product) or product["confidence"] < STRUCTURED_DATA_MIN_CONFIDENCE:
+        tier_memory.incomplete(url)
+        return None
+
+    tier_memory.remember(url, "http")
+    return structured_data_response(product, structured["meta"], page.url)
+
+
+def product_fields(product):
+    """The product part of a result, as sent in structured_data and ai_result stream events."""
+    fields = {field: product.get(field) for field in ("product_name", "price", "currency", "availability")}
+    for key in ("extracted_with", "confidence", "token_usage"):
+        if key in product:
+            fields[key] = product[key]
+    return fields
+
+
+def public_response(response):
+    """Response without internal bookkeeping keys."""
+    return {key: value for key, value in response.items() if key != "_timings"}
+
+
+def content_cache_key(url, use_ai):
+    mode = "ai" if use_ai else "manual"
+    return f"content:{mode}:{normalize_url(url)}"
+
+
+def get_content(url, use_ai, queue_when_busy=True, on_event=None):
+    """Return the extraction result for url, from cache or a pooled browser.
+
+    With queue_when_busy=False, raises PoolSaturated instead of waiting when
+    every browser slot is taken. Raises DomainUnavailable when the domain's
+    circuit is open or, with queue_when_busy=False, when it has too many
+    scrapes in flight for too long; cached results,
+    stale ones included, are still served then. on_event(name, data) is
+    called with partial results as a browser scrape produces them.
+    """
+    cached_response, is_fresh = cache.get(content_cache_key(url, use_ai))
+    metrics.CACHE_LOOKUPS.labels("content", "miss" if not cached_response else "hit" if is_fresh else "stale").inc()
+    if cached_response:
+        if not is_fresh:
+            revalidate_content(url, use_ai)
+        return cached_response
+
+    return refresh_content(url, use_ai, queue_when_busy, on_event)
+
+
+def refresh_content(url, use_ai, queue_when_busy=True, on_event=None):
+    """Scrape url and store the result in the cache.
+
+    Identical requests arriving while a scrape is running wait for it
+    instead of starting their own.
+    """
+    cache_key = content_cache_key(url, use_ai)
+
+    def scrape():
+        timings = metrics.Timings()
+        with metrics.collect(timings):
+            with domain_controller.slot(url, block=queue_when_busy) as domain_slot:
+                response = None
+                # Manual mode keeps its browser result (every visible image and meta tag), so it skips HTTP
+                if HTTP_TIER_ENABLED and use_ai and tier_memory.get(url) != "browser":
+                    with metrics.stage("http_fetch"):
+                        response = fetch_with_http(url)
+                    if response:
+                        response["fetched_with"] = "http"
+                if response is None:
+                    queued_at = time.perf_counter()
+
+                    def run(lease):
+                        # Runs on the browser worker's thread
+                        with metrics.collect(timings):
+                            metrics.observe("browser_acquire", time.perf_counter() - queued_at)
+                            return scrape_page(lease, url, use_ai, on_event, domain_slot)
+
+                    response = browser_pool.run(run, block=queue_when_busy)
+                    response["fetched_with"] = "browser"
+            if image_prober and response.get("image_urls"):
+                with metrics.stage("image_probe"):
+                    response["image_urls"], response["image_details"] = image_prober.rank(response["image_urls"])
+        metrics.EXTRACTIONS.labels(response.get("extracted_with", "unknown"), response["fetched_with"]).inc()
+        response["_timings"] = {"scraped_at": time.time(), "stages": timings.stages}
+        cache.set(
+            cache_key,
+            response,
+            ttl=CACHE_TTL_AI if use_ai else CACHE_TTL_MANUAL,
+            stale_ttl=CACHE_STALE_TTL,
+        )
+        return response
+
+    return scrapes_in_flight.do(cache_key, scrape)
+
+
+def revalidate_content(url, use_ai):
+    """Refresh a stale cache entry in the background, once per key."""
+    if scrapes_in_flight.in_flight(content_cache_key(url, use_ai)) or domain_controller.is_open(url):
+        return
+
+    def run():
+        try:
+            refresh_content(url, use_ai)
+        except Exception as e:
+            print(f"Error revalidating {url}: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def fetch_for_refresh(url, snapshot):
+    """Conditional GET with the validators in snapshot, which is updated with the new ones.
+
+    Returns "not_modified" for a 304, the page's structured product when it
+    has a price, or None when plain HTTP cannot answer.
+    """
+    if not HTTP_TIER_ENABLED or time.time() - snapshot.get("http_blocked_at", 0) < REFRESH_HTTP_RETRY:
+        return None
+    headers = {}
+    if snapshot.get("etag"):
+        headers["If-None-Match"] = snapshot["etag"]
+    if snapshot.get("last_modified"):
+        headers["If-Modified-Since"] = snapshot["last_modified"]
+    try:
+        page = http_fetcher.fetch(url, headers)
+    except httpx.HTTPError as e:
+        print(f"Refresh fetch failed for {url}: {e}")
+        return None
+
+    if page is None:
+        return None
+    if page.status_code == 304:
+        return "not_modified"
+    if page.blocked:
+        snapshot["http_blocked_at"] = time.time()
+        return None
+    snapshot.pop("http_blocked_at", None)
+    snapshot["etag"] = page.headers.get("etag")
+    snapshot["last_modified"] = page.headers.get("last-modified")
+    product = extract_structured_product(collect_structured_data(page.html))
+    return product if product["price"] is not None else None
+
+
+def read_price_in_browser(url, price_selector, queue_when_busy=True):
+    """Render url and read only the price (through the profile selector) and the structured availability.
+
+    Returns None when the selector no longer finds a price.
+    """
+    def run(lease):
+        load_page(lease, url, interception_rules.for_url(url, use_ai=True), domain_slot)
+        lease.interceptor.stop()
+        price = extraction_profiles.read_price(lease.sb, {"price": price_selector})
+        if price is None:
+            return None
+        product = extract_structured_product(PageData(lease.sb)["structured_data"])
+        return {"price": price, "availability": product["availability"]}
+
+    with domain_controller.slot(url, block=queue_when_busy) as domain_slot:
+        return browser_pool.run(run, block=queue_when_busy)
+
+
+def update_cached_content(url, fields):
+    """Write fields found by a cheap refresh into the cached AI result, if there is one."""
+    cache_key = content_cache_key(url, True)
+    cached_response, _ = cache.get(cache_key)
+    if cached_response:
+        cache.set(cache_key, {**cached_response, **fields}, ttl=CACHE_TTL_AI, stale_ttl=CACHE_STALE_TTL)
+
+
+def refresh_product(url, queue_when_busy=True):
+    """Check url for changes to its price, currency, availability and name since the last check.
+
+    The cheapest path that can answer wins:
+    1. a conditional GET: a 304, or structured data that is unchanged (or
+       changed, but agreed with the last result) settles it;
+    2. a browser render that only reads the price through the domain's
+       profile selector;
+    3. a full scrape, which also refreshes the result cache.
+
+    Returns only the changes; the first check of a URL returns its values.
+    A full scrape that yields no product (the AI failed and only the manual
+    fallback came back) is reported as an error and not diffed.
+    """
+    checked_at = time.time()
+    snapshot = refresh_store.get(url)
+    first_seen = snapshot is None
+    snapshot = snapshot or {"url": url, "fields": {}, "changed_at": checked_at}
+    previous = snapshot["fields"]
+    fields = None
+
+    with metrics.stage("refresh_http"), domain_controller.slot(url, block=queue_when_busy):
+        product = fetch_for_refresh(url, snapshot)
+    if product == "not_modified":
+        checked_with, fields = "not_modified", previous
+    elif product and not first_seen and snapshot.get("structured_agrees"):
+        checked_with = "structured_data"
+        if structured_hash(product) == snapshot.get("structured_hash"):
+            fields = previous
+        else:
+            fields = {**previous, **{field: product[field] for field in WATCHED_FIELDS if product[field] is not None}}
+
+    if fields is None and not first_seen and snapshot.get("price_selector"):
+        with metrics.stage("refresh_price_only"):
+            values = read_price_in_browser(url, snapshot["price_selector"], queue_when_busy)
+        if values:
+            checked_with = "price_only"
+            availability = values["availability"] or previous.get("availability")
+            fields = {**previous, "price": values["price"], "availability": availability}
+
+    if fields is None:
+        checked_with = "full"
+        result = refresh_content(url, True, queue_when_busy)
+        fields = {field: result.get(field) for field in WATCHED_FIELDS}
+        if all(value is None for value in fields.values()):
+            refresh_store.count("failed", False)
+            return {
+                "url": url,
+                "changed": False,
+                "changes": {},
+                "checked_with": checked_with,
+                "checked_at": checked_at,
+                "last_changed_at": None if first_seen else snapshot["changed_at"],
+                "error": f"No product found on the page (extracted with {result.get('extracted_with')})",
+            }
+        profile = extraction_profiles.get(url)
+        snapshot["price_selector"] = profile["selectors"].get("price") if profile else None
+
+    if isinstance(product, dict):
+        snapshot["structured_hash"] = structured_hash(product)
+        if checked_with in ("price_only", "full"):
+            # Structured data is only trusted on later checks if it shows the price the page does;
+            # a check answered by the structured data itself cannot tell, so the last verdict stands
+            snapshot["structured_agrees"] = (
+                fields.get("price") is not None and abs(product["price"] - fields["price"]) < 0.005
+            )
+
+    changes = {} if first_seen else diff_results(previous, fields)
+    if changes:
+        snapshot["changed_at"] = checked_at
+        if checked_with in ("structured_data", "price_only"):
+            update_cached_content(url, {field: change["new"] for field, change in changes.items()})
+    snapshot.update(fields=fields, checked_at=checked_at)
+    refresh_store.save(url, snapshot)
+    refresh_store.count("first_seen" if first_seen else checked_with, bool(changes))
+
+    response = {
+        "url": url,
+        "changed": bool(changes),
+        "changes": changes,
+        "checked_with": checked_with,
+        "checked_at": checked_at,
+        "last_changed_at": snapshot["changed_at"],
+    }
+    if first_seen:
+        response["first_seen"] = True
+        response["current"] = fields
+    return response
+
+
+# Periodic refreshes of URL lists, spread over the interval per domain. Every worker process runs the
+# scheduler, so SCHEDULE_STORE must be shared: SQLite for one pod, Redis across replicas
+refresh_scheduler = RefreshScheduler(
+    refresh_product,
+    schedule_store_from_url(
+        os.getenv("SCHEDULE_STORE", "sqlite:///schedules.db"), ttl=int(os.getenv("SCHEDULE_TTL", str(30 * 24 * 3600)))
+    ),
+    max_concurrency=int(os.getenv("REFRESH_CONCURRENCY", str(browser_pool.size))),
+    domain_gap=float(os.getenv("REFRESH_DOMAIN_GAP", "2")),
+)
+
+
+# Background jobs for POST /jobs; JOB_STORE may point at SQLite or Redis to share state across replicas
+job_queue = JobQueue(
+    get_content,
+    job_store_from_url(os.getenv("JOB_STORE", "memory"), ttl=int(os.getenv("JOB_TTL", "3600"))),
+    workers=int(os.getenv("JOB_WORKERS", str(browser_pool.size))),
+    max_size=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+)
+
+
+def stream_content(url, use_ai, events):
+    """Run the extraction for a streamed request, then send what the scrape did not send itself.
+
+    Cache hits, plain HTTP fetches and requests that joined another one's
+    scrape get all their events at the end.
+    """
+    try:
+        content = get_content(url, use_ai, queue_when_busy=False, on_event=events.emit)
+    except (PoolSaturated, DomainUnavailable) as e:
+        events.emit("error", {"error": str(e), "retry_after": e.retry_after})
+    except Exception as e:
+        events.emit("error", {"error": str(e)})
+    else:
+        response = public_response(content)
+        if "metadata" not in events.sent:
+            events.emit("metadata", {"metadata": response.get("metadata")})
+        if use_ai and "structured_data" not in events.sent and response.get("extracted_with") == "structured_data":
+            events.emit("structured_data", {"product": product_fields(response), "complete": True,
+                                            "confidence": response.get("confidence")})
+        if "images" not in events.sent:
+            events.emit("images", {"image_urls": response.get("image_urls", [])})
+        if use_ai and "ai_result" not in events.sent:
+            events.emit("ai_result", product_fields(response))
+        scrape_timings = content.get("_timings") or {}
+        events.emit("done", {"result": response, "stages": scrape_timings.get("stages", {})})
+    finally:
+        events.close()
+
+
 @app.route('/extract-content', methods=['POST'])
 def extract_content():
+    started = time.time()
     data = request.json
     url = data.get("url")
     use_ai = data.get("use_ai", True)  # Default to using AI
+    debug = data.get("debug", False) or request.args.get("debug") == "1"
+    stream = data.get("stream", request.args.get("stream"))
 
     if not url:
         return jsonify({"error": "URL is required"}), 400
 
+    try:
+        stream = stream_format(stream, request.headers.get("Accept", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     url = clean_url(url)
 
     if not is_valid_url(url):
         return jsonify({"error": "Invalid URL format. URL must start with http:// or https://"}), 400
 
-    # Check cache for existing response
-    cache_key = f"content_{url}_{use_ai}"
-    cached_response = cache.get(cache_key)
-    if cached_response:
-        return jsonify(cached_response), 200
+    if stream:
+        # Partial results as server-sent events, or NDJSON lines with an "event" key
+        sse = stream == "sse"
+        events = EventStream()
+        threading.Thread(target=stream_content, args=(url, use_ai, events), daemon=True).start()
+
+        def generate():
+            for name, payload in events:
+                yield format_sse(name, payload) if sse else format_ndjson(name, payload)
+
+        response = Response(generate(), mimetype="text/event-stream" if sse else "application/x-ndjson")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"  # Keep proxies from holding events back
+        return response
 
     try:
-        with SB(uc=True, test=True, locale_code="en", pls="none", headless=True) as sb:
-            sb.activate_cdp_mode(url)
-            sb.execute_cdp_cmd(
-                'Network.setBlockedURLs',
-                {"urls": [
-                    "*.css",  # Stylesheets
-                    "*.woff", "*.woff2", "*.ttf", "*.eot",  # Fonts
-                    "*.mp4", "*.webm", "*.ogg", "*.mkv",  # Videos
-                    "*googlesyndication.com*", "*doubleclick.net*",  # Ads
-                    "*facebook.net*", "*analytics*", "*disqus.com*",  # Trackers & widgets
-                    "*.gif", "*.1x1.png"  # Tracking pixels
-                ]})
-            sb.execute_cdp_cmd('Network.enable', {})
-
-            sb.wait_for_ready_state_complete(timeout=10)
-
-            # Wait until lazy loading images are loaded
-            sb.sleep(2)
-
-            if use_ai:
-                # Get cleaned HTML content for AI processing
-                html_content = clean_html_for_ai(sb)
-                
-                # Log the size reduction for debugging
-                print(f"HTML size for AI: {len(html_content)} characters")
-                
-                # Extract product info using AI
-                product_info = extract_product_info_from_html(html_content)
-                
-                if product_info:
-                    response = {
-                        "product_name": product_info.get("product_name"),
-                        "price": product_info.get("price"),
-                        "currency": product_info.get("currency_code"),
-                        "image_urls": clean_image_urls(product_info.get("images", []), url),
-                        "metadata": extract_metadata(sb),
-                        "extracted_with": "ai"
-                    }
-                    
-                    # Include token usage if available
-                    if "_token_usage" in product_info:
-                        response["token_usage"] = product_info["_token_usage"]
-                else:
-                    # Fallback to manual extraction if AI fails
-                    images = sb.execute_cdp_cmd("Runtime.evaluate", {
-                        "expression": """
-                            function getBestSrcFromSrcset(srcset) {
-                                if (!srcset) return null;
-                                
-                                // Parse the srcset attribute
-                                const srcsetParts = srcset.split(',').map(part => {
-                                    const [url, width] = part.trim().split(/\s+/);
-                                    // Extract numeric width (remove the 'w')
-                                    const numWidth = width ? parseInt(width.replace('w', '')) : 0;
-                                    return { url, width: numWidth };
-                                });
-                                
-                                // Sort by width (descending) and return the largest image
-                                srcsetParts.sort((a, b) => b.width - a.width);
-                                return srcsetParts.length > 0 ? srcsetParts[0].url : null;
-                            }
-                            
-                            Array.from(document.querySelectorAll('img'))
-                                .filter(img => {
-                                    // Check if image is visible
-                                    const rect = img.getBoundingClientRect();
-                                    const style = window.getComputedStyle(img);
-                                    
-                                    // Minimum dimensions for non-icon/logo images (in pixels)
-                                    const MIN_WIDTH = 100;
-                                    const MIN_HEIGHT = 100;
-                                    const MIN_AREA = 10000; // width * height
-                                    
-                                    // Calculate actual dimensions
-                                    const area = rect.width * rect.height;
-                                    
-                                    return rect.width >= MIN_WIDTH && 
-                                           rect.height >= MIN_HEIGHT && 
-                                           area >= MIN_AREA &&
-                                           style.display !== 'none' && 
-                                           style.visibility !== 'hidden' &&
-                                           parseFloat(style.opacity) > 0;
-                                })
-                                .flatMap(img => {
-                                    const urls = [];
-                                    
-                                    // Get the src attribute
-                                    if (img.src) {
-                                        urls.push(img.src);
-                                    }
-                                    
-                                    // Get the best image from srcset if available
-                                    const srcset = img.getAttribute('srcset') || img.dataset.srcset;
-                                    if (srcset) {
-                                        const bestSrc = getBestSrcFromSrcset(srcset);
-                                        if (bestSrc) {
-                                            urls.push(bestSrc);
-                                        }
-                                    }
-                                    
-                                    return urls;
-                                });
-                        """,
-                        "returnByValue": True,
-                        "awaitPromise": True,
-                    })["result"]["value"]
-
-                    image_urls = clean_image_urls(images, url)
-                    metadata = extract_metadata(sb)
-                    
-                    response = {
-                        "image_urls": image_urls, 
-                        "metadata": metadata,
-                        "extracted_with": "manual_fallback"
-                    }
+        content = get_content(url, use_ai, queue_when_busy=False)
+        response = public_response(content)
+        if debug:
+            scrape_timings = content.get("_timings") or {}
+            from_cache = scrape_timings.get("scraped_at", started) < started
+            response["timings"] = {
+                "total": round(time.time() - started, 4),
+                "from_cache": from_cache,
+                "stages": {} if from_cache else scrape_timings.get("stages", {}),
+            }
+        return jsonify(response), 200
+    except (PoolSaturated, DomainUnavailable) as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 503
+    except RobotsDisallowed as e:
+        return jsonify({"error": str(e)}), 403
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/extract-batch', methods=['POST'])
+def extract_batch():
+    data = request.json
+    urls = data.get("urls")
+    use_ai = data.get("use_ai", True)  # Default to using AI
+
+    if not urls or not isinstance(urls, list):
+        return jsonify({"error": "urls must be a non-empty list"}), 400
+
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({"error": f"A batch may contain at most {BATCH_MAX_URLS} URLs"}), 400
+
+    # Group input positions by cache key so duplicate URLs are fetched once
+    invalid = []
+    unique = {}
+    for index, raw_url in enumerate(urls):
+        url = clean_url(raw_url) if isinstance(raw_url, str) else ""
+        if not is_valid_url(url):
+            invalid.append(index)
+            continue
+        unique.setdefault(content_cache_key(url, use_ai), (url, []))[1].append(index)
+    indexes_by_url = {url: indexes for url, indexes in unique.values()}
+
+    def generate():
+        for index in invalid:
+            yield json.dumps({
+                "indexes": [index],
+                "url": urls[index],
+                "error": "Invalid URL format. URL must start with http:// or https://",
+            }) + "\n"
+
+        results = run_concurrently(
+            list(indexes_by_url),
+            lambda url: get_content(url, use_ai),
+            max_concurrency=BATCH_MAX_CONCURRENCY,
+            per_domain_concurrency=BATCH_DOMAIN_CONCURRENCY,
+        )
+        for url, result, error in results:
+            line = {"indexes": indexes_by_url[url], "url": url}
+            if error:
+                line["error"] = str(error)
             else:
-                # Manual extraction only
-                images = sb.execute_cdp_cmd("Runtime.evaluate", {
-                    "expression": """
-                        function getBestSrcFromSrcset(srcset) {
-                            if (!srcset) return null;
-                            
-                            // Parse the srcset attribute
-                            const srcsetParts = srcset.split(',').map(part => {
-                                const [url, width] = part.trim().split(/\s+/);
-                                // Extract numeric width (remove the 'w')
-                                const numWidth = width ? parseInt(width.replace('w', '')) : 0;
-                                return { url, width: numWidth };
-                            });
-                            
-                            // Sort by width (descending) and return the largest image
-                            srcsetParts.sort((a, b) => b.width - a.width);
-                            return srcsetParts.length > 0 ? srcsetParts[0].url : null;
-                        }
-                        
-                        Array.from(document.querySelectorAll('img'))
-                            .filter(img => {
-                                // Check if image is visible
-                                const rect = img.getBoundingClientRect();
-                                const style = window.getComputedStyle(img);
-                                
-                                // Minimum dimensions for non-icon/logo images (in pixels)
-                                const MIN_WIDTH = 100;
-                                const MIN_HEIGHT = 100;
-                                const MIN_AREA = 10000; // width * height
-                                
-                                // Calculate actual dimensions
-                                const area = rect.width * rect.height;
-                                
-                                return rect.width >= MIN_WIDTH && 
-                                       rect.height >= MIN_HEIGHT && 
-                                       area >= MIN_AREA &&
-                                       style.display !== 'none' && 
-                                       style.visibility !== 'hidden' &&
-                                       parseFloat(style.opacity) > 0;
-                            })
-                            .flatMap(img => {
-                                const urls = [];
-                                
-                                // Get the src attribute
-                                if (img.src) {
-                                    urls.push(img.src);
-                                }
-                                
-                                // Get the best image from srcset if available
-                                const srcset = img.getAttribute('srcset') || img.dataset.srcset;
-                                if (srcset) {
-                                    const bestSrc = getBestSrcFromSrcset(srcset);
-                                    if (bestSrc) {
-                                        urls.push(bestSrc);
-                                    }
-                                }
-                                
-                                return urls;
-                            });
-                    """,
-                    "returnByValue": True,
-                    "awaitPromise": True,
-                })["result"]["value"]
-
-                image_urls = clean_image_urls(images, url)
-                metadata = extract_metadata(sb)
-                
-                response = {
-                    "image_urls": image_urls, 
-                    "metadata": metadata,
-                    "extracted_with": "manual"
-                }
-
-        cache.set(cache_key, response)  # Cache the response
+                line["result"] = public_response(result)
+            yield json.dumps(line) + "\n"
 
-        return jsonify(response), 200
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    data = request.json
+    url = data.get("url")
+
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+
+    url = clean_url(url)
+
+    if not is_valid_url(url):
+        return jsonify({"error": "Invalid URL format. URL must start with http:// or https://"}), 400
+
+    try:
+        return jsonify(refresh_product(url, queue_when_busy=False)), 200
+    except (PoolSaturated, DomainUnavailable) as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 503
+    except RobotsDisallowed as e:
+        return jsonify({"error": str(e)}), 403
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/schedules', methods=['POST'])
+def create_schedule():
+    data = request.json
+    urls = data.get("urls")
+    interval = data.get("interval")
+    webhook_url = data.get("webhook_url")
+
+    if not urls or not isinstance(urls, list):
+        return jsonify({"error": "urls must be a non-empty list"}), 400
+
+    if len(urls) > SCHEDULE_MAX_URLS:
+        return jsonify({"error": f"A schedule may contain at most {SCHEDULE_MAX_URLS} URLs"}), 400
+
+    if not isinstance(interval, (int, float)) or interval < SCHEDULE_MIN_INTERVAL:
+        return jsonify({"error": f"interval must be at least {SCHEDULE_MIN_INTERVAL} seconds"}), 400
+
+    urls = [clean_url(url) if isinstance(url, str) else "" for url in urls]
+    invalid = [index for index, url in enumerate(urls) if not is_valid_url(url)]
+    if invalid:
+        return jsonify({"error": "Invalid URL format. URL must start with http:// or https://",
+                        "indexes": invalid}), 400
+
+    if webhook_url is not None and not is_valid_url(webhook_url):
+        return jsonify({"error": "webhook_url must start with http:// or https://"}), 400
+
+    schedule = refresh_scheduler.add(urls, interval, webhook_url)
+    response = jsonify({"schedule_id": schedule["id"], "urls": len(schedule["urls"]), "interval": interval})
+    response.headers["Location"] = f"/schedules/{schedule['id']}"
+    return response, 201
+
+
+@app.route('/schedules/<schedule_id>', methods=['GET'])
+def get_schedule(schedule_id):
+    schedule = refresh_scheduler.get(schedule_id)
+    if not schedule:
+        return jsonify({"error": "Schedule not found"}), 404
+
+    return jsonify(schedule), 200
+
+
+@app.route('/schedules/<schedule_id>', methods=['DELETE'])
+def cancel_schedule(schedule_id):
+    schedule = refresh_scheduler.cancel(schedule_id)
+    if not schedule:
+        return jsonify({"error": "Schedule not found"}), 404
+
+    return jsonify({"schedule_id": schedule["id"], "status": schedule["status"]}), 200
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    data = request.json
+    url = data.get("url")
+    use_ai = data.get("use_ai", True)  # Default to using AI
+
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+
+    url = clean_url(url)
+
+    if not is_valid_url(url):
+        return jsonify({"error": "Invalid URL format. URL must start with http:// or https://"}), 400
+
+    try:
+        job = job_queue.submit(url=url, use_ai=use_ai)
+    except QueueFull as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    response = jsonify({"job_id": job["id"], "status": job["status"]})
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return response, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "url": job["params"]["url"],
+        "result": public_response(job["result"]) if job["result"] else None,
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }), 200
+
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Fails only when every browser is dead, so a restart is the remedy."""
+    stats = browser_pool.stats()
+    alive = stats["dead"] < stats["size"]
+    return jsonify({"status": "ok" if alive else "dead", "browsers_dead": stats["dead"]}), 200 if alive else 503
+
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Ready while at least one browser is up and the pool admits new scrapes."""
+    stats = browser_pool.stats()
+    ready = browser_pool.accepting() and stats["idle"] + stats["busy"] > 0
+    return jsonify({
+        "status": "ready" if ready else "unavailable",
+        "available_slots": stats["available_slots"],
+        "pending": stats["pending"],
+        "capacity": stats["capacity"],
+        "draining": stats["draining"],
+    }), 200 if ready else 503
+
+
+def admin_authorized():
+    """Admin endpoints need ADMIN_TOKEN set and sent as a bearer token; without it they stay closed."""
+    return bool(ADMIN_TOKEN) and request.headers.get("Authorization") == f"Bearer {ADMIN_TOKEN}"
+
+
+@app.route('/admin/domains', methods=['GET'])
+def list_domains():
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return jsonify({"domains": domain_controller.domains()}), 200
+
+
+@app.route('/admin/domains/<domain>', methods=['GET'])
+def get_domain(domain):
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    state = domain_controller.store.get(domain.lower())
+    if not state:
+        return jsonify({"error": "Domain not found"}), 404
+
+    return jsonify(state), 200
+
+
+@app.route('/admin/domains/<domain>', methods=['DELETE'])
+def reset_domain(domain):
+    """Close the domain's circuit and start its concurrency limit over."""
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    domain_controller.reset(domain.lower())
+    return jsonify({"domain": domain.lower(), "status": "reset"}), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE_LATEST)
+
+
+@app.route('/pool-stats', methods=['GET'])
+def pool_stats():
+    return jsonify(browser_pool.stats()), 200
+
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        **cache.stats(),
+        "single_flight": scrapes_in_flight.stats(),
+        "llm": llm_cache.stats(),
+        "fetch_tiers": tier_memory.stats(),
+        "profiles": extraction_profiles.stats(),
+        "gemini": gemini_client.stats(),
+        "image_probe": image_prober.stats() if image_prober else None,
+        "refresh": refresh_store.stats(),
+        "refresh_scheduler": refresh_scheduler.stats(),
+        "llm_batch": llm_batcher.stats() if llm_batcher else None,
+    }), 200
+
+
+def load_page(lease, url, request_filter, domain_slot=None):
+    """Navigate the leased tab to url and wait until the product is ready; returns the wait timings.
+
+    Only this part is timed for the domain's latency. Failed loads raise
+    NavigationFailed and bot walls DomainBlocked, which count against the
+    domain; a browser that died raises as before and does not.
+    """
+    started = time.perf_counter()
+    try:
+        with metrics.stage("navigation"):
+            lease.open(url, request_filter)
+
+        # Wait for the product to appear rather than a fixed delay
+        with metrics.stage("ready_wait"):
+            wait_timings = wait_until_ready(
+                lease.sb, lease.network, wait_settings.for_url(url), images_blocked=request_filter.block_images
+            )
+    except Exception as e:
+        if not lease.worker.is_alive():
+            raise
+        raise NavigationFailed(f"Loading {url} failed: {e}") from e
+    if domain_slot:
+        domain_slot.latency = time.perf_counter() - started
+
+    # A bot wall is not a result; failing here feeds the domain's circuit breaker instead of the cache
+    if page_is_blocked(lease.sb):
+        lease.interceptor.stop()
+        raise DomainBlocked(f"{url_domain(url)} answered with a bot wall")
+    return wait_timings
+
+
+def scrape_page(lease, url, use_ai, on_event=None, domain_slot=None):
+    """Load url in a leased browser and extract product content from it."""
+    sb = lease.sb
+    wait_timings = load_page(lease, url, interception_rules.for_url(url, use_ai), domain_slot)
+
+    response = extract_from_page(sb, url, use_ai, blocked_image_urls=lease.interceptor.image_urls, on_event=on_event)
+    response["wait_timings"] = wait_timings
+    response["interception"] = {**lease.interceptor.stop(), "bytes_received": lease.network.bytes_received}
+    return response
+
+
+def extract_from_page(sb, url, use_ai, blocked_image_urls=(), on_event=None):
+    """Extract product content from the page loaded in sb.
+
+    blocked_image_urls are images whose download was aborted; they stand in
+    for the on-page image list when blocking left nothing to measure.
+    on_event(name, data) receives the metadata, structured data, on-page
+    images and AI result as soon as each is known.
+    """
+    page = PageData(sb, {"token_budget": AI_TOKEN_BUDGET})
+
+    if not use_ai:
+        # Manual extraction only
+        page.prefetch("images", "metadata")
+        if on_event:
+            on_event("metadata", {"metadata": page["metadata"]})
+        return {
+            "image_urls": clean_image_urls(page["images"], url),
+            "metadata": page["metadata"],
+            "extracted_with": "manual"
+        }
+
+    # Most shops publish schema.org / OpenGraph product data; skip the LLM when it is enough
+    page.prefetch("structured_data", "metadata", *(("images",) if on_event else ()))
+    structured_product = extract_structured_product(page["structured_data"])
+    if on_event:
+        on_event("metadata", {"metadata": page["metadata"]})
+        on_event("structured_data", {
+            "product": product_fields(structured_product),
+            "complete": is_complete(structured_product),
+            "confidence": structured_product["confidence"],
+        })
+        on_event("images", {"image_urls": clean_image_urls(page["images"] or list(blocked_image_urls), url)})
+    if is_complete(structured_product) and structured_product["confidence"] >= STRUCTURED_DATA_MIN_CONFIDENCE:
+        return structured_data_response(structured_product, page["metadata"], url)
+
+    # Selectors learned from earlier AI extractions on this domain
+    profile = extraction_profiles.get(url)
+    profile_product = extraction_profiles.extract(sb, url, profile) if profile else None
+    profile_response = None
+    if profile_product:
+        profile_response = {
+            "product_name": profile_product["product_name"],
+            "price": profile_product["price"],
+            "currency": profile_product["currency"],
+            "availability": structured_product["availability"],
+            "image_urls": clean_image_urls(profile_product["images"], url),
+            "metadata": page["metadata"],
+            "extracted_with": "profile",
+            "confidence": confidence({
+                field: "profile" for field in ("product_name", "price", "currency") if profile_product[field]
+            }),
+        }
+        if not extraction_profiles.needs_validation(profile):
+            return profile_response
+
+    # Get condensed (or cleaned HTML) content for AI processing
+    html_content = page[AI_PAGE_FORMAT]
+    
+    # Log the size reduction for debugging
+    print(f"Page content for AI ({AI_PAGE_FORMAT}): {len(html_content)} characters")
+    
+    # Extract product info using AI
+    with metrics.stage("gemini"):
+        product_info = extract_product_info_from_html(html_content)
+    if product_info:
+        metrics.record_token_usage(GEMINI_MODEL, url_domain(url), product_info.get("_token_usage") or {})
+    
+    if not product_info:
+        if profile_response:
+            # The AI call was only validating the profile; its extraction still stands
+            return profile_response
+        # Fallback to manual extraction if AI fails
+        return {
+            "image_urls": clean_image_urls(page["images"] or list(blocked_image_urls), url),
+            "metadata": page["metadata"],
+            "extracted_with": "manual_fallback"
+        }
+
+    if profile_product:
+        # Occasional AI re-extraction to catch profiles that drifted
+        extraction_profiles.validate(url, profile, profile_product, product_info)
+    else:
+        extraction_profiles.learn(sb, url, product_info)
+
+    # Prefer the AI answer, filling any gaps from the structured data
+    ai_fields = {
+        "product_name": product_info.get("product_name"),
+        "price": product_info.get("price"),
+        "currency": product_info.get("currency_code"),
+    }
+    sources = dict(structured_product["sources"])
+    for field, value in ai_fields.items():
+        if value not in (None, ""):
+            sources[field] = "ai"
+        else:
+            ai_fields[field] = structured_product[field]
+
+    response = {
+        **ai_fields,
+        "availability": structured_product["availability"],
+        "image_urls": clean_image_urls(product_info.get("images") or structured_product["images"], url),
+        "metadata": page["metadata"],
+        "extracted_with": "ai",
+        "confidence": confidence(sources),
+    }
+    
+    # Include token usage if available
+    if "_token_usage" in product_info:
+        response["token_usage"] = product_info["_token_usage"]
+
+    if on_event:
+        on_event("ai_result", product_fields(response))
+    return response
+
+
 if __name__ == '__main__':
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    browser_pool.start()  # Launch browsers before the first request arrives
+    refresh_scheduler.start()
     app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
+
+def url_domain(url):
+    return (urlsplit(url).hostname or "").lower()
+
+
+def run_concurrently(urls, fn, max_concurrency=4, per_domain_concurrency=2):
+    """Call fn(url) for every url and yield (url, result, error) as each finishes.
+
+    At most max_concurrency calls run at once, and at most
+    per_domain_concurrency of them target the same domain. URLs whose domain
+    is saturated wait without holding a global slot, so one slow retailer
+    cannot starve the rest of the batch.
+    """
+    pending = list(urls)
+    running = {}
+    domain_load = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while pending or running:
+            # Start every pending URL that fits under both limits, in order
+            for url in list(pending):
+                if len(running) >= max_concurrency:
+                    break
+                domain = url_domain(url)
+                if domain_load.get(domain, 0) >= per_domain_concurrency:
+                    continue
+                pending.remove(url)
+                domain_load[domain] = domain_load.get(domain, 0) + 1
+                running[executor.submit(fn, url)] = url
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = running.pop(future)
+                domain_load[url_domain(url)] -= 1
+                error = future.exception()
+                yield url, (None if error else future.result()), error
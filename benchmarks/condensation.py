@@ -0,0 +1,123 @@
+"""Compare the condensed page format with the cleaned HTML on saved pages.
+
+Pages come from the recorded archive (see benchmarks/record.py): each
+directory holds page.html and expected.json with the expected product_name,
+price and currency_code. The pages are opened in a headless browser, both formats are produced by the extraction
+bundle, and prompt size, estimated cost and whether the price survived are
+reported. With --ai both prompts are also sent to Gemini (or to the server
+in GEMINI_BASE_URL) and the extracted fields are checked.
+
+    python -m benchmarks.condensation [--ai] [--budget 6000] [benchmarks/archive]
+"""
+import argparse
+import json
+import os
+import re
+from pathlib import Path
+
+from seleniumbase import SB
+
+from gemini_client import estimate_cost_usd
+from page_scripts import run_page_extraction
+
+FORMATS = ("html", "condensed")
+
+
+def price_in_prompt(prompt, price):
+    """True if the expected price appears in the prompt in any common notation."""
+    variants = {f"{price:.2f}", f"{price:.2f}".replace(".", ","), f"{price:,.2f}", f"{price:g}"}
+    compact = re.sub(r"\s", "", prompt)
+    return any(variant in compact for variant in variants)
+
+
+def score_extraction(result, expected):
+    """Number of product_name, price and currency_code values that match expected."""
+    if not result:
+        return 0
+    name = " ".join((result.get("product_name") or "").split()).lower()
+    score = int(name == expected["product_name"].lower())
+    price = result.get("price")
+    score += int(price is not None and abs(float(price) - expected["price"]) < 0.01)
+    score += int((result.get("currency_code") or "").upper() == expected["currency_code"])
+    return score
+
+
+def extract_with_ai(prompt):
+    # Imported lazily: the app module sets up caches and clients
+    from google.genai import types
+
+    from app import GEMINI_MODEL, PRODUCT_INSTRUCTION, PRODUCT_SCHEMA, gemini_client
+
+    response = gemini_client.generate(
+        model=GEMINI_MODEL,
+        contents=[types.Content(role="user", parts=[types.Part.from_text(text=f"{PRODUCT_INSTRUCTION}:\n{prompt}")])],
+        config=types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+            response_mime_type="application/json",
+            response_schema=PRODUCT_SCHEMA,
+        ),
+    )
+    usage = response.usage_metadata
+    return json.loads(response.text), usage.prompt_token_count, usage.candidates_token_count
+
+
+def run(archive_dir, budget, use_ai):
+    rows = []
+    with SB(headless=True) as sb:
+        for page_dir in sorted(path for path in Path(archive_dir).iterdir() if (path / "page.html").exists()):
+            expected = json.loads((page_dir / "expected.json").read_text())
+            sb.open((page_dir / "page.html").resolve().as_uri())
+            sections = run_page_extraction(sb, FORMATS, {"token_budget": budget})
+            for page_format in FORMATS:
+                prompt = sections[page_format]
+                row = {
+                    "page": page_dir.name,
+                    "format": page_format,
+                    "chars": len(prompt),
+                    "prompt_tokens": len(prompt) // 4 + 1,
+                    "completion_tokens": 0,
+                    "price_in_prompt": price_in_prompt(prompt, expected["price"]),
+                    "fields_correct": None,
+                }
+                if use_ai:
+                    try:
+                        result, row["prompt_tokens"], row["completion_tokens"] = extract_with_ai(prompt)
+                    except Exception as e:
+                        print(f"AI extraction failed for {page_dir.name} ({page_format}): {e}")
+                        result = None
+                    row["fields_correct"] = score_extraction(result, expected)
+                row["cost_usd"] = estimate_cost_usd(row["prompt_tokens"], row["completion_tokens"] or 0)
+                rows.append(row)
+    return rows
+
+
+def report(rows, use_ai):
+    print(f"{'page':<28}{'format':<11}{'chars':>9}{'tokens':>9}{'cost $':>11}{'price kept':>12}"
+          + (f"{'fields ok':>11}" if use_ai else ""))
+    for row in rows:
+        print(f"{row['page']:<28}{row['format']:<11}{row['chars']:>9}{row['prompt_tokens']:>9}"
+              f"{row['cost_usd']:>11.6f}{str(row['price_in_prompt']):>12}"
+              + (f"{row['fields_correct']:>9}/3" if use_ai else ""))
+
+    print()
+    for page_format in FORMATS:
+        selected = [row for row in rows if row["format"] == page_format]
+        if not selected:
+            continue
+        tokens = sum(row["prompt_tokens"] for row in selected)
+        cost = sum(row["cost_usd"] for row in selected)
+        kept = sum(row["price_in_prompt"] for row in selected)
+        line = f"{page_format:<11} tokens={tokens} cost=${cost:.6f} price kept={kept}/{len(selected)}"
+        if use_ai:
+            correct = sum(row["fields_correct"] for row in selected)
+            line += f" fields correct={correct}/{3 * len(selected)}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archive", nargs="?", default=os.path.join(os.path.dirname(__file__), "archive"))
+    parser.add_argument("--budget", type=int, default=int(os.getenv("AI_TOKEN_BUDGET", "6000")))
+    parser.add_argument("--ai", action="store_true", help="also extract with Gemini and check the fields")
+    args = parser.parse_args()
+    report(run(args.archive, args.budget, args.ai), args.ai)
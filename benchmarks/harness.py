@@ -0,0 +1,227 @@
+"""Replay the recorded archive through /extract-content and report speed, cost and accuracy.
+
+Everything runs locally: the archive is served by a local HTTP server, and
+Gemini is replaced by fake_gemini.py on another local port. Result, LLM and
+profile caches are disabled, so every request does the full scrape.
+
+For each mode (manual, ai) the report includes:
+- throughput and latency percentiles
+- memory per browser and prompt tokens
+- field-level accuracy against each page's expected.json
+
+With --baseline the run is compared with an earlier --output report, or
+with the checked-in budgets in benchmarks/baseline.json, and the exit
+status is non-zero when latency or tokens grow, or accuracy drops, by more
+than --tolerance (default: the baseline's own "tolerance", else 0.2). CI
+runs it that way as a gate.
+
+    python -m benchmarks.harness [--modes manual,ai] [--iterations 3] [--concurrency 2]
+                                 [--output report.json] [--baseline report.json]
+"""
+import argparse
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from werkzeug.serving import make_server
+
+ARCHIVE = Path(__file__).parent / "archive"
+FIELDS = ("product_name", "price", "currency", "images")
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_archive(archive):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(archive)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_fake_gemini():
+    from fake_gemini import app as fake_app
+
+    server = make_server("127.0.0.1", 0, fake_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure(gemini_port, workdir):
+    """Point the app at the local fake Gemini and turn its caches off; must run before importing app."""
+    os.environ.update({
+        "GEMINI_BASE_URL": f"http://127.0.0.1:{gemini_port}",
+        "GOOGLE_GENAI_API_KEY": "offline-benchmark",
+        "CACHE_DB_PATH": str(Path(workdir) / "cache.db"),
+        "CACHE_TTL_AI": "0",
+        "CACHE_TTL_MANUAL": "0",
+        "CACHE_STALE_TTL": "0",
+        "CACHE_TTL_LLM": "0",
+        "PROFILE_TTL": "0",
+        "TIER_MEMORY_TTL": "0",
+    })
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 4)
+
+
+def score_fields(result, expected):
+    """Per-field correctness of one result; images count as correct when most expected files were found."""
+    name = " ".join((result.get("product_name") or "").split()).lower()
+    price = result.get("price")
+    found = {Path(url.split("?")[0]).name for url in result.get("image_urls") or []}
+    expected_images = expected.get("images") or []
+    recall = sum(image in found for image in expected_images) / len(expected_images) if expected_images else 1.0
+    return {
+        "product_name": name == expected["product_name"].lower(),
+        "price": price is not None and abs(float(price) - expected["price"]) < 0.01,
+        "currency": (result.get("currency") or "").upper() == expected["currency_code"],
+        "images": recall >= 0.5,
+    }
+
+
+def run_mode(client, base_url, pages, use_ai, iterations, concurrency):
+    def replay(page):
+        started = time.perf_counter()
+        response = client.post("/extract-content", json={"url": f"{base_url}/{page}/page.html", "use_ai": use_ai})
+        return page, response.status_code, response.get_json(), time.perf_counter() - started
+
+    jobs = [page for _ in range(iterations) for page in pages]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(replay, jobs))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for _, status, _, elapsed in results if status == 200]
+    tokens = [body.get("token_usage", {}).get("prompt_tokens") or 0 for _, status, body, _ in results if status == 200]
+    field_hits = {field: 0 for field in FIELDS}
+    scored = 0
+    outcomes = {}
+    for page, status, body, _ in results:
+        if status != 200:
+            outcomes[f"http_{status}"] = outcomes.get(f"http_{status}", 0) + 1
+            continue
+        outcomes[body.get("extracted_with")] = outcomes.get(body.get("extracted_with"), 0) + 1
+        if not use_ai:
+            continue  # Manual mode only returns images and metadata
+        scored += 1
+        for field, correct in score_fields(body, pages[page]).items():
+            field_hits[field] += correct
+
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "throughput_rps": round(len(results) / wall, 3),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "prompt_tokens_avg": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+        "accuracy": {field: round(hits / scored, 3) for field, hits in field_hits.items()} if scored else None,
+        "outcomes": outcomes,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Describe every metric that got worse than baseline by more than tolerance (a fraction).
+
+    Failed requests are always a regression, and so is a metric the baseline
+    sets a limit for but the run did not produce (e.g. no latency because
+    every request failed).
+    """
+    regressions = []
+    for mode, current in report["modes"].items():
+        if current.get("errors"):
+            regressions.append(f"{mode} errors: {current['errors']} of {current['requests']} requests failed")
+        previous = baseline.get("modes", {}).get(mode)
+        if not previous:
+            continue
+        for metric in ("latency_p50", "latency_p90", "prompt_tokens_avg"):
+            if previous.get(metric) is None:
+                continue
+            if current.get(metric) is None:
+                regressions.append(f"{mode} {metric}: {previous[metric]} -> missing")
+            elif current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{mode} {metric}: {previous[metric]} -> {current[metric]}")
+        accuracy = current.get("accuracy") or {}
+        for field, before in (previous.get("accuracy") or {}).items():
+            value = accuracy.get(field)
+            if value is None:
+                regressions.append(f"{mode} accuracy.{field}: {before} -> missing")
+            elif value < before - tolerance * before:
+                regressions.append(f"{mode} accuracy.{field}: {before} -> {value}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--archive", default=str(ARCHIVE))
+    parser.add_argument("--modes", default="manual,ai")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, help="allowed regression as a fraction of the baseline")
+    args = parser.parse_args()
+
+    archive = Path(args.archive)
+    pages = {
+        path.name: json.loads((path / "expected.json").read_text())
+        for path in sorted(archive.iterdir()) if (path / "page.html").exists()
+    }
+    archive_server = serve_archive(archive)
+    os.environ.setdefault("FAKE_GEMINI_LATENCY", "0.3")
+    gemini_server = serve_fake_gemini()
+    workdir = tempfile.mkdtemp(prefix="scraper-bench-")
+    configure(gemini_server.server_port, workdir)
+
+    import app  # Reads the configuration above
+
+    app.browser_pool.start()
+    base_url = f"http://127.0.0.1:{archive_server.server_address[1]}"
+    client = app.app.test_client()
+    report = {"pages": len(pages), "iterations": args.iterations, "concurrency": args.concurrency, "modes": {}}
+    try:
+        # One warm-up pass so browser launches are not counted as page latency
+        run_mode(client, base_url, pages, False, 1, args.concurrency)
+        for mode in args.modes.split(","):
+            report["modes"][mode] = run_mode(client, base_url, pages, mode == "ai", args.iterations, args.concurrency)
+        report["browser_memory_mb"] = [
+            round(memory, 1) if memory is not None else None
+            for memory in (worker.memory_mb() for worker in app.browser_pool.workers)
+        ]
+        report["stages"] = {
+            sample.labels["stage"]: round(sample.value, 4)
+            for metric in app.metrics.STAGE_SECONDS.collect()
+            for sample in metric.samples if sample.name.endswith("_sum")
+        }
+    finally:
+        app.browser_pool.stop()
+        archive_server.shutdown()
+        gemini_server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        tolerance = args.tolerance if args.tolerance is not None else baseline.get("tolerance", 0.2)
+        regressions = compare(report, baseline, tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
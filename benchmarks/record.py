@@ -0,0 +1,152 @@
+"""Record a live product page into the benchmark archive.
+
+The page is loaded in a pooled browser and left to settle. Then its images
+and stylesheets are downloaded into <archive>/<name>/r/. Last, a static
+snapshot of the rendered DOM is saved as page.html, with its resource URLs
+pointing at the local copies and with scripts removed (JSON-LD is kept).
+Replaying the snapshot therefore needs no network.
+
+An expected.json draft is written from the page's structured data. Review it
+and fill in anything missing before using the page as a golden.
+
+    python -m benchmarks.record https://shop.example.com/p/123 example-shirt
+"""
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from browser_pool import BrowserPool
+from http_fetch import DEFAULT_HEADERS
+from readiness import WaitSettings, wait_until_ready
+from structured_data import collect_structured_data, extract_structured_product
+
+ARCHIVE = Path(__file__).parent / "archive"
+
+# Absolute URLs of the images and stylesheets the page uses
+COLLECT_RESOURCES_SCRIPT = """
+(() => {
+    const urls = new Set();
+    const add = (value) => {
+        if (!value || value.startsWith('data:')) return;
+        try { urls.add(new URL(value, document.baseURI).href); } catch (e) {}
+    };
+    document.querySelectorAll('img, source').forEach(el => {
+        add(el.getAttribute('src'));
+        add(el.getAttribute('data-src'));
+        (el.getAttribute('srcset') || el.getAttribute('data-srcset') || '').split(',')
+            .forEach(candidate => add(candidate.trim().split(/\\s+/)[0]));
+    });
+    document.querySelectorAll('link[rel="stylesheet"]').forEach(el => add(el.getAttribute('href')));
+    return Array.from(urls);
+})()
+"""
+
+# Static copy of the rendered DOM with resource URLs swapped for local paths
+SNAPSHOT_SCRIPT = """
+((local) => {
+    const doc = document.documentElement.cloneNode(true);
+    const resolve = (value) => {
+        try { return new URL(value, document.baseURI).href; } catch (e) { return value; }
+    };
+    const swap = (value) => local[resolve(value)] || value;
+    doc.querySelectorAll('script:not([type="application/ld+json"]), iframe, base').forEach(el => el.remove());
+    doc.querySelectorAll('[src], [data-src], [href]').forEach(el => {
+        ['src', 'data-src'].forEach(attr => el.hasAttribute(attr) && el.setAttribute(attr, swap(el.getAttribute(attr))));
+        if (el.tagName === 'LINK') el.setAttribute('href', swap(el.getAttribute('href')));
+    });
+    // Structured data and og:image carry the same URLs as text
+    doc.querySelectorAll('script[type="application/ld+json"]').forEach(el => {
+        Object.entries(local).forEach(([remote, path]) => { el.textContent = el.textContent.split(remote).join(path); });
+    });
+    doc.querySelectorAll('meta[content^="http"]').forEach(el => el.setAttribute('content', swap(el.getAttribute('content'))));
+    doc.querySelectorAll('[srcset], [data-srcset]').forEach(el => {
+        ['srcset', 'data-srcset'].forEach(attr => {
+            if (!el.hasAttribute(attr)) return;
+            el.setAttribute(attr, el.getAttribute(attr).split(',').map(candidate => {
+                const [url, ...descriptor] = candidate.trim().split(/\\s+/);
+                return [swap(url), ...descriptor].join(' ');
+            }).join(', '));
+        });
+    });
+    return '<!DOCTYPE html>\\n' + doc.outerHTML;
+})
+"""
+
+
+def _evaluate(sb, expression):
+    return sb.execute_cdp_cmd("Runtime.evaluate", {
+        "expression": expression,
+        "returnByValue": True,
+    })["result"]["value"]
+
+
+def download_resources(urls, directory, max_resources):
+    """Save each URL under directory and return {url: relative path}."""
+    directory.mkdir(parents=True, exist_ok=True)
+    saved = {}
+    with httpx.Client(headers=DEFAULT_HEADERS, follow_redirects=True, timeout=15) as client:
+        for url in urls[:max_resources]:
+            try:
+                response = client.get(url)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"Skipping {url}: {e}")
+                continue
+            content_type = response.headers.get("content-type", "").split(";")[0]
+            extension = mimetypes.guess_extension(content_type) or os.path.splitext(url.split("?")[0])[1]
+            filename = hashlib.sha1(url.encode()).hexdigest()[:16] + (extension or "")
+            (directory / filename).write_bytes(response.content)
+            saved[url] = f"r/{filename}"
+    return saved
+
+
+def record(url, name, archive, max_resources):
+    page_dir = Path(archive) / name
+    pool = BrowserPool(size=1)
+
+    def capture(lease):
+        lease.open(url)
+        wait_until_ready(lease.sb, lease.network, WaitSettings.from_env().for_url(url))
+        resources = download_resources(_evaluate(lease.sb, COLLECT_RESOURCES_SCRIPT), page_dir / "r", max_resources)
+        snapshot = _evaluate(lease.sb, f"({SNAPSHOT_SCRIPT})({json.dumps(resources)})")
+        return resources, snapshot
+
+    try:
+        resources, snapshot = pool.run(capture)
+    finally:
+        pool.stop()
+
+    (page_dir / "page.html").write_text(snapshot)
+    (page_dir / "manifest.json").write_text(json.dumps({
+        "url": url,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "resources": resources,
+    }, indent=2))
+
+    expected_path = page_dir / "expected.json"
+    if not expected_path.exists():
+        product = extract_structured_product(collect_structured_data(snapshot))
+        expected_path.write_text(json.dumps({
+            "product_name": product["product_name"],
+            "price": product["price"],
+            "currency_code": product["currency"],
+            "images": [Path(image).name for image in product["images"] if image.startswith("r/")],
+        }, indent=2))
+        print(f"Wrote a draft {expected_path}; check it before relying on it")
+    print(f"Recorded {url} into {page_dir} with {len(resources)} resources")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url")
+    parser.add_argument("name")
+    parser.add_argument("--archive", default=str(ARCHIVE))
+    parser.add_argument("--max-resources", type=int, default=150)
+    args = parser.parse_args()
+    record(args.url, args.name, args.archive, args.max_resources)
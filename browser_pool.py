@@ -0,0 +1,432 @@
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+import mycdp
+import psutil
+from seleniumbase import SB
+
+import metrics
+from interception import RequestInterceptor
+from readiness import NetworkMonitor
+
+# Options every pooled browser is launched with (same as the old per-request SB()).
+SB_OPTIONS = dict(uc=True, test=True, locale_code="en", pls="none", headless=True)
+
+
+class BrowserCrashed(Exception):
+    """Raised when a pooled browser dies while serving a lease."""
+
+
+class PoolSaturated(Exception):
+    """Raised when work is submitted while every browser slot and queue place is taken, or while draining."""
+
+    def __init__(self, retry_after, message="Every browser is busy"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BrowserLease:
+    """A browser handed to one request. Only valid inside the pool callback."""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.sb = worker.sb
+
+    @property
+    def network(self):
+        return self.worker.network
+
+    @property
+    def interceptor(self):
+        return self.worker.interceptor
+
+    def open(self, url, request_filter=None):
+        """Navigate the leased tab to url, tracking and filtering its requests."""
+        self.worker.network.attach(self.sb)
+        self.worker.interceptor.attach(self.sb)
+        self.worker.install_init_scripts()
+        self.worker.network.reset()
+        self.worker.interceptor.start(request_filter)
+        parts = urlsplit(url)
+        self.worker.visited_origins.add(f"{parts.scheme}://{parts.netloc}")
+        self.sb.activate_cdp_mode(url)
+
+
+class BrowserWorker:
+    """A long-lived browser driven by its own thread.
+
+    SeleniumBase drivers (and the CDP event loop behind them) are not safe to
+    share between threads, so each worker owns one browser and runs leased
+    callbacks on its own thread.
+    """
+
+    def __init__(self, pool, worker_id):
+        self.pool = pool
+        self.worker_id = worker_id
+        self.sb = None
+        self._sb_context = None
+        self.state = "starting"
+        self.pages_served = 0
+        self.launched_at = None
+        self.network = NetworkMonitor()
+        self.interceptor = RequestInterceptor()
+        self._scripts_page = None
+        self.visited_origins = set()
+        self.thread = threading.Thread(
+            target=self._run, name=f"browser-worker-{worker_id}", daemon=True
+        )
+
+    def _launch(self):
+        self.state = "starting"
+        with metrics.stage("browser_launch"):
+            self._sb_context = SB(**SB_OPTIONS)
+            self.sb = self._sb_context.__enter__()
+            # Enter CDP mode up front so network handlers can be attached before the first navigation
+            self.sb.activate_cdp_mode("about:blank")
+        self.network = NetworkMonitor()
+        self.interceptor = RequestInterceptor()
+        self._scripts_page = None
+        self.visited_origins = set()
+        self.pages_served = 0
+        self.launched_at = time.time()
+        self.pool._count("launched")
+
+    def _close(self):
+        context, self._sb_context, self.sb = self._sb_context, None, None
+        if context is None:
+            return
+        try:
+            context.__exit__(None, None, None)
+        except Exception as e:
+            print(f"Error closing browser worker {self.worker_id}: {e}")
+
+    def install_init_scripts(self):
+        """Register the pool's init scripts on the current tab (once per tab)."""
+        page = self.sb.cdp.page
+        if page is self._scripts_page:
+            return
+        for script in self.pool.init_scripts:
+            self.sb.cdp.loop.run_until_complete(
+                page.send(mycdp.page.add_script_to_evaluate_on_new_document(
+                    source=script, world_name=self.pool.init_world
+                ))
+            )
+        self._scripts_page = page
+
+    def memory_mb(self):
+        """Resident memory of the browser process tree in MB, or None if unknown."""
+        pid = getattr(getattr(self.sb, "driver", None), "browser_pid", None)
+        if not pid:
+            return None
+        try:
+            process = psutil.Process(pid)
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return rss / (1024 * 1024)
+        except psutil.Error:
+            return None
+
+    def is_alive(self):
+        """Cheap round trip to check that the browser still answers CDP commands."""
+        try:
+            self.sb.execute_cdp_cmd("Runtime.evaluate", {"expression": "1", "returnByValue": True})
+            return True
+        except Exception:
+            return False
+
+    def _reset_page(self):
+        """Leave the tab clean for the next lease.
+
+        With clear_cookies, cookies go, and so does all storage (local and
+        session storage, IndexedDB, Cache Storage, service workers) of every
+        origin the lease opened, including where it was redirected to.
+        """
+        self.interceptor.stop()
+        if self.pool.clear_cookies:
+            origin = self.sb.execute_cdp_cmd("Runtime.evaluate", {
+                "expression": "location.origin",
+                "returnByValue": True,
+            })["result"].get("value")
+            if origin and origin != "null":
+                self.visited_origins.add(origin)
+        # Leave the page first so it cannot write anything back while being cleared
+        self.sb.activate_cdp_mode("about:blank")
+        if self.pool.clear_cookies:
+            self.sb.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            for origin in self.visited_origins:
+                self.sb.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        self.visited_origins.clear()
+
+    def _recycle_reason(self):
+        if self.pages_served >= self.pool.max_pages:
+            return "max_pages"
+        memory = self.memory_mb()
+        if memory is not None and memory > self.pool.max_memory_mb:
+            return "max_memory"
+        return None
+
+    def _replace(self, reason):
+        print(f"Recycling browser worker {self.worker_id} ({reason})")
+        self.state = "recycling"
+        self._close()
+        self.pool._count("crashed" if reason == "crashed" else "recycled")
+        if not self.pool._stopping:
+            try:
+                self._launch()
+            except Exception as e:
+                # Leave the slot empty; the next lease or health check retries.
+                print(f"Failed to relaunch browser worker {self.worker_id}: {e}")
+
+    def _run(self):
+        try:
+            self._launch()
+        except Exception as e:
+            print(f"Failed to launch browser worker {self.worker_id}: {e}")
+            self.pool._count("crashed")
+        while not self.pool._stopping:
+            self.state = "idle" if self.sb else "dead"
+            try:
+                task = self.pool._tasks.get(timeout=self.pool.health_check_interval)
+            except queue.Empty:
+                self._health_check()
+                continue
+            if task is None:
+                break
+            fn, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._serve(fn, future)
+        self.state = "stopped"
+        self._close()
+
+    def _serve(self, fn, future):
+        try:
+            if self.sb is None:
+                self._launch()
+            self.state = "busy"
+            started = time.monotonic()
+            result = fn(BrowserLease(self))
+            self.pool._record_duration(time.monotonic() - started)
+        except Exception as e:
+            crashed = not self.is_alive()
+            future.set_exception(BrowserCrashed(str(e)) if crashed else e)
+            if crashed:
+                self._replace("crashed")
+                return
+        else:
+            future.set_result(result)
+        self.pages_served += 1
+        self.pool._count("pages_served")
+        try:
+            self._reset_page()
+            reason = self._recycle_reason()
+        except Exception:
+            reason = "crashed"
+        if reason:
+            self._replace(reason)
+
+    def _health_check(self):
+        try:
+            if self.sb is None:
+                self._launch()
+            elif not self.is_alive():
+                self._replace("crashed")
+            else:
+                reason = self._recycle_reason()
+                if reason:
+                    self._replace(reason)
+        except Exception as e:
+            print(f"Health check failed for browser worker {self.worker_id}: {e}")
+            self._close()
+            self.pool._count("crashed")
+
+
+class BrowserPool:
+    """Pool of warm browsers shared by all requests.
+
+    Work is submitted with run(fn); the first idle worker picks it up and calls
+    fn(lease) on its own thread. At most size + max_queued leases are pending
+    at once; past that, non-blocking submissions raise PoolSaturated so the
+    caller can shed load instead of piling up requests. init_scripts are registered on every tab
+    with Page.addScriptToEvaluateOnNewDocument, in the isolated world init_world when it is set
+    (the page's main world otherwise). Workers are recycled after max_pages pages or
+    once their process tree passes max_memory_mb, and replaced if they crash.
+    """
+
+    def __init__(self, size=2, max_pages=50, max_memory_mb=1024, health_check_interval=30,
+                 clear_cookies=True, init_scripts=(), init_world=None, max_queued=None):
+        self.size = size
+        self.max_queued = size * 2 if max_queued is None else max_queued
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.health_check_interval = health_check_interval
+        self.clear_cookies = clear_cookies
+        self.init_scripts = list(init_scripts)
+        self.init_world = init_world
+        self.workers = []
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._counters = {"launched": 0, "recycled": 0, "crashed": 0, "pages_served": 0}
+        self._stopping = False
+        self._started = False
+        self._draining = False
+        self._pending = 0
+        self._avg_duration = 10.0  # Seconds per page; refined as pages complete
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        return cls(
+            size=int(os.getenv("BROWSER_POOL_SIZE", "2")),
+            max_pages=int(os.getenv("BROWSER_MAX_PAGES", "50")),
+            max_memory_mb=int(os.getenv("BROWSER_MAX_MEMORY_MB", "1024")),
+            health_check_interval=int(os.getenv("BROWSER_HEALTH_CHECK_INTERVAL", "30")),
+            clear_cookies=os.getenv("BROWSER_CLEAR_COOKIES", "true").lower() == "true",
+            max_queued=int(os.environ["BROWSER_MAX_QUEUED"]) if "BROWSER_MAX_QUEUED" in os.environ else None,
+            **kwargs,
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _record_duration(self, seconds):
+        with self._lock:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * seconds
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    @property
+    def capacity(self):
+        return self.size + self.max_queued
+
+    def available_slots(self):
+        """Leases that can start right away."""
+        with self._lock:
+            return max(self.size - self._pending, 0)
+
+    def accepting(self):
+        """True when a non-blocking submit() would be admitted."""
+        with self._lock:
+            return not self._draining and self._pending < self.capacity
+
+    def retry_after(self):
+        """Rough number of seconds until a browser slot frees up."""
+        with self._lock:
+            return max(1, math.ceil(self._avg_duration / max(self.size, 1)))
+
+    def start(self):
+        """Launch the workers. Safe to call more than once."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._stopping = False
+            self._draining = False
+            self.workers = [BrowserWorker(self, i) for i in range(self.size)]
+        for worker in self.workers:
+            worker.thread.start()
+
+    def submit(self, fn, block=True):
+        """Queue fn(lease) for the next idle browser and return a Future.
+
+        With block=False, raises PoolSaturated instead of queueing when the
+        pool is at capacity. Nothing new is accepted while draining.
+        """
+        self.start()
+        with self._lock:
+            draining = self._draining
+            full = not block and self._pending >= self.capacity
+            if not (draining or full):
+                self._pending += 1
+        if draining:
+            raise PoolSaturated(self.retry_after(), "Shutting down")
+        if full:
+            raise PoolSaturated(self.retry_after())
+        future = Future()
+        future.add_done_callback(self._release)
+        self._tasks.put((fn, future))
+        return future
+
+    def run(self, fn, timeout=None, block=True):
+        """Run fn(lease) on a pooled browser and wait for its result."""
+        return self.submit(fn, block=block).result(timeout=timeout)
+
+    def begin_drain(self):
+        """Stop accepting work without waiting; readiness turns unavailable and pending leases carry on."""
+        with self._lock:
+            self._draining = True
+
+    def drain(self, timeout=60):
+        """Stop accepting work, wait up to timeout seconds for pending leases, then stop."""
+        self.begin_drain()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._pending <= 0:
+                    break
+            time.sleep(0.2)
+        self.stop()
+
+    def stop(self):
+        """Let workers finish their current page, then close every browser.
+
+        Leases still queued (e.g. after a drain timeout) fail with PoolSaturated
+        instead of waiting forever for a worker.
+        """
+        self._stopping = True
+        for _ in self.workers:
+            self._tasks.put(None)
+        for worker in self.workers:
+            worker.thread.join()
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                continue
+            _, future = task
+            if future.set_running_or_notify_cancel():
+                future.set_exception(PoolSaturated(self.retry_after(), "Shutting down"))
+        with self._lock:
+            self._started = False
+
+    def stats(self):
+        states = [worker.state for worker in self.workers]
+        with self._lock:
+            counters = dict(self._counters)
+            pending = self._pending
+            draining = self._draining
+        return {
+            "size": self.size,
+            "capacity": self.capacity,
+            "pending": pending,
+            "available_slots": max(self.size - pending, 0),
+            "draining": draining,
+            "busy": states.count("busy"),
+            "idle": states.count("idle"),
+            "starting": states.count("starting") + states.count("recycling"),
+            "dead": states.count("dead"),
+            "queued": self._tasks.qsize(),
+            **counters,
+            "workers": [
+                {
+                    "id": worker.worker_id,
+                    "state": worker.state,
+                    "pages_served": worker.pages_served,
+                    "uptime_seconds": round(time.time() - worker.launched_at, 1) if worker.launched_at else None,
+                }
+                for worker in self.workers
+            ],
+        }
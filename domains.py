@@ -0,0 +1,480 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+import metrics
+from batch import url_domain
+from http_fetch import BLOCKED_STATUS_CODES, DEFAULT_HEADERS, looks_like_bot_wall, looks_like_challenge
+
+# Status of the document load, and its HTML when the page is short; anything longer is not a bot wall
+PAGE_STATUS_SCRIPT = """
+(() => {
+    const entry = performance.getEntriesByType('navigation')[0];
+    const html = document.documentElement.outerHTML;
+    return {status: entry ? entry.responseStatus || 0 : 0, html: html.length < 50000 ? html : ''};
+})()
+"""
+
+
+class DomainUnavailable(Exception):
+    """Raised when a domain's circuit is open or too many of its scrapes are in flight."""
+
+    def __init__(self, retry_after, message):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DomainBlocked(Exception):
+    """Raised when a domain answers with a bot wall instead of the page."""
+
+
+class NavigationFailed(Exception):
+    """Raised when loading a page fails on the site's side (timeouts, resets, error pages)."""
+
+
+class RobotsDisallowed(Exception):
+    """Raised when robots.txt disallows a URL and robots rules are respected."""
+
+
+def page_is_blocked(sb):
+    """True when the page loaded in sb is a bot wall.
+
+    Small pages merely mentioning a captcha or "access denied" are not
+    enough: the page must carry a known challenge, or have been answered
+    with a blocking status code and look like a bot wall.
+    """
+    page = sb.execute_cdp_cmd("Runtime.evaluate", {
+        "expression": PAGE_STATUS_SCRIPT,
+        "returnByValue": True,
+    })["result"]["value"]
+    html = page["html"]
+    if not html:
+        return False
+    return looks_like_challenge(html) or (page["status"] in BLOCKED_STATUS_CODES and looks_like_bot_wall(html))
+
+
+class MemoryDomainStore:
+    """Keeps domain health in this process only. Fine for a single replica."""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, domain):
+        with self._lock:
+            state = self._states.get(domain)
+            return dict(state) if state else None
+
+    def put(self, domain, state):
+        with self._lock:
+            self._states[domain] = dict(state)
+
+    def update(self, domain, change):
+        """Apply change(state) atomically; it gets None for an unknown domain and returns the new state,
+        or None to leave it as it is. Returns what change returned."""
+        with self._lock:
+            current = self._states.get(domain)
+            state = change(dict(current) if current else None)
+            if state is not None:
+                self._states[domain] = dict(state)
+            return state
+
+    def delete(self, domain):
+        with self._lock:
+            self._states.pop(domain, None)
+
+    def domains(self):
+        with self._lock:
+            return sorted(self._states)
+
+
+class RedisDomainStore:
+    """Keeps domain health in Redis so every replica backs off from the same domains."""
+
+    def __init__(self, url, ttl=7 * 24 * 3600, prefix="ecom-scraper:domain:"):
+        import redis  # Only needed when DOMAIN_STATE_STORE points at Redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+
+    def get(self, domain):
+        data = self._redis.get(self.prefix + domain)
+        return json.loads(data) if data else None
+
+    def put(self, domain, state):
+        self._redis.set(self.prefix + domain, json.dumps(state), ex=self.ttl)
+        self._redis.sadd(self.prefix + "index", domain)
+
+    def update(self, domain, change):
+        """Apply change(state) atomically across replicas (optimistic WATCH/MULTI, retried on conflict)."""
+        key = self.prefix + domain
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    state = change(json.loads(data) if data else None)
+                    if state is None:
+                        pipe.unwatch()
+                        return None
+                    pipe.multi()
+                    pipe.set(key, json.dumps(state), ex=self.ttl)
+                    pipe.sadd(self.prefix + "index", domain)
+                    pipe.execute()
+                    return state
+                except self._watch_error:
+                    continue
+
+    def delete(self, domain):
+        self._redis.delete(self.prefix + domain)
+        self._redis.srem(self.prefix + "index", domain)
+
+    def domains(self):
+        names = sorted(name.decode() for name in self._redis.smembers(self.prefix + "index"))
+        expired = [name for name in names if not self._redis.exists(self.prefix + name)]
+        if expired:
+            self._redis.srem(self.prefix + "index", *expired)
+        return [name for name in names if name not in expired]
+
+
+def domain_store_from_url(url):
+    """Build a store from "memory" or "redis://host:port/db"."""
+    if not url or url == "memory":
+        return MemoryDomainStore()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisDomainStore(url)
+    raise ValueError(f"Unsupported domain state store: {url}")
+
+
+class RobotsPolicy:
+    """robots.txt rules per origin, fetched on first use and kept for ttl seconds.
+
+    A robots.txt answered with 401 or 403 disallows everything, as
+    urllib.robotparser does; any other missing or unreadable one allows
+    everything.
+    """
+
+    def __init__(self, user_agent="*", ttl=24 * 3600, timeout=5.0):
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self.client = httpx.Client(headers=DEFAULT_HEADERS, timeout=timeout, follow_redirects=True)
+        self._parsers = {}
+        self._lock = threading.Lock()
+
+    def _parser(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            cached = self._parsers.get(origin)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        parser = RobotFileParser()
+        lines = []
+        try:
+            response = self.client.get(f"{origin}/robots.txt")
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code < 400:
+                lines = response.text.splitlines()
+        except httpx.HTTPError as e:
+            print(f"Could not read robots.txt of {origin}: {e}")
+        parser.parse(lines)
+        with self._lock:
+            self._parsers[origin] = (parser, time.time() + self.ttl)
+        return parser
+
+    def allowed(self, url):
+        return self._parser(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url):
+        """Seconds to leave between requests to url's site, from Crawl-delay or Request-rate."""
+        parser = self._parser(url)
+        delay = parser.crawl_delay(self.user_agent)
+        if delay is None:
+            rate = parser.request_rate(self.user_agent)
+            delay = rate.seconds / rate.requests if rate and rate.requests else 0
+        return float(delay)
+
+
+class DomainSlot:
+    """One admitted scrape of a domain.
+
+    latency is set to the time the site took to load the page (navigation
+    and readiness wait); when left unset, the whole slot is timed.
+    """
+
+    def __init__(self, domain, probe):
+        self.domain = domain
+        self.probe = probe
+        self.started = time.perf_counter()
+        self.latency = None
+
+
+class DomainController:
+    """Per-domain admission for scrapes: adaptive concurrency, politeness and a circuit breaker.
+
+    Each domain has a concurrency limit adjusted by AIMD: it grows by
+    1/limit after every success faster than latency_target, shrinks by a
+    quarter after a slow success and halves after a failure (an error or a
+    bot wall). Scrapes over the limit queue for a slot; callers that cannot
+    queue (block=False) wait at most wait_timeout. Starts are spaced by
+    min_interval, or by the site's robots.txt Crawl-delay when robots rules
+    are respected.
+
+    After failure_threshold failures in a row, or when the failure rate
+    passes max_error_rate, the domain's circuit opens. Only bot walls and
+    failed page loads count; our own failures do not. Scrapes then fail
+    fast with DomainUnavailable, so cached results, even stale ones, are
+    served instead. Once open_seconds have passed, one probe scrape is let
+    through; if it fails the circuit opens again for twice as long, up to
+    max_open_seconds.
+
+    Limits and circuit state live in the store and are shared by replicas;
+    in-flight counts are per process.
+    """
+
+    def __init__(self, store, initial_limit=2, min_limit=1, max_limit=8, latency_target=15.0,
+                 failure_threshold=3, max_error_rate=0.5, open_seconds=60, max_open_seconds=900,
+                 wait_timeout=10.0, min_interval=0.0, probe_timeout=120.0, robots=None):
+        self.store = store
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.failure_threshold = failure_threshold
+        self.max_error_rate = max_error_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.wait_timeout = wait_timeout
+        self.min_interval = min_interval
+        self.probe_timeout = probe_timeout
+        self.robots = robots
+        self._local = {}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        robots = RobotsPolicy(
+            user_agent=os.getenv("ROBOTS_USER_AGENT", "*"),
+            ttl=int(os.getenv("ROBOTS_TTL", str(24 * 3600))),
+        ) if os.getenv("RESPECT_ROBOTS", "false").lower() == "true" else None
+        return cls(
+            domain_store_from_url(os.getenv("DOMAIN_STATE_STORE", "memory")),
+            initial_limit=float(os.getenv("DOMAIN_INITIAL_CONCURRENCY", "2")),
+            min_limit=float(os.getenv("DOMAIN_MIN_CONCURRENCY", "1")),
+            max_limit=float(os.getenv("DOMAIN_MAX_CONCURRENCY", "8")),
+            latency_target=float(os.getenv("DOMAIN_LATENCY_TARGET", "15")),
+            failure_threshold=int(os.getenv("DOMAIN_FAILURE_THRESHOLD", "3")),
+            max_error_rate=float(os.getenv("DOMAIN_MAX_ERROR_RATE", "0.5")),
+            open_seconds=int(os.getenv("DOMAIN_OPEN_SECONDS", "60")),
+            max_open_seconds=int(os.getenv("DOMAIN_MAX_OPEN_SECONDS", "900")),
+            wait_timeout=float(os.getenv("DOMAIN_WAIT_TIMEOUT", "10")),
+            min_interval=float(os.getenv("DOMAIN_MIN_INTERVAL", "0")),
+            probe_timeout=float(os.getenv("DOMAIN_PROBE_TIMEOUT", "120")),
+            robots=robots,
+        )
+
+    def state(self, domain):
+        return self.store.get(domain) or self._new_state(domain)
+
+    def _new_state(self, domain):
+        return {
+            "domain": domain,
+            "limit": float(self.initial_limit),
+            "circuit": "closed",
+            "open_until": 0,
+            "opens": 0,
+            "probe_started_at": 0,
+            "consecutive_failures": 0,
+            "error_rate": 0.0,
+            "avg_latency": None,
+            "requests": 0,
+            "failures": 0,
+            "last_failure": None,
+            "updated_at": None,
+        }
+
+    def is_open(self, url):
+        """True while url's domain fails fast."""
+        state = self.store.get(url_domain(url))
+        return bool(state) and state["circuit"] == "open" and state["open_until"] > time.time()
+
+    def _reject(self, reason, retry_after, message):
+        metrics.DOMAIN_REJECTIONS.labels(reason).inc()
+        raise DomainUnavailable(max(1, math.ceil(retry_after)), message)
+
+    def _admit(self, domain):
+        """Check the circuit; returns the domain state and whether this scrape is the half-open probe."""
+        now = time.time()
+        seen = {}
+
+        def change(state):
+            state = seen["state"] = state or self._new_state(domain)
+            if state["circuit"] == "closed":
+                return None
+            if state["circuit"] == "open" and state["open_until"] > now:
+                self._reject("circuit_open", state["open_until"] - now, f"{domain} is failing; not scraping it for now")
+            # A probe that never reported back (its process died) is given up after probe_timeout
+            if state["circuit"] == "half_open" and now - state["probe_started_at"] < self.probe_timeout:
+                self._reject("circuit_open", 5, f"{domain} is being probed after failures")
+            state.update(circuit="half_open", probe_started_at=now)
+            return state
+
+        probe = self.store.update(domain, change) is not None
+        return seen["state"], probe
+
+    def _acquire(self, domain, limit, delay, block):
+        """Wait for one of the domain's local slots and for its next allowed start time.
+
+        Without block, gives up with DomainUnavailable once that takes longer than wait_timeout.
+        """
+        deadline = time.monotonic() + self.wait_timeout if not block else math.inf
+        with self._condition:
+            local = self._local.setdefault(domain, {"in_flight": 0, "next_start": 0.0})
+            while local["in_flight"] >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject("busy", self.wait_timeout, f"Too many scrapes of {domain} in flight")
+                self._condition.wait(None if block else remaining)
+            start_at = max(time.monotonic(), local["next_start"])
+            if start_at > deadline:
+                self._reject("crawl_delay", start_at - time.monotonic(), f"{domain} asks for slower crawling")
+            local["in_flight"] += 1
+            local["next_start"] = start_at + delay
+        time.sleep(max(0.0, start_at - time.monotonic()))
+
+    def _release(self, domain):
+        with self._condition:
+            self._local[domain]["in_flight"] -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, url, block=True):
+        """Admit one scrape of url and record how it went.
+
+        Raises DomainUnavailable or RobotsDisallowed instead of admitting it;
+        with block=True, a busy domain or a long Crawl-delay is waited out
+        and only an open circuit is rejected.
+        Only DomainBlocked and NavigationFailed count as the domain's
+        failures; other exceptions (a saturated pool, a crashed or
+        unlaunchable browser, a failed AI call) are ours and not recorded.
+        """
+        domain = url_domain(url)
+        delay = self.min_interval
+        if self.robots:
+            if not self.robots.allowed(url):
+                metrics.DOMAIN_REJECTIONS.labels("robots").inc()
+                raise RobotsDisallowed(f"robots.txt of {domain} disallows {url}")
+            delay = max(delay, self.robots.crawl_delay(url))
+
+        state, probe = self._admit(domain)
+        recorded = False
+        try:
+            with metrics.stage("domain_wait"):
+                self._acquire(domain, 1 if probe else max(self.min_limit, math.floor(state["limit"])), delay, block)
+            admitted = DomainSlot(domain, probe)
+            try:
+                yield admitted
+            except DomainBlocked as e:
+                recorded = True
+                self.record(domain, None, "blocked", str(e), probe)
+                raise
+            except NavigationFailed as e:
+                recorded = True
+                self.record(domain, None, "error", str(e), probe)
+                raise
+            else:
+                recorded = True
+                latency = admitted.latency if admitted.latency is not None else time.perf_counter() - admitted.started
+                self.record(domain, latency, "ok", None, probe)
+            finally:
+                self._release(domain)
+        finally:
+            if probe and not recorded:
+                self._abandon_probe(domain)
+
+    def _abandon_probe(self, domain):
+        """Hand the half-open probe back when it ended without telling anything about the domain.
+
+        The circuit returns to open with its elapsed open_until, so the next
+        scrape becomes the probe instead of everyone waiting probe_timeout.
+        """
+        def change(state):
+            if not state or state["circuit"] != "half_open":
+                return None
+            state.update(circuit="open")
+            return state
+
+        self.store.update(domain, change)
+
+    def record(self, domain, latency, outcome, error=None, probe=False):
+        """Update the domain's limit, failure rate and circuit with one scrape's outcome."""
+        now = time.time()
+        before = {}
+
+        def change(state):
+            state = state or self._new_state(domain)
+            before.update(circuit=state["circuit"], opens=state["opens"])
+            return self._recorded(state, now, latency, outcome, error, probe)
+
+        state = self.store.update(domain, change)
+        if state["opens"] > before["opens"]:
+            print(f"Circuit open for {domain} for {round(state['open_until'] - now)}s after {outcome}: {error}")
+        elif state["circuit"] == "closed" and before["circuit"] != "closed":
+            print(f"Circuit closed for {domain}")
+
+    def _recorded(self, state, now, latency, outcome, error, probe):
+        """state with one scrape's outcome applied."""
+        failed = outcome != "ok"
+        state["requests"] += 1
+        state["error_rate"] = round(0.9 * state["error_rate"] + 0.1 * failed, 4)
+        if failed:
+            state["failures"] += 1
+            state["consecutive_failures"] += 1
+            state["last_failure"] = {"outcome": outcome, "error": error, "at": now}
+            state["limit"] = max(self.min_limit, state["limit"] / 2)
+            tripped = state["consecutive_failures"] >= self.failure_threshold or \
+                state["error_rate"] >= self.max_error_rate
+            if probe or (tripped and state["circuit"] == "closed"):
+                state["opens"] += 1
+                open_for = min(self.max_open_seconds, self.open_seconds * 2 ** (state["opens"] - 1))
+                state.update(circuit="open", open_until=now + open_for)
+        else:
+            state["consecutive_failures"] = 0
+            state["avg_latency"] = round(
+                latency if state["avg_latency"] is None else 0.8 * state["avg_latency"] + 0.2 * latency, 3
+            )
+            if latency > self.latency_target:
+                state["limit"] = max(self.min_limit, state["limit"] * 0.75)
+            else:
+                state["limit"] = min(self.max_limit, state["limit"] + 1 / state["limit"])
+            if probe:
+                state.update(circuit="closed", opens=0, error_rate=0.0)
+        state["limit"] = round(state["limit"], 3)
+        state["updated_at"] = now
+        return state
+
+    def reset(self, domain):
+        """Forget a domain's limit and failures, closing its circuit."""
+        self.store.delete(domain)
+
+    def domains(self):
+        """Health of every known domain, with this process's in-flight scrapes."""
+        with self._condition:
+            in_flight = {domain: local["in_flight"] for domain, local in self._local.items()}
+        states = []
+        for domain in self.store.domains():
+            state = self.store.get(domain)
+            if state:
+                states.append({**state, "in_flight": in_flight.get(domain, 0)})
+        return states
@@ -0,0 +1,86 @@
+"""Stand-in for the Gemini generateContent API, for load tests without the real service.
+
+Run it with `python fake_gemini.py` and start the scraper with
+GEMINI_BASE_URL=http://localhost:8090. FAKE_GEMINI_LATENCY adds a delay per
+call (seconds), and FAKE_GEMINI_ERROR_RATE answers that share of calls with
+a 429 to exercise the retry path.
+"""
+import json
+import os
+import random
+import re
+import time
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+LATENCY = float(os.getenv("FAKE_GEMINI_LATENCY", "0.5"))
+ERROR_RATE = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0"))
+
+
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₽": "RUB"}
+
+
+def fake_product(prompt):
+    """Pull something product-like out of the prompt (HTML or condensed text) so responses vary per page.
+
+    Deterministic, so offline benchmarks can check that the price and name
+    still reach the prompt.
+    """
+    title = re.search(r"<h1[^>]*>(.*?)</h1>", prompt, re.IGNORECASE | re.DOTALL) or \
+        re.search(r"^h1: (.*)$", prompt, re.MULTILINE)
+    price = re.search(r"([$€£¥₽])\s?(\d+(?:[.,]\d{2})?)|(\d+[.,]\d{2})\s?([$€£¥₽])", prompt) or \
+        re.search(r"(\d+[.,]\d{2})", prompt)
+    images = re.findall(r'<img[^>]+src="([^"]+)"', prompt) or re.findall(r"^img \d+x\d+ (\S+)", prompt, re.MULTILINE)
+
+    amount, currency = 9.99, "USD"
+    if price and price.lastindex and price.lastindex > 1:
+        symbol = price.group(1) or price.group(4)
+        amount = float((price.group(2) or price.group(3)).replace(",", "."))
+        currency = CURRENCY_SYMBOLS[symbol]
+    elif price:
+        amount = float(price.group(1).replace(",", "."))
+    return {
+        "product_name": re.sub(r"<[^>]+>", "", title.group(1)).strip() if title else "Fake product",
+        "price": amount,
+        "currency_code": currency,
+        "images": images[:5],
+    }
+
+
+@app.route('/<version>/models/<model>:generateContent', methods=['POST'])
+def generate_content(version, model):
+    time.sleep(LATENCY)
+    if random.random() < ERROR_RATE:
+        return jsonify({"error": {"code": 429, "message": "Resource exhausted", "status": "RESOURCE_EXHAUSTED"}}), 429
+
+    body = request.json
+    prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+    schema = body.get("generationConfig", {}).get("responseSchema", {})
+    if schema.get("type") == "ARRAY":
+        # Batched request: one product per page section
+        parts = re.split(r"=== PAGE (\d+) ===", prompt)[1:]
+        result = [dict(fake_product(section), page=int(page)) for page, section in zip(parts[::2], parts[1::2])]
+    else:
+        result = fake_product(prompt)
+
+    prompt_tokens = len(prompt) // 4 + 1
+    completion = json.dumps(result)
+    completion_tokens = len(completion) // 4 + 1
+    return jsonify({
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": completion}]},
+            "finishReason": "STOP",
+        }],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": completion_tokens,
+            "totalTokenCount": prompt_tokens + completion_tokens,
+        },
+        "modelVersion": model,
+    }), 200
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", "8090")), threaded=True)
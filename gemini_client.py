@@ -0,0 +1,184 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+from google import genai
+from google.genai import errors, types
+
+# Status codes worth retrying: rate limits and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# USD per 1M tokens (Gemini Flash list prices)
+INPUT_PRICE_PER_MILLION = 0.075
+OUTPUT_PRICE_PER_MILLION = 0.30
+
+
+def estimate_cost_usd(prompt_tokens, completion_tokens):
+    input_cost = (prompt_tokens / 1_000_000) * INPUT_PRICE_PER_MILLION
+    output_cost = (completion_tokens / 1_000_000) * OUTPUT_PRICE_PER_MILLION
+    return round(input_cost + output_cost, 6)
+
+
+class TokenBucket:
+    """Refills capacity per minute; acquire() waits until amount is available."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    async def acquire(self, amount):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) * 60 / self.capacity)
+
+    def adjust(self, amount):
+        """Debit (or credit, if negative) the difference between an estimate and actual use."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class GeminiClient:
+    """Long-lived Gemini client shared by every request.
+
+    Calls run on a dedicated asyncio loop over one pooled HTTP connection
+    pool. A semaphore caps concurrent calls, token buckets keep us under the
+    requests/min and tokens/min quota, and 429/5xx responses and timeouts
+    are retried with jittered exponential backoff. base_url can point at a
+    local fake server (see fake_gemini.py) for load tests.
+
+    The underlying genai client is created on the first call, so a missing
+    or invalid API key fails that call (and the caller falls back to manual
+    extraction) instead of the import.
+    """
+
+    def __init__(self, api_key, base_url=None, max_concurrency=8, requests_per_minute=1000,
+                 tokens_per_minute=1_000_000, timeout=30.0, max_retries=3, backoff=1.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self._counters = {"calls": 0, "retries": 0, "failures": 0, "throttled_seconds": 0.0}
+        self._lock = threading.Lock()
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="gemini-client", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._init_async(), self.loop).result()
+        self._client = None
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if not self.api_key:
+                    raise RuntimeError("GOOGLE_GENAI_API_KEY is not set; AI extraction is disabled")
+                self._client = genai.Client(
+                    api_key=self.api_key,
+                    http_options=types.HttpOptions(
+                        base_url=self.base_url,
+                        httpx_async_client=httpx.AsyncClient(
+                            limits=httpx.Limits(
+                                max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency
+                            ),
+                            timeout=self.timeout,
+                        ),
+                    ),
+                )
+            return self._client
+
+    async def _init_async(self):
+        # asyncio primitives are created on the loop that uses them
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._requests = TokenBucket(self.requests_per_minute)
+        self._tokens = TokenBucket(self.tokens_per_minute)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            api_key=os.getenv("GOOGLE_GENAI_API_KEY", ""),
+            base_url=os.getenv("GEMINI_BASE_URL") or None,
+            max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+            requests_per_minute=int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "1000")),
+            tokens_per_minute=int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000")),
+            timeout=float(os.getenv("GEMINI_TIMEOUT", "30")),
+            max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "3")),
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    @staticmethod
+    def estimate_tokens(contents):
+        """Rough prompt size (about four characters per token) used before the real count is known."""
+        characters = sum(len(part.text or "") for content in contents for part in content.parts or [])
+        return characters // 4 + 1
+
+    async def generate_async(self, model, contents, config, timeout=None):
+        estimate = self.estimate_tokens(contents)
+        attempt = 0
+        while True:
+            waited = time.monotonic()
+            await self._requests.acquire(1)
+            await self._tokens.acquire(estimate)
+            self._count("throttled_seconds", time.monotonic() - waited)
+            try:
+                async with self._semaphore:
+                    self._count("calls")
+                    response = await asyncio.wait_for(
+                        self.client.aio.models.generate_content(model=model, contents=contents, config=config),
+                        timeout=timeout or self.timeout,
+                    )
+                usage = getattr(response, "usage_metadata", None)
+                if usage and usage.total_token_count:
+                    self._tokens.adjust(usage.total_token_count - estimate)
+                return response
+            except (errors.APIError, asyncio.TimeoutError, httpx.TransportError) as e:
+                retryable = not isinstance(e, errors.APIError) or e.code in RETRYABLE_STATUS_CODES
+                if not retryable or attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                delay = self.backoff * 2 ** (attempt - 1)
+                await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+    def retry_budget(self, timeout=None):
+        """Longest a call can take with every retry and backoff used, not counting quota waits."""
+        attempts = (self.max_retries + 1) * (timeout or self.timeout)
+        return attempts + sum(self.backoff * 2 ** (attempt - 1) for attempt in range(1, self.max_retries + 1))
+
+    def submit(self, model, contents, config, timeout=None):
+        """Schedule generate_async() on the client loop and return a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(
+            self.generate_async(model, contents, config, timeout=timeout), self.loop
+        )
+
+    def generate(self, model, contents, config, timeout=None):
+        """Blocking wrapper around generate_async() for use from request threads."""
+        return self.submit(model, contents, config, timeout=timeout).result()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 3)
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
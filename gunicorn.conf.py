@@ -0,0 +1,53 @@
+import os
+import signal
+import time
+
+# Each worker process runs its own browser pool, so size the pod for
+# WEB_WORKERS * BROWSER_POOL_SIZE browsers. Threads beyond the pool size
+# serve cache hits, HTTP-tier fetches and fast 503s while every browser is busy.
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", str(4 * int(os.getenv("BROWSER_POOL_SIZE", "2")))))
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+# On SIGTERM in-flight requests and the browser pool drain share this budget before the worker is
+# killed; keep it plus the preStop sleep under the pod's terminationGracePeriodSeconds
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    # Browsers are launched after the fork; Chrome and its CDP loop must not be inherited
+    from app import browser_pool, refresh_scheduler
+
+    browser_pool.start()
+    refresh_scheduler.start()  # Re-queue the saved refresh schedules
+
+    # Start draining as soon as SIGTERM arrives rather than after in-flight requests finish, so readiness
+    # fails right away and background scrapes finish alongside the requests instead of after them
+    exit_handler = signal.getsignal(signal.SIGTERM)
+
+    def drain_on_term(signum, frame):
+        worker.term_received_at = time.monotonic()
+        browser_pool.begin_drain()
+        exit_handler(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain_on_term)
+
+
+def worker_exit(server, worker):
+    # Finish scrapes still running for background jobs and batches, then close the browsers, within
+    # what is left of graceful_timeout since SIGTERM (the master kills the worker when it runs out)
+    from app import browser_pool
+
+    elapsed = time.monotonic() - getattr(worker, "term_received_at", time.monotonic())
+    browser_pool.drain(timeout=max(0, graceful_timeout - elapsed - 5))
+
+
+def child_exit(server, worker):
+    # With several workers, metrics are shared through PROMETHEUS_MULTIPROC_DIR
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,147 @@
+import importlib.util
+import re
+import threading
+
+import httpx
+
+from batch import url_domain
+
+# Desktop Chrome headers; many shops serve a stripped page to unknown clients
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# Status codes and page markers left by Cloudflare, Akamai, DataDome, PerimeterX, Imperva, ...
+BLOCKED_STATUS_CODES = {401, 403, 429, 503}
+BOT_PROTECTION_MARKERS = re.compile(
+    r"cf-browser-verification|challenge-platform|cf_chl_|just a moment\.\.\.|"
+    r"attention required!|_incapsula_resource|datadome|px-captcha|perimeterx|"
+    r"access denied|are you a robot|verify you are human|g-recaptcha|h-captcha|"
+    r"enable javascript and cookies to continue",
+    re.IGNORECASE,
+)
+
+
+# Markers only challenge pages carry, unlike the generic wording above that product pages may use
+CHALLENGE_MARKERS = re.compile(
+    r"cf-browser-verification|cf_chl_opt|/cdn-cgi/challenge-platform/|<title>just a moment\.\.\.</title>|"
+    r"_incapsula_resource|captcha-delivery\.com|px-captcha",
+    re.IGNORECASE,
+)
+
+
+def looks_like_bot_wall(html):
+    """True when a page's HTML looks like a challenge page rather than a product page."""
+    # Challenge pages are small; real product pages mentioning "captcha" are not
+    return len(html) < 50_000 and bool(BOT_PROTECTION_MARKERS.search(html))
+
+
+def looks_like_challenge(html):
+    """True when a page's HTML carries a known bot-protection challenge."""
+    return len(html) < 50_000 and bool(CHALLENGE_MARKERS.search(html))
+
+
+class FetchResult:
+    def __init__(self, url, status_code, html, headers):
+        self.url = url
+        self.status_code = status_code
+        self.html = html
+        self.headers = headers
+
+    @property
+    def blocked(self):
+        """True when the response looks like a bot wall rather than the product page."""
+        return self.status_code in BLOCKED_STATUS_CODES or looks_like_bot_wall(self.html)
+
+
+class HttpFetcher:
+    """Pooled HTTP client for pages that render server-side.
+
+    Connections are kept alive and shared between threads. HTTP/2 and brotli
+    are used when the optional h2 and brotli packages are installed.
+    """
+
+    def __init__(self, timeout=10.0, max_connections=50, max_bytes=5 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.client = httpx.Client(
+            http2=importlib.util.find_spec("h2") is not None,
+            headers=DEFAULT_HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def fetch(self, url, headers=None):
+        """GET url and return a FetchResult, or None if the page is not HTML or too large.
+
+        headers are sent along with the defaults, e.g. If-None-Match for a
+        conditional request, which comes back as a 304 with an empty body.
+        """
+        with self.client.stream("GET", url, headers=headers) as response:
+            if "html" not in response.headers.get("content-type", "html"):
+                return None
+            body = bytearray()
+            for chunk in response.iter_bytes():
+                body.extend(chunk)
+                if len(body) > self.max_bytes:
+                    return None
+            encoding = response.encoding or "utf-8"
+            return FetchResult(
+                str(response.url), response.status_code, body.decode(encoding, errors="replace"), response.headers
+            )
+
+
+class DomainTierMemory:
+    """Remembers per domain whether plain HTTP was enough last time.
+
+    A bot wall sends the domain to the browser at once. Other incomplete
+    HTTP results (no structured product, not HTML) only do so after
+    demote_after of them in a row, since one odd page says little about the
+    domain; an HTTP success starts the count over. Kept in the shared result
+    cache so every replica learns from the others. Entries expire so
+    domains that needed the browser get re-probed later.
+    """
+
+    def __init__(self, cache, ttl=24 * 3600, demote_after=3):
+        self.cache = cache
+        self.ttl = ttl
+        self.demote_after = demote_after
+        self._counters = {"http": 0, "browser": 0, "incomplete": 0}
+        self._lock = threading.Lock()
+
+    def _key(self, url):
+        return f"tier:{url_domain(url)}"
+
+    def _entry(self, url):
+        entry, _ = self.cache.get(self._key(url))
+        if isinstance(entry, str):
+            return {"tier": entry, "incomplete": 0}
+        return entry or {"tier": None, "incomplete": 0}
+
+    def get(self, url):
+        return self._entry(url)["tier"]
+
+    def remember(self, url, tier):
+        self.cache.set(self._key(url), {"tier": tier, "incomplete": 0}, ttl=self.ttl)
+        with self._lock:
+            self._counters[tier] += 1
+
+    def incomplete(self, url):
+        """Count an HTTP result that was not enough; the domain moves to the browser after demote_after in a row."""
+        entry = self._entry(url)
+        entry["incomplete"] += 1
+        with self._lock:
+            self._counters["incomplete"] += 1
+        if entry["incomplete"] >= self.demote_after:
+            self.remember(url, "browser")
+        else:
+            self.cache.set(self._key(url), entry, ttl=self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,226 @@
+import re
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import httpx
+
+from http_fetch import DEFAULT_HEADERS
+
+# Query parameters that only select a rendition (size, crop, quality, format) of the same image.
+# Others, such as Shopify's version "v" or an image id, are kept.
+RENDITION_PARAMS = {
+    "w", "h", "width", "height", "wid", "hei", "size", "sz", "dpr", "q", "qlt", "quality", "fit", "crop",
+    "fm", "fmt", "format", "auto", "resize", "scale", "imwidth", "imheight", "sw", "sh", "sm", "resmode",
+    "ixlib", "trim", "bg", "op_sharpen", "mode",
+}
+
+# Signed URLs stop working when any parameter changes, so their query is left alone
+SIGNATURE_PARAMS = {"s", "sig", "signature", "token", "x-amz-signature", "key-pair-id", "hmac"}
+
+SHOPIFY_VARIANT = re.compile(
+    r"_(?:\d+x\d*|x\d+|pico|icon|thumb|small|compact|medium|large|grande|original|master)"
+    r"(?:_crop_[a-z]+)?(?:@\d+x)?(?=\.[A-Za-z0-9]+$)",
+    re.IGNORECASE,
+)
+CLOUDINARY_PATH = re.compile(r"^(/[^/]+/image/(?:upload|fetch|private|authenticated)/)((?:[a-z]{1,3}_[^/]*/)*)(.*)$")
+AMAZON_MODIFIERS = re.compile(r"\._[^/]*_(?=\.[A-Za-z0-9]+$)")
+WORDPRESS_SIZE = re.compile(r"-\d{2,4}x\d{2,4}(?=\.[A-Za-z0-9]+$)")
+
+
+def _shopify(host, path):
+    # Only product and file uploads carry size suffixes; other names like poster_24x36.jpg are left alone
+    on_cdn = host == "cdn.shopify.com" or path.startswith("/cdn/shop/")
+    return on_cdn and ("/files/" in path or "/products/" in path)
+
+
+def _canonical_path(host, path):
+    """Strip rendition markers that CDNs put in the path, which leaves the original (largest) image."""
+    if _shopify(host, path):
+        return SHOPIFY_VARIANT.sub("", path)
+    if host.endswith("cloudinary.com"):
+        match = CLOUDINARY_PATH.match(path)
+        if match:
+            return match.group(1) + match.group(3)
+    if host.endswith("media-amazon.com") or host.endswith("ssl-images-amazon.com"):
+        return AMAZON_MODIFIERS.sub("", path)
+    if "/wp-content/uploads/" in path:
+        return WORDPRESS_SIZE.sub("", path)
+    return path
+
+
+def _canonical_query(query):
+    params = parse_qsl(query, keep_blank_values=True)
+    if any(key.lower() in SIGNATURE_PARAMS for key, _ in params):
+        return query
+    # Scene7 presets look like $pdp_main$
+    kept = [
+        (key, value) for key, value in params
+        if key.lower() not in RENDITION_PARAMS and not (key.startswith("$") and key.endswith("$"))
+    ]
+    return urlencode(kept)
+
+
+def canonical_image_url(url, base_url):
+    """Absolute URL of the original image behind url, or None if url is not an http(s) image URL."""
+    if not url or url.startswith("data:"):
+        return None
+    parts = urlsplit(urljoin(base_url, url.strip()))
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+    host = parts.netloc.lower()
+    return urlunsplit((parts.scheme, host, _canonical_path(host, parts.path), _canonical_query(parts.query), ""))
+
+
+def canonicalize_image_urls(image_urls, base_url):
+    """Resolve, canonicalize and dedupe image URLs in page order.
+
+    Renditions of one image (srcset widths, CDN resize parameters, size
+    suffixes) collapse into the original, full-size URL at the position
+    where the first of them appeared.
+    """
+    seen = {}
+    for url in image_urls:
+        canonical = canonical_image_url(url, base_url)
+        if canonical:
+            seen.setdefault(canonical, None)
+    return list(seen)
+
+
+def image_dimensions(data):
+    """(width, height) from the first bytes of a PNG, GIF, JPEG, WebP or AVIF file, or None."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        chunk = data[12:16]
+        if chunk == b"VP8 " and len(data) >= 30:
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and len(data) >= 25:
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X" and len(data) >= 30:
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+        return None
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker in (0xD8, 0x01, 0xFF) or 0xD0 <= marker <= 0xD7:
+                i += 1 if marker == 0xFF else 2
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                if len(data) < i + 9:
+                    return None
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return width, height
+            if len(data) < i + 4:
+                return None
+            i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+        return None
+    ispe = data.find(b"ispe")
+    if data[4:8] == b"ftyp" and ispe != -1 and len(data) >= ispe + 16:
+        return struct.unpack(">II", data[ispe + 8:ispe + 16])
+    return None
+
+
+class ImageProber:
+    """Reads the dimensions and byte size of images without downloading them.
+
+    Each image costs one GET for its first max_bytes (a range request; the
+    body is cut off if the server ignores the range), made concurrently over
+    a pooled client. Results are kept in the shared cache.
+    """
+
+    def __init__(self, cache, ttl=7 * 24 * 3600, max_workers=8, timeout=3.0, min_dimension=100,
+                 max_bytes=64 * 1024):
+        self.cache = cache
+        self.ttl = ttl
+        self.min_dimension = min_dimension
+        self.max_bytes = max_bytes
+        self.client = httpx.Client(
+            headers={**DEFAULT_HEADERS, "Accept": "image/avif,image/webp,image/*,*/*;q=0.8"},
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_workers * 2, max_keepalive_connections=max_workers * 2),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-probe")
+        self._counters = {"probed": 0, "cached": 0, "failed": 0, "dropped": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def probe_one(self, url):
+        """{"url", "ok", "width", "height", "bytes", "content_type"} for one image.
+
+        ok is None when the server could not be reached, so the image is not judged.
+        """
+        key = f"imgprobe:{url}"
+        cached, _ = self.cache.get(key)
+        if cached:
+            self._count("cached")
+            return cached
+
+        details = {"url": url, "ok": None, "width": None, "height": None, "bytes": None, "content_type": None}
+        try:
+            with self.client.stream("GET", url, headers={"Range": f"bytes=0-{self.max_bytes - 1}"}) as response:
+                details["ok"] = response.status_code < 400
+                details["content_type"] = response.headers.get("content-type", "").split(";")[0] or None
+                total = response.headers.get("content-range", "").rpartition("/")[2]
+                if total.isdigit():
+                    details["bytes"] = int(total)
+                elif response.status_code == 200 and response.headers.get("content-length", "").isdigit():
+                    details["bytes"] = int(response.headers["content-length"])
+                head = bytearray()
+                if details["ok"]:
+                    for chunk in response.iter_bytes():
+                        head.extend(chunk)
+                        if len(head) >= self.max_bytes:
+                            break
+        except httpx.HTTPError as e:
+            print(f"Image probe failed for {url}: {e}")
+            self._count("failed")
+            return details
+
+        try:
+            dimensions = image_dimensions(bytes(head))
+        except (struct.error, ValueError) as e:
+            print(f"Could not read the dimensions of {url}: {e}")
+            dimensions = None
+        if dimensions:
+            details["width"], details["height"] = dimensions
+
+        self._count("probed")
+        self.cache.set(key, details, ttl=self.ttl)
+        return details
+
+    def rank(self, urls):
+        """Probe urls concurrently; drop broken and icon-sized images, keeping page order.
+
+        Returns the kept URLs and their details, each with a rank (1 = largest area, then bytes).
+        """
+        details = list(self._executor.map(self.probe_one, urls))
+        kept = [
+            item for item in details
+            if item["ok"] is not False and not (
+                item["width"] is not None and min(item["width"], item["height"]) < self.min_dimension
+            )
+        ]
+        self._count("dropped", len(details) - len(kept))
+        ordered = sorted(kept, key=lambda item: ((item["width"] or 0) * (item["height"] or 0), item["bytes"] or 0),
+                         reverse=True)
+        ranks = {id(item): position for position, item in enumerate(ordered, 1)}
+        kept = [{**item, "rank": ranks[id(item)]} for item in kept]
+        return [item["url"] for item in kept], kept
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
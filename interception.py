@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+from fnmatch import fnmatch
+
+import mycdp
+import tldextract
+
+from batch import url_domain
+
+# Blocked on every domain unless allowlisted
+DEFAULT_BLOCKLIST = [
+    "*.css",  # Stylesheets
+    "*.woff", "*.woff2", "*.ttf", "*.eot",  # Fonts
+    "*.mp4", "*.webm", "*.ogg", "*.mkv",  # Videos
+    "*googlesyndication.com*", "*doubleclick.net*", "*adservice.google.*",  # Ads
+    "*google-analytics.com*", "*googletagmanager.com*", "*facebook.net*", "*connect.facebook.*",  # Trackers
+    "*hotjar.com*", "*segment.io*", "*cdn.segment.com*", "*mixpanel.com*", "*amplitude.com*",
+    "*clarity.ms*", "*nr-data.net*", "*criteo.*", "*taboola.com*", "*tiktok.com/i18n/pixel*",
+    "*disqus.com*",  # Widgets
+    "*.gif", "*.1x1.png",  # Tracking pixels
+]
+
+# Third-party hosts that serve the storefront itself and must not be blocked
+DEFAULT_ALLOWLIST = [
+    "*cdn.shopify.com*", "*shopifycdn.com*", "*cdn.jsdelivr.net*", "*unpkg.com*", "*cloudfront.net*",
+    "*akamaized.net*", "*bigcommerce.com*", "*wixstatic.com*", "*squarespace-cdn.com*",
+    "*cdn.salesforce-commerce.com*", "*demandware.*", "*cdn.vtex.com*", "*vteximg.com.br*",
+]
+
+# Typical transfer sizes, used to estimate what blocked requests would have cost
+ESTIMATED_BYTES = {
+    "Script": 40_000, "Stylesheet": 25_000, "Image": 80_000, "Font": 40_000, "Media": 500_000,
+}
+DEFAULT_ESTIMATED_BYTES = 5_000
+
+
+# Public Suffix List snapshot bundled with tldextract; never fetched at runtime
+PUBLIC_SUFFIXES = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+
+
+def site_of(host):
+    """Registrable domain per the Public Suffix List: shop.example.com -> example.com,
+    www.shop.co.uk -> shop.co.uk, shop.myshopify.com -> shop.myshopify.com."""
+    host = host.lower()
+    return PUBLIC_SUFFIXES(host, include_psl_private_domains=True).top_domain_under_public_suffix or host
+
+
+class RequestFilter:
+    """Decides which requests one page load may make."""
+
+    def __init__(self, page_url, blocklist, allowlist, block_third_party_scripts, block_images):
+        self.site = site_of(url_domain(page_url))
+        self.blocklist = blocklist
+        self.allowlist = allowlist
+        self.block_third_party_scripts = block_third_party_scripts
+        self.block_images = block_images
+
+    def should_block(self, url, resource_type):
+        if resource_type == "Document":
+            return False
+        if any(fnmatch(url, pattern) for pattern in self.allowlist):
+            return False
+        if any(fnmatch(url, pattern) for pattern in self.blocklist):
+            return True
+        if resource_type == "Image" and self.block_images:
+            return True
+        if resource_type == "Script" and self.block_third_party_scripts:
+            return site_of(url_domain(url)) != self.site
+        return False
+
+
+class InterceptionRules:
+    """Blocklist, allowlist and switches, with per-domain overrides.
+
+    Overrides come from INTERCEPTION_PROFILES, a JSON object keyed by domain
+    (subdomains match too), e.g.
+    {"example.com": {"allow": ["*analytics*"], "block": ["*chat*"],
+                     "block_third_party_scripts": false, "block_images": "never"}}.
+    "allow" and "block" extend the defaults. block_images is "never",
+    "ai" (only when the AI reads the page, which needs no image layout) or
+    "always".
+    """
+
+    def __init__(self, block_third_party_scripts=True, block_images="ai", overrides=None):
+        self.block_third_party_scripts = block_third_party_scripts
+        self.block_images = block_images
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            block_third_party_scripts=os.getenv("BLOCK_THIRD_PARTY_SCRIPTS", "true").lower() == "true",
+            block_images=os.getenv("BLOCK_IMAGES", "ai"),
+            overrides=json.loads(os.getenv("INTERCEPTION_PROFILES", "{}")),
+        )
+
+    def for_url(self, url, use_ai):
+        blocklist = list(DEFAULT_BLOCKLIST)
+        allowlist = list(DEFAULT_ALLOWLIST)
+        block_third_party_scripts = self.block_third_party_scripts
+        block_images = self.block_images
+        domain = url_domain(url)
+        for key, override in self.overrides.items():
+            if domain == key or domain.endswith("." + key):
+                blocklist += override.get("block", [])
+                allowlist += override.get("allow", [])
+                block_third_party_scripts = override.get("block_third_party_scripts", block_third_party_scripts)
+                block_images = override.get("block_images", block_images)
+        return RequestFilter(
+            url,
+            blocklist,
+            allowlist,
+            block_third_party_scripts,
+            block_images == "always" or (block_images == "ai" and use_ai),
+        )
+
+
+class RequestInterceptor:
+    """Pauses every request of a tab through the CDP Fetch domain and applies a RequestFilter.
+
+    Blocked image requests are failed before any bytes are downloaded, but
+    their URLs are kept so image lists can still be built from them.
+    """
+
+    def __init__(self):
+        self._page = None
+        self._filter = None
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.requests_allowed = 0
+        self.requests_blocked = 0
+        self.estimated_bytes_saved = 0
+        self.blocked_by_type = {}
+        self.image_urls = []
+
+    def attach(self, sb):
+        """Register the RequestPaused handler on the current tab (once per tab).
+
+        Registering it makes the tab enable the Fetch domain, after which every
+        request waits for the handler's answer.
+        """
+        page = sb.cdp.page
+        if page is self._page:
+            return
+        sb.cdp.add_handler(mycdp.fetch.RequestPaused, self._on_paused)
+        self._page = page
+
+    def start(self, request_filter):
+        with self._lock:
+            self._filter = request_filter
+            self._reset_counters()
+
+    def stop(self):
+        """Stop filtering (later requests pass through) and return this page's counters."""
+        with self._lock:
+            self._filter = None
+            return {
+                "requests_allowed": self.requests_allowed,
+                "requests_blocked": self.requests_blocked,
+                "blocked_by_type": dict(self.blocked_by_type),
+                "estimated_bytes_saved": self.estimated_bytes_saved,
+            }
+
+    def _on_paused(self, event, tab=None):
+        url = event.request.url
+        resource_type = event.resource_type.value if event.resource_type else "Other"
+        with self._lock:
+            block = self._filter is not None and self._filter.should_block(url, resource_type)
+            if block:
+                self.requests_blocked += 1
+                self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+                self.estimated_bytes_saved += ESTIMATED_BYTES.get(resource_type, DEFAULT_ESTIMATED_BYTES)
+                if resource_type == "Image":
+                    self.image_urls.append(url)
+            elif self._filter is not None:
+                self.requests_allowed += 1
+        if block:
+            tab.feed_cdp(mycdp.fetch.fail_request(event.request_id, mycdp.network.ErrorReason.BLOCKED_BY_CLIENT))
+        else:
+            tab.feed_cdp(mycdp.fetch.continue_request(event.request_id))
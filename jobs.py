@@ -0,0 +1,183 @@
+import json
+import math
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class MemoryJobStore:
+    """Keeps jobs in this process only. Fine for a single replica."""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+            self._expire()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [k for k, job in self._jobs.items() if job["updated_at"] < cutoff]:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Keeps jobs in a SQLite file so replicas sharing a volume see each other's jobs."""
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, job):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, data, updated_at) VALUES (?, ?, ?)",
+                (job["id"], json.dumps(job), job["updated_at"]),
+            )
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class RedisJobStore:
+    """Keeps jobs in Redis, expiring each one after ttl seconds."""
+
+    def __init__(self, url, ttl=3600):
+        import redis  # Only needed when JOB_STORE points at Redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def put(self, job):
+        self._redis.set(f"job:{job['id']}", json.dumps(job), ex=self.ttl)
+
+    def get(self, job_id):
+        data = self._redis.get(f"job:{job_id}")
+        return json.loads(data) if data else None
+
+
+def job_store_from_url(url, ttl=3600):
+    """Build a store from "memory", "sqlite:///path/to/jobs.db" or "redis://host:port/db"."""
+    if not url or url == "memory":
+        return MemoryJobStore(ttl=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisJobStore(url, ttl=ttl)
+    raise ValueError(f"Unsupported job store: {url}")
+
+
+class JobQueue:
+    """Bounded in-process queue that runs handler(**params) on worker threads.
+
+    Job state lives in the store, so GET /jobs/<id> can be answered by any
+    replica that shares it.
+    """
+
+    def __init__(self, handler, store, workers=2, max_size=100):
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._avg_duration = 10.0  # Seconds; refined as jobs complete
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def retry_after(self):
+        """Rough number of seconds until a queue slot frees up."""
+        # A slot opens whenever any worker finishes its current job
+        return max(1, math.ceil(self._avg_duration / max(self.workers, 1)))
+
+    def submit(self, **params):
+        """Queue a job and return its record, or raise QueueFull."""
+        self.start()
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "params": params,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.put(job)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            job.update(status="rejected", updated_at=time.time())
+            self.store.put(job)
+            raise QueueFull(self.retry_after())
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "workers": self.workers,
+            "avg_duration_seconds": round(self._avg_duration, 2),
+        }
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            started = time.time()
+            job.update(status="running", updated_at=started)
+            self.store.put(job)
+            try:
+                job["result"] = self.handler(**job["params"])
+                job["status"] = "done"
+            except Exception as e:
+                job["error"] = str(e)
+                job["status"] = "failed"
+            finished = time.time()
+            job["updated_at"] = finished
+            self.store.put(job)
+            with self._lock:
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * (finished - started)
@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from google.genai import types
+
+from gemini_client import estimate_cost_usd
+
+
+class _Pending:
+    def __init__(self, html):
+        self.html = html
+        self.tokens = len(html) // 4 + 1
+        self.future = Future()
+
+
+class LLMBatcher:
+    """Sends the HTML of several pages to Gemini in one call.
+
+    Pages submitted within window seconds of each other are grouped until
+    max_items pages or max_tokens (estimated) prompt tokens are collected, so
+    the instruction and schema are sent once per batch instead of once per
+    page. The model answers with an array tagged by page number and each
+    caller gets its own product back.
+
+    extract() returns None when a page was not batched or its item was
+    missing or invalid, so the caller can fall back to a single call
+    without the rest of the batch failing. It waits for its batch at most
+    timeout seconds, never less than the client needs for all its retries,
+    and raises TimeoutError after that.
+    """
+
+    def __init__(self, client, model, instruction, item_schema, window=0.2, max_items=8,
+                 max_tokens=100_000, timeout=None):
+        self.client = client
+        self.model = model
+        self.instruction = instruction
+        self.window = window
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.timeout = max(timeout or 0, client.retry_budget())
+        self.config = types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+            response_mime_type="application/json",
+            response_schema=types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(
+                    type=types.Type.OBJECT,
+                    required=["page"] + list(item_schema.required or []),
+                    properties={"page": types.Schema(type=types.Type.INTEGER), **item_schema.properties},
+                ),
+            ),
+        )
+        self._pending = []
+        self._pending_tokens = 0
+        self._first_at = None
+        self._cond = threading.Condition()
+        self._counters = {"batches": 0, "items": 0, "item_failures": 0, "batch_failures": 0, "timeouts": 0,
+                          "saved_tokens": 0}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._dispatch, name="llm-batcher", daemon=True).start()
+
+    @classmethod
+    def from_env(cls, client, model, instruction, item_schema):
+        return cls(
+            client, model, instruction, item_schema,
+            window=float(os.getenv("LLM_BATCH_WINDOW", "0.2")),
+            max_items=int(os.getenv("LLM_BATCH_MAX_ITEMS", "8")),
+            max_tokens=int(os.getenv("LLM_BATCH_MAX_TOKENS", "100000")),
+            timeout=float(os.getenv("LLM_BATCH_TIMEOUT", "0")) or None,
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def extract(self, html):
+        """Queue html for the next batch and wait for its product, or None to use a single call."""
+        item = _Pending(html)
+        if item.tokens >= self.max_tokens:
+            return None
+        with self._cond:
+            if self._pending_tokens + item.tokens > self.max_tokens:
+                self._flush()
+            self._pending.append(item)
+            self._pending_tokens += item.tokens
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            if len(self._pending) >= self.max_items:
+                self._flush()
+            self._cond.notify()
+        try:
+            return item.future.result(timeout=self.window + self.timeout)
+        except FutureTimeoutError:
+            self._count("timeouts")
+            raise
+
+    def _dispatch(self):
+        """Flush the pending items once the oldest has waited window seconds."""
+        with self._cond:
+            while True:
+                if self._first_at is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._first_at + self.window - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._flush()
+
+    def _flush(self):
+        # Called with self._cond held
+        items = self._pending
+        self._pending = []
+        self._pending_tokens = 0
+        self._first_at = None
+        if not items:
+            return
+        if len(items) == 1:
+            # Nothing to share the prompt with; a plain call is cheaper
+            items[0].future.set_result(None)
+            return
+
+        sections = [f"=== PAGE {index} ===\n{item.html}" for index, item in enumerate(items)]
+        prompt = (
+            f"{self.instruction}. The HTML of {len(items)} different pages follows, each after a "
+            f"'=== PAGE n ===' header. Return one object per page, in page order, with its page number in 'page'.\n\n"
+            + "\n\n".join(sections)
+        )
+        contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+        future = self.client.submit(self.model, contents, self.config)
+        future.add_done_callback(lambda done: self._resolve(items, prompt, done))
+
+    def _resolve(self, items, prompt, done):
+        self._count("batches")
+        self._count("items", len(items))
+        try:
+            response = done.result()
+            products = json.loads(response.text)
+            if not isinstance(products, list):
+                raise ValueError("batched response is not an array")
+        except Exception as e:
+            print(f"Batched AI extraction of {len(items)} pages failed: {e}")
+            self._count("batch_failures")
+            for item in items:
+                item.future.set_result(None)
+            return
+
+        by_page = {}
+        for position, product in enumerate(products):
+            if not isinstance(product, dict):
+                continue
+            page = product.pop("page", None)
+            if page is None and len(products) == len(items):
+                page = position
+            by_page.setdefault(page, product)
+
+        usage = response.usage_metadata
+        prompt_tokens = (usage.prompt_token_count or 0) if usage else 0
+        completion_tokens = (usage.candidates_token_count or 0) if usage else 0
+        # Split the measured prompt tokens by characters between the pages and
+        # the rest of the batch prompt (instruction, headers). A single call
+        # per page would have sent "<instruction>:\n" with each page instead.
+        scale = prompt_tokens / len(prompt) if prompt else 0
+        page_tokens = [len(item.html) * scale for item in items]
+        batch_overhead = prompt_tokens - sum(page_tokens)
+        single_overhead = len(f"{self.instruction}:\n") * scale
+        saved_tokens = round((single_overhead * len(items) - batch_overhead) / len(items))
+        overhead_share = batch_overhead / len(items)
+        output_sizes = {page: len(json.dumps(product)) for page, product in by_page.items()}
+        total_output = sum(output_sizes.values()) or 1
+
+        for index, item in enumerate(items):
+            product = by_page.get(index)
+            if not product or not product.get("product_name"):
+                self._count("item_failures")
+                item.future.set_result(None)
+                continue
+            item_prompt = round(overhead_share + page_tokens[index])
+            item_completion = round(completion_tokens * output_sizes[index] / total_output)
+            product["_token_usage"] = {
+                "prompt_tokens": item_prompt,
+                "completion_tokens": item_completion,
+                "total_tokens": item_prompt + item_completion,
+                "estimated_cost_usd": estimate_cost_usd(item_prompt, item_completion),
+                "batch_size": len(items),
+                "saved_tokens": saved_tokens,
+                "saved_cost_usd": estimate_cost_usd(saved_tokens, 0),
+            }
+            self._count("saved_tokens", saved_tokens)
+            item.future.set_result(product)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["avg_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else 0
+        return stats
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Scrapes take from tens of milliseconds (cache, HTTP tier) to tens of seconds (slow shops)
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "scraper_stage_seconds", "Time spent in each stage of a scrape", ["stage"], buckets=STAGE_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    "scraper_cache_lookups_total", "Result and LLM cache lookups by outcome", ["cache", "result"]
+)
+EXTRACTIONS = Counter(
+    "scraper_extractions_total", "Scrapes by extraction method and fetch tier", ["extracted_with", "fetched_with"]
+)
+GEMINI_TOKENS = Counter(
+    "scraper_gemini_tokens_total", "Gemini tokens spent", ["model", "domain", "kind"]
+)
+GEMINI_COST = Counter(
+    "scraper_gemini_cost_usd_total", "Estimated Gemini spend in USD", ["model", "domain"]
+)
+DOMAIN_REJECTIONS = Counter(
+    "scraper_domain_rejections_total", "Scrapes refused by per-domain limits", ["reason"]
+)
+BUNDLE_INSTALLS = Counter(
+    "scraper_extraction_bundle_installs_total",
+    "Pages the extraction bundle was sent to because its init script had not run",
+)
+
+_current = threading.local()
+
+
+class Timings:
+    """Seconds per stage for one scrape; repeated stages add up."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = round(self.stages.get(name, 0) + seconds, 4)
+
+
+@contextmanager
+def collect(timings):
+    """Also record the stages timed on this thread into timings."""
+    previous = getattr(_current, "timings", None)
+    _current.timings = timings
+    try:
+        yield timings
+    finally:
+        _current.timings = previous
+
+
+def observe(name, seconds):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = getattr(_current, "timings", None)
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def record_token_usage(model, domain, usage):
+    """Count the tokens and cost of one AI extraction (cache hits count as zero)."""
+    GEMINI_TOKENS.labels(model, domain, "prompt").inc(usage.get("prompt_tokens") or 0)
+    GEMINI_TOKENS.labels(model, domain, "completion").inc(usage.get("completion_tokens") or 0)
+    GEMINI_COST.labels(model, domain).inc(usage.get("estimated_cost_usd") or 0)
+
+
+class PoolCollector:
+    """Browser slot gauges read from BrowserPool.stats() at scrape time."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def collect(self):
+        stats = self.pool.stats()
+        browsers = GaugeMetricFamily("scraper_browsers", "Pooled browsers by state", labels=["state"])
+        for state in ("busy", "idle", "starting", "dead"):
+            browsers.add_metric([state], stats[state])
+        yield browsers
+        yield GaugeMetricFamily("scraper_browser_leases_pending", "Leases running or queued", value=stats["pending"])
+        yield GaugeMetricFamily(
+            "scraper_browser_capacity", "Leases admitted before requests are rejected", value=stats["capacity"]
+        )
+
+
+def render():
+    """Metrics in the Prometheus text format, merged across gunicorn workers in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
@@ -0,0 +1,496 @@
+import json
+
+import mycdp
+
+import metrics
+
+# Every in-page extraction step in one bundle. It is registered once per tab
+# with Page.addScriptToEvaluateOnNewDocument in the EXTRACTION_WORLD isolated
+# world, so each page already has __ecomExtract there and a scrape only sends
+# a short call naming the sections it needs, instead of resending and
+# recompiling the scripts. The isolated world shares the page's DOM but not
+# its JavaScript globals, so page scripts can neither see nor call it.
+EXTRACTION_WORLD = "ecom-extract"
+
+EXTRACTION_BUNDLE = """
+(() => {
+    if (window.__ecomExtract) return window.__ecomExtract;
+
+    function getBestSrcFromSrcset(srcset) {
+        if (!srcset) return null;
+
+        // Parse the srcset attribute
+        const srcsetParts = srcset.split(',').map(part => {
+            const [url, width] = part.trim().split(/\\s+/);
+            // Extract numeric width (remove the 'w')
+            const numWidth = width ? parseInt(width.replace('w', '')) : 0;
+            return { url, width: numWidth };
+        });
+
+        // Sort by width (descending) and return the largest image
+        srcsetParts.sort((a, b) => b.width - a.width);
+        return srcsetParts.length > 0 ? srcsetParts[0].url : null;
+    }
+
+    // Visible, non-icon images plus the largest srcset candidate of each
+    const collectImages = () => Array.from(document.querySelectorAll('img'))
+        .filter(img => {
+            // Check if image is visible
+            const rect = img.getBoundingClientRect();
+            const style = window.getComputedStyle(img);
+
+            // Minimum dimensions for non-icon/logo images (in pixels)
+            const MIN_WIDTH = 100;
+            const MIN_HEIGHT = 100;
+            const MIN_AREA = 10000; // width * height
+
+            // Calculate actual dimensions
+            const area = rect.width * rect.height;
+
+            return rect.width >= MIN_WIDTH && 
+                   rect.height >= MIN_HEIGHT && 
+                   area >= MIN_AREA &&
+                   style.display !== 'none' && 
+                   style.visibility !== 'hidden' &&
+                   parseFloat(style.opacity) > 0;
+        })
+        .flatMap(img => {
+            const urls = [];
+
+            // Get the src attribute
+            if (img.src) {
+                urls.push(img.src);
+            }
+
+            // Get the best image from srcset if available
+            const srcset = img.getAttribute('srcset') || img.dataset.srcset;
+            if (srcset) {
+                const bestSrc = getBestSrcFromSrcset(srcset);
+                if (bestSrc) {
+                    urls.push(bestSrc);
+                }
+            }
+
+            return urls;
+        });
+
+    // OpenGraph and named meta tags
+    const collectMetadata = () => {
+        const metaTags = document.querySelectorAll('meta[property^="og:"], meta[name]');
+        const metadata = {};
+        metaTags.forEach(meta => {
+            const key = meta.getAttribute('property') || meta.getAttribute('name');
+            const value = meta.getAttribute('content');
+            if (key && value) {
+                metadata[key] = value;
+            }
+        });
+        return metadata;
+    };
+
+    // JSON-LD blocks, schema.org Product microdata and all meta tags
+    const collectStructuredData = () => {
+        const jsonLd = Array.from(document.querySelectorAll('script[type="application/ld+json"]'))
+            .map(script => script.textContent);
+
+        const itemValue = (el) => el.getAttribute('content') || el.getAttribute('src') ||
+            el.getAttribute('href') || (el.textContent || '').trim();
+
+        const microdata = Array.from(document.querySelectorAll('[itemscope][itemtype*="schema.org/Product"]'))
+            .map(item => {
+                const properties = {};
+                // Includes nested scopes such as offers, which carry price and currency
+                item.querySelectorAll('[itemprop]').forEach(el => {
+                    const name = el.getAttribute('itemprop');
+                    if (el.hasAttribute('itemscope')) return;
+                    (properties[name] = properties[name] || []).push(itemValue(el));
+                });
+                return { type: item.getAttribute('itemtype'), properties };
+            });
+
+        const meta = {};
+        document.querySelectorAll('meta[property], meta[name]').forEach(el => {
+            const key = el.getAttribute('property') || el.getAttribute('name');
+            const value = el.getAttribute('content');
+            if (key && value && !(key in meta)) {
+                meta[key] = value;
+            }
+        });
+
+        return { json_ld: jsonLd, microdata, meta };
+    };
+
+    // Only the HTML relevant to the product, without scripts, styles, tracking, etc.
+    const cleanHtml = () => {
+        // Clone the document to avoid modifying the actual page
+        const clonedDoc = document.cloneNode(true);
+
+        // Remove script tags
+        const scripts = clonedDoc.querySelectorAll('script');
+        scripts.forEach(script => script.remove());
+
+        // Remove style tags
+        const styles = clonedDoc.querySelectorAll('style');
+        styles.forEach(style => style.remove());
+
+        // Remove link tags (stylesheets)
+        const links = clonedDoc.querySelectorAll('link[rel="stylesheet"]');
+        links.forEach(link => link.remove());
+
+        // Remove comments
+        const removeComments = (node) => {
+            for (let i = node.childNodes.length - 1; i >= 0; i--) {
+                const child = node.childNodes[i];
+                if (child.nodeType === 8) { // Comment node
+                    child.remove();
+                } else if (child.nodeType === 1) { // Element node
+                    removeComments(child);
+                }
+            }
+        };
+        removeComments(clonedDoc);
+
+        // Remove common non-content elements
+        const selectorsToRemove = [
+            'iframe',
+            'noscript',
+            'svg:not([data-product-image])', // Keep product image SVGs
+            'path',
+            'defs',
+            '.analytics-*',
+            '[class*="tracking"]',
+            '[class*="analytics"]',
+            '[id*="tracking"]',
+            '[id*="analytics"]',
+            '.cookie-*',
+            '[class*="cookie"]',
+            '.gdpr-*',
+            '[class*="gdpr"]',
+            'footer',
+            'header nav', // Keep header but remove navigation
+            '.navigation',
+            '.menu',
+            '.sidebar:not(.product-sidebar)',
+            '.advertisement',
+            '.ads',
+            '[class*="banner"]:not([class*="product"])',
+            '.popup',
+            '.modal:not(.product-modal)',
+            '.overlay:not(.product-overlay)',
+            '.social-share',
+            '.social-media',
+            '[class*="facebook"]',
+            '[class*="twitter"]',
+            '[class*="instagram"]',
+            '[class*="pinterest"]',
+            '.newsletter',
+            '.subscription',
+            '.related-products',
+            '.recommended-products',
+            '.recently-viewed',
+            '.reviews:not(.product-reviews)',
+            '.comments:not(.product-comments)',
+            '.chat-widget',
+            '[id*="chat"]',
+            '.help-widget'
+        ];
+
+        selectorsToRemove.forEach(selector => {
+            try {
+                const elements = clonedDoc.querySelectorAll(selector);
+                elements.forEach(el => el.remove());
+            } catch (e) {
+                // Ignore selector errors
+            }
+        });
+
+        // Remove all inline styles and unnecessary attributes
+        const allElements = clonedDoc.querySelectorAll('*');
+        allElements.forEach(el => {
+            el.removeAttribute('style');
+            el.removeAttribute('onclick');
+            el.removeAttribute('onload');
+            el.removeAttribute('onerror');
+            el.removeAttribute('onmouseover');
+            el.removeAttribute('onmouseout');
+            el.removeAttribute('data-analytics');
+            el.removeAttribute('data-tracking');
+
+            // Remove data attributes except for product-related ones
+            const attrs = Array.from(el.attributes);
+            attrs.forEach(attr => {
+                if (attr.name.startsWith('data-') && 
+                    !attr.name.includes('product') && 
+                    !attr.name.includes('price') && 
+                    !attr.name.includes('image') &&
+                    !attr.name.includes('name') &&
+                    !attr.name.includes('sku') &&
+                    !attr.name.includes('currency')) {
+                    el.removeAttribute(attr.name);
+                }
+            });
+        });
+
+        // Keep only essential HTML structure with product-related content
+        let html = clonedDoc.documentElement.outerHTML;
+
+        // Remove excessive whitespace
+        html = html.replace(/\\s+/g, ' ').replace(/> </g, '><').trim();
+
+        // Limit the HTML size (take first 50KB)
+        const maxLength = 50000;
+        if (html.length > maxLength) {
+            // Try to find the main product container first
+            const productSelectors = [
+                '.product-container',
+                '.product-details',
+                '.product-info',
+                '.product-main',
+                '[class*="product-page"]',
+                '[id*="product-container"]',
+                'main[role="main"]',
+                'main',
+                '.content',
+                '#content'
+            ];
+
+            for (const selector of productSelectors) {
+                const productElement = clonedDoc.querySelector(selector);
+                if (productElement) {
+                    html = productElement.outerHTML;
+                    if (html.length <= maxLength) {
+                        break;
+                    }
+                }
+            }
+
+            // If still too long, truncate
+            if (html.length > maxLength) {
+                html = html.substring(0, maxLength) + '...';
+            }
+        }
+
+        return html;
+    };
+
+    const PRICE = /(?:[$€£¥₹₽₩₺]|\\b(?:USD|EUR|GBP|JPY|CNY|RUB|INR|CAD|AUD|CHF|SEK|NOK|DKK|PLN|CZK|BRL|MXN|TRY|KRW)\\b)\\s?\\d|\\d[\\d.,]*\\s?(?:[$€£¥₹₽₩₺]|\\b(?:USD|EUR|GBP|JPY|CNY|RUB|INR|CAD|AUD|CHF|SEK|NOK|DKK|PLN|CZK|BRL|MXN|TRY|KRW)\\b|руб|zł|kr\\b|kč)/i;
+    const CURRENCY = /[$€£¥₹₽₩₺]|\\b(?:USD|EUR|GBP|JPY|CNY|RUB|INR|CAD|AUD|CHF|SEK|NOK|DKK|PLN|CZK|BRL|MXN|TRY|KRW)\\b/;
+    const ADD_TO_CART = /add to (?:cart|bag|basket)|buy (?:it )?now|in den warenkorb|ajouter au panier|añadir al carrito|aggiungi al carrello|в корзину|do koszyka/i;
+    const PRODUCT_HINT = /product|price|sku|gallery|offer|variant|buy/i;
+    const NOISE = 'nav, footer, [role="navigation"], [role="contentinfo"], [class*="menu" i], [class*="cookie" i], ' +
+        '[class*="newsletter" i], [class*="breadcrumb" i], [class*="related" i], [class*="recommend" i]';
+    const BLOCK_TAGS = new Set(['P', 'LI', 'H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'DIV', 'SECTION', 'ARTICLE', 'MAIN',
+        'ASIDE', 'HEADER', 'FOOTER', 'NAV', 'TD', 'TH', 'DD', 'DT', 'BUTTON', 'LABEL', 'FIGURE', 'FIGCAPTION', 'FORM',
+        'SELECT', 'TABLE', 'TR', 'UL', 'OL', 'DL', 'SUMMARY', 'DETAILS', 'BLOCKQUOTE']);
+    const SKIP_TAGS = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE', 'SVG', 'IFRAME', 'OBJECT', 'CANVAS', 'LINK']);
+
+    // The page as short text lines ("h1: ...", "img 800x800 https://..."), keeping the
+    // blocks that look most like the product until options.token_budget is spent
+    const condensePage = (options) => {
+        const budget = ((options && options.token_budget) || 6000) * 4;  // ~4 characters per token
+        const blocks = [];
+        const blockFor = new Map();
+        const blockOf = (el) => {
+            let node = el;
+            while (node && node !== document.body && !BLOCK_TAGS.has(node.tagName)) node = node.parentElement;
+            node = node || document.body;
+            let block = blockFor.get(node);
+            if (!block) {
+                block = { el: node, tag: node.tagName.toLowerCase(), parts: [], images: [], linkChars: 0 };
+                blockFor.set(node, block);
+                blocks.push(block);
+            }
+            return block;
+        };
+
+        const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, {
+            acceptNode: (node) => {
+                if (node.nodeType === 3) return NodeFilter.FILTER_ACCEPT;
+                if (SKIP_TAGS.has(node.tagName.toUpperCase())) return NodeFilter.FILTER_REJECT;
+                // display: none (but display: contents has no boxes either and its children still
+                // render, and <option> and microdata <meta> never have boxes)
+                if (!node.getClientRects().length && !['OPTION', 'META'].includes(node.tagName) &&
+                    window.getComputedStyle(node).display !== 'contents') return NodeFilter.FILTER_REJECT;
+                return NodeFilter.FILTER_ACCEPT;
+            },
+        });
+        for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+            if (node.nodeType === 3) {
+                const text = node.nodeValue.replace(/\\s+/g, ' ').trim();
+                if (!text) continue;
+                const block = blockOf(node.parentElement);
+                block.parts.push(text);
+                if (node.parentElement.closest('a')) block.linkChars += text.length;
+                continue;
+            }
+            if (node.tagName === 'IMG') {
+                const src = getBestSrcFromSrcset(node.getAttribute('srcset') || node.dataset.srcset) ||
+                    node.currentSrc || node.src || node.dataset.src;
+                const rect = node.getBoundingClientRect();
+                if (src && !src.startsWith('data:')) {
+                    blockOf(node.parentElement).images.push({
+                        src, width: Math.round(rect.width), height: Math.round(rect.height), alt: node.alt || '',
+                    });
+                }
+                continue;
+            }
+            // Values that are only in attributes: schema.org content, data-price, button labels
+            const itemprop = node.getAttribute('itemprop');
+            if (itemprop && node.hasAttribute('content')) {
+                blockOf(node).parts.push(`[${itemprop}=${node.getAttribute('content')}]`);
+            }
+            for (const attr of node.attributes) {
+                if (/^data-.*(price|currency|sku)/.test(attr.name) && attr.value && attr.value.length < 40) {
+                    blockOf(node).parts.push(`[${attr.name}=${attr.value}]`);
+                }
+            }
+            if (node.tagName === 'BUTTON' && node.getAttribute('aria-label')) {
+                blockOf(node).parts.push(node.getAttribute('aria-label'));
+            }
+        }
+
+        const viewport = window.innerHeight || 800;
+        const cartIndexes = [];
+        const candidates = blocks.map((block, index) => {
+            const text = block.parts.join(' ').slice(0, 400);
+            const lines = [];
+            if (text) lines.push(`${block.tag}: ${text}`);
+            block.images.forEach(img => lines.push(
+                `img ${img.width}x${img.height} ${img.src}` + (img.alt ? ` alt="${img.alt.slice(0, 80)}"` : '')
+            ));
+
+            let score = 0;
+            if (PRICE.test(text)) score += 6;
+            else if (CURRENCY.test(text)) score += 2;
+            if (ADD_TO_CART.test(text)) {
+                score += 5;
+                cartIndexes.push(index);
+            }
+            if (block.tag === 'h1') score += 8;
+            else if (block.tag === 'h2' || block.tag === 'h3') score += 1;
+            const hints = [block.el, block.el.parentElement].filter(Boolean)
+                .map(el => `${el.getAttribute('class') || ''} ${el.id} ${el.getAttribute('itemprop') || ''}`)
+                .join(' ');
+            if (PRODUCT_HINT.test(hints)) score += 3;
+            score += Math.min(block.images.filter(img => img.width * img.height >= 40000).length * 4, 8);
+            if (block.el.getBoundingClientRect().top < viewport * 1.5) score += 1;
+            if (block.el.closest(NOISE)) score -= 6;
+            if (text && block.linkChars / text.length > 0.7) score -= 2;
+            return { index, lines, score, size: lines.join('\\n').length };
+        }).filter(candidate => candidate.lines.length);
+
+        // Blocks near the add-to-cart button usually hold the price and variant details
+        candidates.forEach(candidate => {
+            const distance = Math.min(...cartIndexes.map(i => Math.abs(i - candidate.index)), Infinity);
+            if (distance <= 10) candidate.score += (10 - distance) / 2;
+        });
+
+        const head = [`title: ${document.title}`];
+        document.querySelectorAll('meta[property^="og:"], meta[property^="product:"], meta[name="description"]')
+            .forEach(meta => head.push(`meta ${meta.getAttribute('property') || meta.getAttribute('name')}: ${meta.content}`));
+        document.querySelectorAll('script[type="application/ld+json"]').forEach(script => {
+            if (/Product|Offer/.test(script.textContent)) {
+                head.push(`json-ld: ${script.textContent.replace(/\\s+/g, ' ').trim().slice(0, 3000)}`);
+            }
+        });
+        let headText = head.join('\\n').slice(0, Math.floor(budget / 4));
+        let used = headText.length;
+
+        const seen = new Set();
+        const kept = [];
+        candidates
+            .filter(candidate => candidate.score >= 0)
+            .sort((a, b) => b.score - a.score || a.index - b.index)
+            .forEach(candidate => {
+                const key = candidate.lines.join('\\n');
+                if (seen.has(key) || used + candidate.size + 1 > budget) return;
+                seen.add(key);
+                kept.push(candidate);
+                used += candidate.size + 1;
+            });
+        kept.sort((a, b) => a.index - b.index);
+        return headText + '\\n---\\n' + kept.map(candidate => candidate.lines.join('\\n')).join('\\n');
+    };
+
+    const sections = {
+        images: collectImages,
+        metadata: collectMetadata,
+        structured_data: collectStructuredData,
+        html: cleanHtml,
+        condensed: condensePage,
+    };
+    const extract = (names, options) => Object.fromEntries(names.map(name => [name, sections[name](options || {})]));
+
+    // Lives in the isolated world's global; not enumerable or writable in case it runs in the main world
+    Object.defineProperty(window, '__ecomExtract', { value: extract, enumerable: false, writable: false });
+    return extract;
+})()
+"""
+
+SECTIONS = ("images", "metadata", "structured_data", "html", "condensed")
+
+
+def _send(sb, command):
+    # Same CDP session as the tab's init scripts; an isolated world is only
+    # shared with the init script when it is created on that session
+    return sb.cdp.loop.run_until_complete(sb.cdp.page.send(command))
+
+
+def _evaluate(sb, expression, context_id):
+    result, _ = _send(sb, mycdp.runtime.evaluate(expression, context_id=context_id, return_by_value=True))
+    return result.value
+
+
+def extraction_context(sb):
+    """Execution context of EXTRACTION_WORLD in the current document's main frame.
+
+    Chrome keeps one isolated world per name and frame for the session that
+    registered the init script, so this is the world it already ran in.
+    """
+    frame_id = _send(sb, mycdp.page.get_frame_tree()).frame.id_
+    return _send(sb, mycdp.page.create_isolated_world(frame_id, world_name=EXTRACTION_WORLD))
+
+
+def run_page_extraction(sb, sections, options=None, context_id=None):
+    """Run the named bundle sections on the current page in one call, in the isolated world."""
+    if context_id is None:
+        context_id = extraction_context(sb)
+    args = f"{json.dumps(list(sections))}, {json.dumps(options or {})}"
+    call = f"window.__ecomExtract ? window.__ecomExtract({args}) : null"
+    result = _evaluate(sb, call, context_id)
+    if result is None:
+        # The bundle was not injected into this document (e.g. it was opened
+        # before the tab registered it), so install it now and retry. Counted
+        # so a rise shows the init script is no longer reaching the pages.
+        metrics.BUNDLE_INSTALLS.inc()
+        _evaluate(sb, EXTRACTION_BUNDLE, context_id)
+        result = _evaluate(sb, call, context_id)
+    return result
+
+
+class PageData:
+    """Lazily fetched extraction results for the page loaded in sb.
+
+    prefetch() gets several sections in a single round trip; any section
+    read later that was not fetched costs one more short call.
+    """
+
+    def __init__(self, sb, options=None):
+        self.sb = sb
+        self.options = options or {}
+        self._sections = {}
+        self._context_id = None
+
+    def prefetch(self, *sections):
+        missing = [section for section in sections if section not in self._sections]
+        if missing:
+            stage = "html_cleaning" if {"html", "condensed"} & set(missing) else "extraction_js"
+            with metrics.stage(stage):
+                if self._context_id is None:
+                    self._context_id = extraction_context(self.sb)
+                self._sections.update(run_page_extraction(self.sb, missing, self.options, self._context_id))
+        return self
+
+    def __getitem__(self, section):
+        self.prefetch(section)
+        return self._sections[section]
@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+
+from batch import url_domain
+from structured_data import parse_price
+
+# Finds the elements that hold the AI-extracted name, price and images and
+# returns a CSS selector for each that uniquely matches on this page.
+DERIVE_PROFILE_SCRIPT = """
+(({name, price, images}) => {
+    const normalize = (text) => (text || '').replace(/\\s+/g, ' ').trim().toLowerCase();
+    const stableClass = (cls) => cls && !/\\d{3,}|[A-Za-z0-9]{8,}_|^(is-|has-|active|selected|hover)/.test(cls);
+
+    const selectorFor = (el) => {
+        const parts = [];
+        for (let node = el; node && node.nodeType === 1 && node !== document.documentElement; node = node.parentElement) {
+            if (node.id && !/\\d{3,}/.test(node.id)) {
+                parts.unshift('#' + CSS.escape(node.id));
+                break;
+            }
+            const itemprop = node.getAttribute('itemprop');
+            let part = node.tagName.toLowerCase();
+            if (itemprop) {
+                part += `[itemprop="${itemprop}"]`;
+            } else {
+                const classes = Array.from(node.classList).filter(stableClass).slice(0, 2);
+                part += classes.map(cls => '.' + CSS.escape(cls)).join('');
+            }
+            parts.unshift(part);
+            const selector = parts.join(' > ');
+            try {
+                if (document.querySelectorAll(selector).length === 1) return selector;
+            } catch (e) {}
+            if (parts.length >= 6) break;
+        }
+        return null;
+    };
+
+    // Deepest element whose whole text matches, preferring ones that look like the field
+    const bestMatch = (matches, hint) => {
+        const scored = Array.from(document.body.querySelectorAll('*'))
+            .filter(el => !['SCRIPT', 'STYLE', 'NOSCRIPT', 'TITLE'].includes(el.tagName) && matches(el))
+            .map(el => {
+                const label = (el.className + ' ' + el.id + ' ' + (el.getAttribute('itemprop') || '')).toLowerCase();
+                return { el, score: (hint.test(label) || hint.test(el.tagName) ? 100 : 0) - el.querySelectorAll('*').length };
+            });
+        scored.sort((a, b) => b.score - a.score);
+        return scored.length ? selectorFor(scored[0].el) : null;
+    };
+
+    const selectors = {};
+    if (name) {
+        const target = normalize(name);
+        selectors.product_name = bestMatch(el => normalize(el.textContent) === target, /name|title|h1/i);
+    }
+    if (price !== null && price !== undefined) {
+        const number = Number(price);
+        const variants = new Set([
+            number.toFixed(2), number.toFixed(2).replace('.', ','), String(number),
+            number.toLocaleString('en-US', { minimumFractionDigits: 2 }),
+            number.toLocaleString('de-DE', { minimumFractionDigits: 2 }),
+            number.toLocaleString('en-US'),
+        ]);
+        selectors.price = bestMatch(el => {
+            const text = (el.textContent || '').trim();
+            return text.length < 40 && Array.from(variants).some(v => text.includes(v));
+        }, /price/i);
+    }
+    if (images && images.length) {
+        const files = images.map(src => (src || '').split('?')[0].split('/').pop()).filter(Boolean);
+        const matched = Array.from(document.querySelectorAll('img')).filter(img => {
+            const sources = [img.currentSrc, img.src, img.getAttribute('srcset'), img.getAttribute('data-src')].join(' ');
+            return files.some(file => sources.includes(file));
+        });
+        if (matched.length) {
+            // Smallest container that holds every matched image
+            let container = matched[0].parentElement;
+            while (container && container !== document.body && !matched.every(img => container.contains(img))) {
+                container = container.parentElement;
+            }
+            const base = container && container !== document.body ? selectorFor(container) : null;
+            selectors.images = base ? base + ' img' : null;
+        }
+    }
+    return selectors;
+})
+"""
+
+# Reads the fields back using a stored profile.
+APPLY_PROFILE_SCRIPT = """
+((selectors) => {
+    const text = (selector) => {
+        try {
+            const el = selector && document.querySelector(selector);
+            if (!el) return null;
+            return (el.getAttribute('content') || el.textContent || '').replace(/\\s+/g, ' ').trim() || null;
+        } catch (e) {
+            return null;
+        }
+    };
+    let images = [];
+    try {
+        images = Array.from(document.querySelectorAll(selectors.images))
+            .map(img => img.currentSrc || img.src || img.getAttribute('data-src'))
+            .filter(Boolean);
+    } catch (e) {}
+    return { product_name: text(selectors.product_name), price: text(selectors.price), images };
+})
+"""
+
+
+def _run_script(sb, script, argument):
+    return sb.execute_cdp_cmd("Runtime.evaluate", {
+        "expression": f"({script})({json.dumps(argument)})",
+        "returnByValue": True,
+    })["result"]["value"]
+
+
+def _same_name(a, b):
+    return " ".join((a or "").split()).lower() == " ".join((b or "").split()).lower()
+
+
+def _same_price(a, b):
+    return a is not None and b is not None and abs(float(a) - float(b)) < 0.01
+
+
+class ProfileStore:
+    """Per-domain extraction profiles learned from AI results.
+
+    A profile holds CSS selectors for the product name, price and images,
+    plus the currency the domain used. Profiles live in the shared result
+    cache. Every validate_every-th use is checked against a fresh AI
+    extraction, and a profile is dropped after max_failures disagreements
+    or once its selectors miss on max_misses pages in a row (one miss may
+    just be an out-of-stock or unusual page).
+    """
+
+    def __init__(self, cache, ttl=30 * 24 * 3600, validate_every=20, max_failures=2, max_misses=3):
+        self.cache = cache
+        self.ttl = ttl
+        self.validate_every = validate_every
+        self.max_failures = max_failures
+        self.max_misses = max_misses
+        self._counters = {"learned": 0, "hits": 0, "misses": 0, "validated": 0, "invalidated": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _key(self, url):
+        return f"profile:{url_domain(url)}"
+
+    def get(self, url):
+        profile, _ = self.cache.get(self._key(url))
+        return profile
+
+    def save(self, url, profile):
+        self.cache.set(self._key(url), profile, ttl=self.ttl)
+
+    def invalidate(self, url, reason):
+        print(f"Invalidating extraction profile for {url_domain(url)}: {reason}")
+        self.cache.delete(self._key(url))
+        self._count("invalidated")
+
+    def learn(self, sb, url, product):
+        """Derive selectors for product (an AI result) on the current page and store them."""
+        selectors = _run_script(sb, DERIVE_PROFILE_SCRIPT, {
+            "name": product.get("product_name"),
+            "price": product.get("price"),
+            "images": product.get("images") or [],
+        })
+        if not (selectors.get("product_name") and selectors.get("price") and selectors.get("images")):
+            return None
+        profile = {
+            "domain": url_domain(url),
+            "selectors": selectors,
+            "currency": product.get("currency_code"),
+            "created_at": time.time(),
+            "uses": 0,
+            "failures": 0,
+            "misses": 0,
+        }
+        self.save(url, profile)
+        self._count("learned")
+        return profile
+
+    def extract(self, sb, url, profile):
+        """Apply profile to the current page. Returns the product or None if the selectors failed."""
+        values = _run_script(sb, APPLY_PROFILE_SCRIPT, profile["selectors"])
+        price = parse_price(values.get("price"))
+        if not values.get("product_name") or price is None or not values.get("images"):
+            self._count("misses")
+            profile["misses"] = profile.get("misses", 0) + 1
+            if profile["misses"] >= self.max_misses:
+                self.invalidate(url, f"selectors missed on {profile['misses']} pages in a row")
+            else:
+                self.save(url, profile)
+            return None
+
+        profile["uses"] += 1
+        profile["misses"] = 0
+        self.save(url, profile)
+        self._count("hits")
+        return {
+            "product_name": values["product_name"],
+            "price": price,
+            "currency": profile.get("currency"),
+            "images": values["images"],
+        }
+
+    def read_price(self, sb, selectors):
+        """Price shown by the price selector on the current page, or None; leaves the stored profile alone."""
+        values = _run_script(sb, APPLY_PROFILE_SCRIPT, {"price": selectors.get("price")})
+        return parse_price(values.get("price"))
+
+    def needs_validation(self, profile):
+        return profile["uses"] % self.validate_every == 0
+
+    def validate(self, url, profile, product, ai_result):
+        """Compare a profile extraction with an AI one; drop the profile if they keep disagreeing."""
+        self._count("validated")
+        if _same_name(product["product_name"], ai_result.get("product_name")) and \
+                _same_price(product["price"], ai_result.get("price")):
+            profile["failures"] = 0
+            self.save(url, profile)
+            return True
+        profile["failures"] += 1
+        if profile["failures"] >= self.max_failures:
+            self.invalidate(url, "drifted from AI extraction")
+        else:
+            self.save(url, profile)
+        return False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import mycdp
+
+from batch import url_domain
+
+# Product signals checked while waiting: a JSON-LD Product, a visible price,
+# and whether the first large images have finished loading.
+PRODUCT_SIGNALS_SCRIPT = """
+(() => {
+    const jsonLdProduct = Array.from(document.querySelectorAll('script[type="application/ld+json"]'))
+        .some(script => /"@type"\\s*:\\s*(\\[[^\\]]*)?"Product(Group)?"/.test(script.textContent));
+
+    const priceVisible = Array.from(document.querySelectorAll(
+        '[itemprop="price"], [class*="price" i], [id*="price" i], [data-price]'
+    )).some(el => {
+        const rect = el.getBoundingClientRect();
+        return rect.width > 0 && rect.height > 0 && /\\d/.test(el.textContent || el.getAttribute('content') || '');
+    });
+
+    const images = Array.from(document.images).filter(img => {
+        const rect = img.getBoundingClientRect();
+        return rect.width >= 100 && rect.height >= 100;
+    });
+    const imagesLoaded = images.length > 0 && images.slice(0, 5).every(img => img.complete && img.naturalWidth > 0);
+
+    return {
+        document_complete: document.readyState === 'complete',
+        json_ld_product: jsonLdProduct,
+        price_visible: priceVisible,
+        images_loaded: imagesLoaded,
+    };
+})();
+"""
+
+
+class NetworkMonitor:
+    """Tracks in-flight requests of a browser tab through CDP Network events."""
+
+    def __init__(self):
+        self._page = None
+        self._in_flight = set()
+        self._last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self.bytes_received = 0
+
+    def attach(self, sb):
+        """Register the event handlers on the current tab (once per tab)."""
+        page = sb.cdp.page
+        if page is self._page:
+            return
+        sb.cdp.add_handler(mycdp.network.RequestWillBeSent, self._on_request)
+        sb.cdp.add_handler(mycdp.network.LoadingFinished, self._on_done)
+        sb.cdp.add_handler(mycdp.network.LoadingFailed, self._on_done)
+        self._page = page
+
+    def reset(self):
+        with self._lock:
+            self._in_flight.clear()
+            self._last_activity = time.monotonic()
+            self.bytes_received = 0
+
+    def _on_request(self, event, tab=None):
+        with self._lock:
+            self._in_flight.add(event.request_id)
+            self._last_activity = time.monotonic()
+
+    def _on_done(self, event, tab=None):
+        with self._lock:
+            self._in_flight.discard(event.request_id)
+            self._last_activity = time.monotonic()
+            self.bytes_received += int(getattr(event, "encoded_data_length", 0) or 0)
+
+    def is_idle(self, quiet_seconds, max_in_flight=2):
+        """True when at most max_in_flight requests (beacons, long polls) have been open for quiet_seconds."""
+        with self._lock:
+            return len(self._in_flight) <= max_in_flight and \
+                time.monotonic() - self._last_activity >= quiet_seconds
+
+
+class WaitSettings:
+    """Upper bounds for the readiness wait, with optional per-domain overrides.
+
+    Overrides come from READY_WAIT_OVERRIDES, a JSON object keyed by domain,
+    e.g. {"example.com": {"max_wait": 8, "idle_time": 1.0}}. A key also
+    matches its subdomains.
+    """
+
+    FIELDS = ("ready_state_timeout", "max_wait", "idle_time", "poll_interval")
+
+    def __init__(self, ready_state_timeout=10, max_wait=5.0, idle_time=0.5, poll_interval=0.1, overrides=None):
+        self.ready_state_timeout = ready_state_timeout
+        self.max_wait = max_wait
+        self.idle_time = idle_time
+        self.poll_interval = poll_interval
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ready_state_timeout=float(os.getenv("READY_STATE_TIMEOUT", "10")),
+            max_wait=float(os.getenv("READY_MAX_WAIT", "5")),
+            idle_time=float(os.getenv("READY_IDLE_TIME", "0.5")),
+            overrides=json.loads(os.getenv("READY_WAIT_OVERRIDES", "{}")),
+        )
+
+    def for_url(self, url):
+        """Settings for url's domain as a dict."""
+        settings = {field: getattr(self, field) for field in self.FIELDS}
+        domain = url_domain(url)
+        for key, override in self.overrides.items():
+            if domain == key or domain.endswith("." + key):
+                settings.update({k: v for k, v in override.items() if k in self.FIELDS})
+        return settings
+
+
+def _signals(sb):
+    return sb.execute_cdp_cmd("Runtime.evaluate", {
+        "expression": PRODUCT_SIGNALS_SCRIPT,
+        "returnByValue": True,
+    })["result"]["value"]
+
+
+def _pump(sb, seconds):
+    """Run the CDP event loop so network and request-interception events are handled."""
+    sb.cdp.loop.run_until_complete(asyncio.sleep(seconds))
+
+
+def wait_until_ready(sb, network, settings, images_blocked=False):
+    """Wait until the product is on the page instead of sleeping a fixed time.
+
+    Returns once a product signal (JSON-LD Product or visible price) is
+    present and the main images have loaded, or once the network has gone
+    quiet, or after settings["max_wait"] seconds. Images are not waited for
+    when their requests are being blocked. Returns the seconds spent in each
+    phase.
+    """
+    started = time.monotonic()
+    timings = {"ready_state": None, "product_signals": None, "network_idle": None, "timed_out": False}
+
+    # readyState is polled here rather than with sb.wait_for_ready_state_complete()
+    # because the event loop has to keep running while requests are intercepted
+    deadline = started + settings["ready_state_timeout"]
+    while time.monotonic() < deadline:
+        _pump(sb, settings["poll_interval"])
+        if sb.cdp.evaluate("document.readyState") == "complete":
+            break
+    timings["ready_state"] = round(time.monotonic() - started, 3)
+
+    phase_started = time.monotonic()
+    deadline = phase_started + settings["max_wait"]
+    while True:
+        _pump(sb, settings["poll_interval"])
+        signals = _signals(sb)
+        elapsed = round(time.monotonic() - phase_started, 3)
+        images_ready = images_blocked or signals["images_loaded"]
+        product_ready = (signals["json_ld_product"] or signals["price_visible"]) and images_ready
+        if product_ready and timings["product_signals"] is None:
+            timings["product_signals"] = elapsed
+        if network.is_idle(settings["idle_time"]) and timings["network_idle"] is None:
+            timings["network_idle"] = elapsed
+        if product_ready or (signals["document_complete"] and timings["network_idle"] is not None):
+            break
+        if time.monotonic() >= deadline:
+            timings["timed_out"] = True
+            break
+
+    timings["total"] = round(time.monotonic() - started, 3)
+    return timings
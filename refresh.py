@@ -0,0 +1,509 @@
+import hashlib
+import heapq
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from batch import url_domain
+from result_cache import normalize_url
+
+# Fields a refresh reports changes for
+WATCHED_FIELDS = ("price", "currency", "availability", "product_name")
+
+
+def structured_hash(product):
+    """Hash of the watched fields found in a page's structured data."""
+    values = {field: product.get(field) for field in WATCHED_FIELDS}
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+def diff_results(old, new, fields=WATCHED_FIELDS):
+    """{field: {"old", "new"}} for every watched field whose value changed."""
+    changes = {}
+    for field in fields:
+        before, after = old.get(field), new.get(field)
+        if isinstance(before, float) and isinstance(after, float) and abs(before - after) < 0.005:
+            continue
+        if before != after:
+            changes[field] = {"old": before, "new": after}
+    return changes
+
+
+class RefreshStore:
+    """Last known result of each refreshed URL, with what is needed to check it cheaply again.
+
+    A snapshot holds the watched fields, the HTTP validators (ETag and
+    Last-Modified), when plain HTTP was last blocked, the hash of the
+    structured data, whether that structured data agreed with the result,
+    and the price selector of the domain's extraction profile. Snapshots
+    live in the shared result cache.
+    """
+
+    def __init__(self, cache, ttl=30 * 24 * 3600):
+        self.cache = cache
+        self.ttl = ttl
+        self._counters = {"first_seen": 0, "not_modified": 0, "structured_data": 0, "price_only": 0, "full": 0,
+                          "failed": 0, "changed": 0}
+        self._lock = threading.Lock()
+
+    def _key(self, url):
+        return f"refresh:{normalize_url(url)}"
+
+    def get(self, url):
+        snapshot, _ = self.cache.get(self._key(url))
+        return snapshot
+
+    def save(self, url, snapshot):
+        self.cache.set(self._key(url), snapshot, ttl=self.ttl)
+
+    def count(self, checked_with, changed):
+        with self._lock:
+            self._counters[checked_with] += 1
+            self._counters["changed"] += int(changed)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class MemoryScheduleStore:
+    """Keeps schedules in this process only. Fine for a single worker and replica."""
+
+    def __init__(self, ttl=30 * 24 * 3600):
+        self.ttl = ttl
+        self._schedules = {}
+        self._urls = {}
+        self._changes = {}
+        self._lock = threading.Lock()
+
+    def create(self, schedule, dues):
+        with self._lock:
+            self._schedules[schedule["id"]] = dict(schedule)
+            self._urls[schedule["id"]] = {url: {"next_due": due, "last_result": None} for url, due in dues.items()}
+            self._changes[schedule["id"]] = []
+
+    def get(self, schedule_id):
+        with self._lock:
+            schedule = self._schedules.get(schedule_id)
+            return dict(schedule) if schedule else None
+
+    def set_status(self, schedule_id, status):
+        with self._lock:
+            schedule = self._schedules.get(schedule_id)
+            if not schedule:
+                return None
+            schedule["status"] = status
+            return dict(schedule)
+
+    def active_ids(self):
+        with self._lock:
+            return [schedule_id for schedule_id, schedule in self._schedules.items() if schedule["status"] == "active"]
+
+    def url_states(self, schedule_id):
+        with self._lock:
+            return {url: dict(state) for url, state in self._urls.get(schedule_id, {}).items()}
+
+    def claim(self, schedule_id, url, due, next_due):
+        with self._lock:
+            state = self._urls.get(schedule_id, {}).get(url)
+            if not state or state["next_due"] > due:
+                return False
+            state["next_due"] = next_due
+            return True
+
+    def save_result(self, schedule_id, url, result):
+        with self._lock:
+            state = self._urls.get(schedule_id, {}).get(url)
+            if state:
+                state["last_result"] = result
+
+    def add_change(self, schedule_id, result, keep):
+        with self._lock:
+            changes = self._changes.setdefault(schedule_id, [])
+            changes.append(result)
+            del changes[:-keep]
+
+    def changes(self, schedule_id):
+        with self._lock:
+            return list(self._changes.get(schedule_id, []))
+
+
+class SQLiteScheduleStore:
+    """Keeps schedules in a SQLite file, shared by every worker process of a pod (or replicas sharing a volume).
+
+    Claims are a conditional UPDATE, so exactly one process runs each check.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedules ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, status TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedule_urls ("
+                "schedule_id TEXT NOT NULL, url TEXT NOT NULL, next_due REAL NOT NULL, last_result TEXT, "
+                "PRIMARY KEY (schedule_id, url))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS schedule_changes ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, schedule_id TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, schedule, dues):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO schedules (id, data, status, updated_at) VALUES (?, ?, ?, ?)",
+                (schedule["id"], json.dumps(schedule), schedule["status"], time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO schedule_urls (schedule_id, url, next_due) VALUES (?, ?, ?)",
+                [(schedule["id"], url, due) for url, due in dues.items()],
+            )
+            self._expire(conn)
+
+    def _expire(self, conn):
+        expired = [row[0] for row in conn.execute(
+            "SELECT id FROM schedules WHERE status != 'active' AND updated_at < ?", (time.time() - self.ttl,)
+        )]
+        for table, column in (("schedules", "id"), ("schedule_urls", "schedule_id"),
+                              ("schedule_changes", "schedule_id")):
+            conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(schedule_id,) for schedule_id in expired])
+
+    def get(self, schedule_id):
+        row = self._connect().execute("SELECT data, status FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        return {**json.loads(row[0]), "status": row[1]} if row else None
+
+    def set_status(self, schedule_id, status):
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE schedules SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), schedule_id)
+            ).rowcount
+        return self.get(schedule_id) if updated else None
+
+    def active_ids(self):
+        return [row[0] for row in self._connect().execute("SELECT id FROM schedules WHERE status = 'active'")]
+
+    def url_states(self, schedule_id):
+        rows = self._connect().execute(
+            "SELECT url, next_due, last_result FROM schedule_urls WHERE schedule_id = ?", (schedule_id,)
+        )
+        return {
+            url: {"next_due": next_due, "last_result": json.loads(result) if result else None}
+            for url, next_due, result in rows
+        }
+
+    def claim(self, schedule_id, url, due, next_due):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE schedule_urls SET next_due = ? WHERE schedule_id = ? AND url = ? AND next_due <= ?",
+                (next_due, schedule_id, url, due),
+            ).rowcount == 1
+
+    def save_result(self, schedule_id, url, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE schedule_urls SET last_result = ? WHERE schedule_id = ? AND url = ?",
+                (json.dumps(result), schedule_id, url),
+            )
+
+    def add_change(self, schedule_id, result, keep):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO schedule_changes (schedule_id, data) VALUES (?, ?)", (schedule_id, json.dumps(result))
+            )
+            conn.execute(
+                "DELETE FROM schedule_changes WHERE schedule_id = ? AND id NOT IN "
+                "(SELECT id FROM schedule_changes WHERE schedule_id = ? ORDER BY id DESC LIMIT ?)",
+                (schedule_id, schedule_id, keep),
+            )
+
+    def changes(self, schedule_id):
+        rows = self._connect().execute(
+            "SELECT data FROM schedule_changes WHERE schedule_id = ? ORDER BY id", (schedule_id,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+
+class RedisScheduleStore:
+    """Keeps schedules in Redis so every replica shares them.
+
+    Claims compare and set the URL's next due time under WATCH, so exactly
+    one process runs each check. Cancelled schedules expire after ttl.
+    """
+
+    def __init__(self, url, ttl=30 * 24 * 3600, prefix="ecom-scraper:schedule:"):
+        import redis  # Only needed when SCHEDULE_STORE points at Redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+
+    def _keys(self, schedule_id):
+        key = self.prefix + schedule_id
+        return key, key + ":due", key + ":results", key + ":changes"
+
+    def create(self, schedule, dues):
+        key, due_key, _, _ = self._keys(schedule["id"])
+        with self._redis.pipeline() as pipe:
+            pipe.set(key, json.dumps(schedule))
+            pipe.hset(due_key, mapping={url: due for url, due in dues.items()})
+            pipe.sadd(self.prefix + "index", schedule["id"])
+            pipe.execute()
+
+    def get(self, schedule_id):
+        data = self._redis.get(self.prefix + schedule_id)
+        return json.loads(data) if data else None
+
+    def set_status(self, schedule_id, status):
+        schedule = self.get(schedule_id)
+        if not schedule:
+            return None
+        schedule["status"] = status
+        with self._redis.pipeline() as pipe:
+            pipe.set(self.prefix + schedule_id, json.dumps(schedule))
+            if status != "active":
+                pipe.srem(self.prefix + "index", schedule_id)
+                for key in self._keys(schedule_id):
+                    pipe.expire(key, self.ttl)
+            pipe.execute()
+        return schedule
+
+    def active_ids(self):
+        return sorted(schedule_id.decode() for schedule_id in self._redis.smembers(self.prefix + "index"))
+
+    def url_states(self, schedule_id):
+        _, due_key, results_key, _ = self._keys(schedule_id)
+        results = self._redis.hgetall(results_key)
+        return {
+            url.decode(): {
+                "next_due": float(due),
+                "last_result": json.loads(results[url]) if url in results else None,
+            }
+            for url, due in self._redis.hgetall(due_key).items()
+        }
+
+    def claim(self, schedule_id, url, due, next_due):
+        _, due_key, _, _ = self._keys(schedule_id)
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(due_key)
+                    current = pipe.hget(due_key, url)
+                    if current is None or float(current) > due:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.hset(due_key, url, next_due)
+                    pipe.execute()
+                    return True
+                except self._watch_error:
+                    continue
+
+    def save_result(self, schedule_id, url, result):
+        _, _, results_key, _ = self._keys(schedule_id)
+        self._redis.hset(results_key, url, json.dumps(result))
+
+    def add_change(self, schedule_id, result, keep):
+        _, _, _, changes_key = self._keys(schedule_id)
+        with self._redis.pipeline() as pipe:
+            pipe.rpush(changes_key, json.dumps(result))
+            pipe.ltrim(changes_key, -keep, -1)
+            pipe.execute()
+
+    def changes(self, schedule_id):
+        _, _, _, changes_key = self._keys(schedule_id)
+        return [json.loads(item) for item in self._redis.lrange(changes_key, 0, -1)]
+
+
+def schedule_store_from_url(url, ttl=30 * 24 * 3600):
+    """Build a store from "memory", "sqlite:///path/to/schedules.db" or "redis://host:port/db"."""
+    if not url or url == "memory":
+        return MemoryScheduleStore(ttl=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteScheduleStore(url[len("sqlite:///"):], ttl=ttl)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisScheduleStore(url, ttl=ttl)
+    raise ValueError(f"Unsupported schedule store: {url}")
+
+
+class RefreshScheduler:
+    """Re-checks lists of URLs every interval seconds and keeps their latest changes.
+
+    Each URL of a schedule gets a fixed phase within the interval, so the
+    checks of one domain are spread evenly over it instead of arriving
+    together. On top of that, two checks of the same domain start at least
+    domain_gap seconds apart within a process, whichever schedule they
+    belong to.
+
+    Schedules, each URL's last result and next due time live in the store
+    (SQLite or Redis to share them between worker processes and replicas),
+    so any process can report or cancel them. start() queues every active
+    schedule in this process; every process holding a URL tries to claim
+    each of its checks, and the store lets exactly one of them run it.
+    Changes are POSTed to the schedule's webhook when it has one.
+    """
+
+    def __init__(self, refresh, store, max_concurrency=2, domain_gap=2.0, keep_changes=100):
+        self.refresh = refresh
+        self.store = store
+        self.domain_gap = domain_gap
+        self.keep_changes = keep_changes
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="refresh")
+        self._webhooks = httpx.Client(timeout=10)
+        self._due = []
+        self._sequence = itertools.count()
+        self._domain_next = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._counters = {"runs": 0, "errors": 0, "changes": 0, "webhook_errors": 0, "skipped": 0}
+
+    def _count(self, name, amount=1):
+        with self._condition:
+            self._counters[name] += amount
+
+    def get(self, schedule_id):
+        """The schedule record with the last result of each of its URLs and its recent changes."""
+        schedule = self.store.get(schedule_id)
+        if not schedule:
+            return None
+        last_results = {
+            url: state["last_result"]
+            for url, state in self.store.url_states(schedule_id).items() if state["last_result"]
+        }
+        return {**schedule, "last_results": last_results, "recent_changes": self.store.changes(schedule_id)}
+
+    def start(self):
+        """Start the scheduler thread and queue the active schedules saved in the store."""
+        with self._condition:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._loop, name="refresh-scheduler", daemon=True)
+            self._thread.start()
+        resumed = 0
+        for schedule_id in self.store.active_ids():
+            self._queue(schedule_id, self.store.url_states(schedule_id))
+            resumed += 1
+        if resumed:
+            print(f"Resumed {resumed} refresh schedules")
+
+    def add(self, urls, interval, webhook_url=None):
+        """Schedule urls for a check every interval seconds and return the schedule record."""
+        self.start()
+        now = time.time()
+        schedule = {
+            "id": uuid.uuid4().hex,
+            "urls": list(dict.fromkeys(urls)),
+            "interval": interval,
+            "webhook_url": webhook_url,
+            "status": "active",
+            "created_at": now,
+        }
+        by_domain = {}
+        for url in schedule["urls"]:
+            by_domain.setdefault(url_domain(url), []).append(url)
+        dues = {}
+        for domain, domain_urls in by_domain.items():
+            # A stable per-domain phase keeps domains from lining up with each other
+            phase = int(hashlib.sha1(domain.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+            for position, url in enumerate(domain_urls):
+                dues[url] = now + interval * (position + phase) / len(domain_urls)
+        self.store.create(schedule, dues)
+        self._queue(schedule["id"], {url: {"next_due": due} for url, due in dues.items()})
+        return schedule
+
+    def _queue(self, schedule_id, url_states):
+        with self._condition:
+            for url, state in url_states.items():
+                due = state["next_due"]
+                heapq.heappush(self._due, (due, next(self._sequence), schedule_id, url, due))
+            self._condition.notify()
+
+    def cancel(self, schedule_id):
+        """Stop a schedule; its checks are dropped as they come due, in whichever process holds them."""
+        return self.store.set_status(schedule_id, "cancelled")
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._due or self._due[0][0] > time.time():
+                    self._condition.wait(timeout=self._due[0][0] - time.time() if self._due else None)
+                _, _, schedule_id, url, due = heapq.heappop(self._due)
+                domain = url_domain(url)
+                now = time.time()
+                if self._domain_next.get(domain, 0) > now:
+                    # Wait for the domain without moving the URL's place in the interval
+                    heapq.heappush(self._due, (self._domain_next[domain], next(self._sequence), schedule_id, url, due))
+                    continue
+                self._domain_next[domain] = now + self.domain_gap
+            self._executor.submit(self._run, due, schedule_id, url)
+
+    def _requeue(self, schedule_id, url, next_due):
+        with self._condition:
+            heapq.heappush(self._due, (next_due, next(self._sequence), schedule_id, url, next_due))
+            self._condition.notify()
+
+    def _run(self, due, schedule_id, url):
+        schedule = self.store.get(schedule_id)
+        if not schedule or schedule["status"] != "active":
+            return
+
+        next_due = due + schedule["interval"]
+        while next_due < time.time():
+            next_due += schedule["interval"]  # Skip slots missed while the check ran late
+        if not self.store.claim(schedule_id, url, due, next_due):
+            # Another process already ran this slot; follow its schedule instead
+            self._count("skipped")
+            state = self.store.url_states(schedule_id).get(url)
+            if state:
+                self._requeue(schedule_id, url, state["next_due"])
+            return
+
+        try:
+            result = self.refresh(url)
+        except Exception as e:
+            print(f"Scheduled refresh of {url} failed: {e}")
+            self._count("errors")
+            result = {"url": url, "error": str(e), "checked_at": time.time()}
+        else:
+            if result.get("error"):
+                self._count("errors")
+        self._count("runs")
+        self.store.save_result(schedule_id, url, result)
+
+        if result.get("changed"):
+            self._count("changes")
+            self.store.add_change(schedule_id, result, self.keep_changes)
+            if schedule.get("webhook_url"):
+                self._notify(schedule, result)
+
+        self._requeue(schedule_id, url, next_due)
+
+    def _notify(self, schedule, result):
+        try:
+            self._webhooks.post(schedule["webhook_url"], json={"schedule_id": schedule["id"], **result})
+        except httpx.HTTPError as e:
+            print(f"Webhook for schedule {schedule['id']} failed: {e}")
+            self._count("webhook_errors")
+
+    def stats(self):
+        with self._condition:
+            return {**self._counters, "queued": len(self._due)}
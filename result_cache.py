@@ -0,0 +1,314 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that never change what a product page shows
+TRACKING_PARAMS = {
+    "gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "_ga", "_gl", "ref", "ref_src", "spm", "scm", "srsltid",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "trk_")
+
+
+def normalize_url(url):
+    """Canonical form of url for cache keys.
+
+    Lowercases scheme and host, drops default ports, fragments and tracking
+    parameters, and sorts the remaining query string.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not (scheme == "http" and parts.port == 80) and not (scheme == "https" and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class CacheEntry:
+    """A cached value with the time it stops being fresh and the time it must be dropped."""
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+    @property
+    def is_fresh(self):
+        return time.time() < self.fresh_until
+
+    @property
+    def is_expired(self):
+        return time.time() >= self.stale_until
+
+
+class MemoryCache:
+    """In-process LRU cache bounded by the serialized size of its values."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, size = item
+            if entry.is_expired:
+                del self._entries[key]
+                self.size_bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = len(json.dumps(entry.value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.size_bytes -= old[1]
+            self._entries[key] = (entry, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+
+    def delete(self, key):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item:
+                self.size_bytes -= item[1]
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.size_bytes, "max_bytes": self.max_bytes}
+
+
+class SQLiteCache:
+    """On-disk cache that survives restarts.
+
+    Expired rows are deleted at startup and every purge_every writes, so the
+    file does not keep growing with entries nobody reads again.
+    """
+
+    def __init__(self, path, purge_every=1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_stale_until ON cache (stale_until)")
+        self.purge_expired()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value, fresh_until, stale_until FROM cache WHERE key = ? AND stale_until > ?",
+            (key, time.time()),
+        ).fetchone()
+        if not row:
+            return None
+        return CacheEntry(json.loads(row[0]), row[1], row[2])
+
+    def set(self, key, entry):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry.value), entry.fresh_until, entry.stale_until),
+            )
+        with self._writes_lock:
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            self.purge_expired()
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE stale_until <= ?", (time.time(),))
+
+    def stats(self):
+        (entries,) = self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()
+        return {"entries": entries, "path": self.path}
+
+
+class RedisCache:
+    """Cache shared by every replica."""
+
+    def __init__(self, url, prefix="ecom-scraper:"):
+        import redis  # Only needed when CACHE_REDIS_URL is set
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        data = self._redis.get(self.prefix + key)
+        if not data:
+            return None
+        data = json.loads(data)
+        return CacheEntry(data["value"], data["fresh_until"], data["stale_until"])
+
+    def set(self, key, entry):
+        data = {"value": entry.value, "fresh_until": entry.fresh_until, "stale_until": entry.stale_until}
+        ttl = max(1, int(entry.stale_until - time.time()))
+        self._redis.set(self.prefix + key, json.dumps(data), ex=ttl)
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+    def stats(self):
+        return {"prefix": self.prefix}
+
+
+class TieredCache:
+    """Looks keys up tier by tier (fastest first) and back-fills the faster tiers on a hit.
+
+    get() returns (value, is_fresh). Stale values are still returned until
+    their stale window runs out, so callers can serve them while refreshing.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self._counters = {"hits": 0, "stale_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key):
+        for index, tier in enumerate(self.tiers):
+            try:
+                entry = tier.get(key)
+            except Exception as e:
+                print(f"Cache tier {type(tier).__name__} get failed: {e}")
+                continue
+            if entry is None:
+                continue
+            for faster in self.tiers[:index]:
+                faster.set(key, entry)
+            self._count("hits" if entry.is_fresh else "stale_hits")
+            return entry.value, entry.is_fresh
+        self._count("misses")
+        return None, False
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        now = time.time()
+        entry = CacheEntry(value, now + ttl, now + ttl + stale_ttl)
+        for tier in self.tiers:
+            try:
+                tier.set(key, entry)
+            except Exception as e:
+                print(f"Cache tier {type(tier).__name__} set failed: {e}")
+
+    def delete(self, key):
+        for tier in self.tiers:
+            try:
+                tier.delete(key)
+            except Exception as e:
+                print(f"Cache tier {type(tier).__name__} delete failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["tiers"] = {type(tier).__name__: tier.stats() for tier in self.tiers}
+        return stats
+
+
+# Attribute values and URL parameters that change on every page view without
+# changing the product content (CSP nonces, CSRF tokens, session ids).
+VOLATILE_ATTRIBUTES = re.compile(r'\s(?:nonce|data-csrf[\w-]*|data-token|data-session[\w-]*)="[^"]*"', re.IGNORECASE)
+VOLATILE_PARAMS = re.compile(
+    r'([?&])(?:utm_\w+|gclid|fbclid|sessionid|session_id|sid|token|_ga|_gl)=[^&"\'\s>]*&?', re.IGNORECASE
+)
+
+
+def normalize_html_for_hash(html):
+    """Strip per-request noise from cleaned HTML so identical pages hash the same."""
+    html = VOLATILE_ATTRIBUTES.sub("", html)
+    html = VOLATILE_PARAMS.sub(r"\1", html)
+    return re.sub(r"\s+", " ", html).strip()
+
+
+class ContentHashCache:
+    """Caches model results keyed by a hash of the HTML they were extracted from.
+
+    Hits are reported as zero-cost calls, and the tokens and cost the original
+    call spent are added to the saved totals. version goes into every key, so
+    results of a different model, prompt or schema are never served.
+    """
+
+    def __init__(self, cache, ttl=7 * 24 * 3600, prefix="llm:", version=""):
+        self.cache = cache
+        self.ttl = ttl
+        self.prefix = f"{prefix}{version}:" if version else prefix
+        self._counters = {"hits": 0, "misses": 0, "saved_tokens": 0, "saved_cost_usd": 0.0}
+        self._lock = threading.Lock()
+
+    def key(self, html):
+        return self.prefix + hashlib.sha256(normalize_html_for_hash(html).encode()).hexdigest()
+
+    def get(self, html):
+        """Return a copy of the cached result for html, or None."""
+        result, _ = self.cache.get(self.key(html))
+        if result is None:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+
+        result = dict(result)
+        usage = result.pop("_token_usage", None) or {}
+        saved_tokens = usage.get("total_tokens") or 0
+        saved_cost = usage.get("estimated_cost_usd") or 0.0
+        result["_token_usage"] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "estimated_cost_usd": 0.0,
+            "cache_hit": True,
+            "saved_tokens": saved_tokens,
+            "saved_cost_usd": saved_cost,
+        }
+        with self._lock:
+            self._counters["hits"] += 1
+            self._counters["saved_tokens"] += saved_tokens
+            self._counters["saved_cost_usd"] += saved_cost
+        return result
+
+    def set(self, html, result):
+        self.cache.set(self.key(html), result, ttl=self.ttl)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["saved_cost_usd"] = round(stats["saved_cost_usd"], 6)
+        return stats
@@ -0,0 +1,61 @@
+import json
+import queue
+import time
+
+STREAM_ON = {"true", "1", "yes"}
+STREAM_OFF = {"false", "0", "no", ""}
+
+
+class EventStream:
+    """Partial results of one extraction, passed from the scrape threads to the response generator.
+
+    Every event carries "elapsed", the seconds since the stream was opened.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sent = set()
+        self._queue = queue.Queue()
+
+    def emit(self, name, data):
+        self.sent.add(name)
+        self._queue.put((name, {**data, "elapsed": round(time.perf_counter() - self.started, 4)}))
+
+    def close(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            yield item
+
+
+def format_sse(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def format_ndjson(name, data):
+    return json.dumps({"event": name, **data}) + "\n"
+
+
+def stream_format(value, accept=""):
+    """"sse", "ndjson" or None (no streaming) for a stream flag from JSON or the query string.
+
+    "sse" and "ndjson" pick the format; a plain true picks SSE when the
+    Accept header asks for text/event-stream and NDJSON otherwise. Raises
+    ValueError for anything else.
+    """
+    if value is None or value is False:
+        return None
+    if value is True:
+        value = "true"
+    value = str(value).strip().lower()
+    if value in ("sse", "ndjson"):
+        return value
+    if value in STREAM_OFF:
+        return None
+    if value in STREAM_ON:
+        return "sse" if "text/event-stream" in accept else "ndjson"
+    raise ValueError(f"stream must be sse, ndjson, true or false, not {value!r}")
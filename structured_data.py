@@ -0,0 +1,317 @@
+import html
+import json
+import re
+from html.parser import HTMLParser
+
+# Fields a product must have before the LLM can be skipped
+REQUIRED_FIELDS = ("product_name", "price", "currency")
+
+# How much each source is trusted, used to compute the confidence score
+SOURCE_CONFIDENCE = {
+    "json_ld": 1.0,
+    "microdata": 0.9,
+    "meta": 0.8,
+    "og_title": 0.6,
+    "profile": 0.85,
+    "ai": 0.8,
+}
+
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₽": "RUB", "₹": "INR", "₩": "KRW", "₺": "TRY"}
+
+# schema.org ItemAvailability names, keyed by the spellings shops use in meta tags
+AVAILABILITY = {
+    "instock": "InStock",
+    "outofstock": "OutOfStock",
+    "oos": "OutOfStock",
+    "soldout": "SoldOut",
+    "preorder": "PreOrder",
+    "presale": "PreSale",
+    "backorder": "BackOrder",
+    "limitedavailability": "LimitedAvailability",
+    "onlineonly": "OnlineOnly",
+    "instoreonly": "InStoreOnly",
+    "discontinued": "Discontinued",
+    "availablefororder": "InStock",
+}
+
+
+def parse_price(value):
+    """Turn a price like 1299, "1,299.00", "1.299,00 €" or "$12" into a float."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = re.sub(r"[^\d.,]", "", str(value))
+    if not text:
+        return None
+    if "," in text and "." in text:
+        # Whichever separator comes last is the decimal one
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        head, _, tail = text.rpartition(",")
+        text = f"{head.replace(',', '')}.{tail}" if len(tail) != 3 else text.replace(",", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_currency(value):
+    if not value:
+        return None
+    value = str(value).strip()
+    if re.fullmatch(r"[A-Za-z]{3}", value):
+        return value.upper()
+    return CURRENCY_SYMBOLS.get(value)
+
+
+def parse_availability(value):
+    """Turn "https://schema.org/InStock", "in stock" or "oos" into a schema.org availability name."""
+    if not value or not isinstance(value, str):
+        return None
+    name = value.strip().rstrip("/").rsplit("/", 1)[-1]
+    return AVAILABILITY.get(re.sub(r"[\s_-]", "", name.lower()), name or None)
+
+
+def _types(node):
+    node_type = node.get("@type", [])
+    return node_type if isinstance(node_type, list) else [node_type]
+
+
+def _walk_json_ld(node):
+    """Yield every object in a JSON-LD document, following @graph and nested values."""
+    if isinstance(node, list):
+        for item in node:
+            yield from _walk_json_ld(item)
+    elif isinstance(node, dict):
+        yield node
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                yield from _walk_json_ld(value)
+
+
+def _image_urls(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return _image_urls(value.get("contentUrl") or value.get("url"))
+    if isinstance(value, list):
+        return [url for item in value for url in _image_urls(item)]
+    return []
+
+
+def _offer_availability(offers):
+    for offer in offers if isinstance(offers, list) else [offers]:
+        if isinstance(offer, dict) and offer.get("availability"):
+            return parse_availability(offer["availability"])
+    return None
+
+
+def _offer_price(offers):
+    """Return (price, currency) from an Offer, AggregateOffer or list of them."""
+    for offer in offers if isinstance(offers, list) else [offers]:
+        if not isinstance(offer, dict):
+            continue
+        spec = offer.get("priceSpecification")
+        spec = spec[0] if isinstance(spec, list) and spec else spec
+        spec = spec if isinstance(spec, dict) else {}
+        price = parse_price(offer.get("price", offer.get("lowPrice", spec.get("price"))))
+        currency = parse_currency(offer.get("priceCurrency") or spec.get("priceCurrency"))
+        if price is not None:
+            return price, currency
+    return None, None
+
+
+def _from_json_ld(blocks):
+    for block in blocks:
+        try:
+            document = json.loads(block) if isinstance(block, str) else block
+        except ValueError:
+            continue
+        for node in _walk_json_ld(document):
+            if not {"Product", "ProductGroup"} & set(_types(node)):
+                continue
+            offers = node.get("offers")
+            if not offers and node.get("hasVariant"):
+                variants = node["hasVariant"] if isinstance(node["hasVariant"], list) else [node["hasVariant"]]
+                offers = [v.get("offers") for v in variants if isinstance(v, dict) and v.get("offers")]
+            price, currency = _offer_price(offers) if offers else (None, None)
+            name = node.get("name")
+            yield {
+                "product_name": html.unescape(name).strip() if isinstance(name, str) else None,
+                "price": price,
+                "currency": currency,
+                "availability": _offer_availability(offers) if offers else None,
+                "images": _image_urls(node.get("image")),
+            }
+
+
+def _from_microdata(items):
+    for item in items:
+        props = item.get("properties", {})
+        yield {
+            "product_name": (props.get("name") or [None])[0],
+            "price": parse_price((props.get("price") or props.get("lowPrice") or [None])[0]),
+            "currency": parse_currency((props.get("priceCurrency") or [None])[0]),
+            "availability": parse_availability((props.get("availability") or [None])[0]),
+            "images": props.get("image", []),
+        }
+
+
+def _from_meta(meta):
+    meta = {key.lower(): value for key, value in (meta or {}).items()}
+    price = meta.get("product:price:amount") or meta.get("og:price:amount")
+    currency = meta.get("product:price:currency") or meta.get("og:price:currency")
+    images = [meta[key] for key in ("og:image:secure_url", "og:image", "twitter:image") if meta.get(key)]
+    return {
+        "product_name": None,
+        "price": parse_price(price),
+        "currency": parse_currency(currency),
+        "availability": parse_availability(meta.get("product:availability") or meta.get("og:availability")),
+        "images": images,
+        "og_title": meta.get("og:title"),
+    }
+
+
+def extract_structured_product(structured):
+    """Merge JSON-LD, microdata and meta tags into one product.
+
+    structured is {"json_ld": [...], "microdata": [...], "meta": {...}}, as
+    collected from the page. Each field comes from the most trusted source
+    that has it. The result carries a confidence score and the source of
+    every field.
+    """
+    product = {"product_name": None, "price": None, "currency": None, "availability": None, "images": []}
+    sources = {}
+
+    candidates = [("json_ld", c) for c in _from_json_ld(structured.get("json_ld", []))]
+    candidates += [("microdata", c) for c in _from_microdata(structured.get("microdata", []))]
+    meta = _from_meta(structured.get("meta"))
+    candidates.append(("meta", meta))
+
+    for source, candidate in candidates:
+        for field in REQUIRED_FIELDS:
+            if product[field] is None and candidate.get(field) not in (None, ""):
+                product[field] = candidate[field]
+                sources[field] = source
+        if product["availability"] is None and candidate.get("availability"):
+            product["availability"] = candidate["availability"]
+        if not product["images"] and candidate.get("images"):
+            product["images"] = list(candidate["images"])
+            sources["images"] = source
+
+    if product["product_name"] is None and meta.get("og_title"):
+        product["product_name"] = meta["og_title"].strip()
+        sources["product_name"] = "og_title"
+
+    product["sources"] = sources
+    product["confidence"] = confidence(sources)
+    return product
+
+
+def confidence(sources):
+    """Average trust in the required fields; a missing field counts as zero."""
+    scores = [SOURCE_CONFIDENCE.get(sources.get(field), 0.0) for field in REQUIRED_FIELDS]
+    return round(sum(scores) / len(scores), 2)
+
+
+def is_complete(product):
+    """True when every required field and at least one image were found."""
+    return bool(product.get("images")) and all(product.get(field) not in (None, "") for field in REQUIRED_FIELDS)
+
+
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr",
+}
+
+
+class _OpenElement:
+    """An element whose end tag we are waiting for, matched by counting same-name tags."""
+
+    def __init__(self, tag, payload):
+        self.tag = tag
+        self.depth = 1
+        self.payload = payload
+
+
+class StructuredDataParser(HTMLParser):
+    """Collects the same data as the structured_data section of the in-page bundle (page_scripts.py), from raw HTML."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.json_ld = []
+        self.microdata = []
+        self.meta = {}
+        self._json_ld_parts = None
+        self._products = []
+        self._text_props = []
+
+    def _track(self, open_elements, tag, opening):
+        for element in list(open_elements):
+            if element.tag != tag:
+                continue
+            element.depth += 1 if opening else -1
+            if element.depth == 0:
+                open_elements.remove(element)
+                yield element
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag not in VOID_ELEMENTS:
+            list(self._track(self._products, tag, True))
+            list(self._track(self._text_props, tag, True))
+
+        if tag == "script" and (attrs.get("type") or "").lower() == "application/ld+json":
+            self._json_ld_parts = []
+        elif tag == "meta":
+            key = attrs.get("property") or attrs.get("name")
+            if key and attrs.get("content") and key not in self.meta:
+                self.meta[key] = attrs["content"]
+
+        if "itemscope" in attrs and "schema.org/Product" in (attrs.get("itemtype") or ""):
+            item = {"type": attrs.get("itemtype"), "properties": {}}
+            self.microdata.append(item)
+            if tag not in VOID_ELEMENTS:
+                self._products.append(_OpenElement(tag, item))
+            return
+
+        name = attrs.get("itemprop")
+        if not name or "itemscope" in attrs or not self._products:
+            return
+        properties = self._products[-1].payload["properties"]
+        value = attrs.get("content") or attrs.get("src") or attrs.get("href")
+        if value is not None or tag in VOID_ELEMENTS:
+            properties.setdefault(name, []).append(value or "")
+        else:
+            self._text_props.append(_OpenElement(tag, (properties, name, [])))
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._json_ld_parts is not None:
+            self.json_ld.append("".join(self._json_ld_parts))
+            self._json_ld_parts = None
+        for element in self._track(self._text_props, tag, False):
+            properties, name, parts = element.payload
+            properties.setdefault(name, []).append(" ".join("".join(parts).split()))
+        list(self._track(self._products, tag, False))
+
+    def handle_data(self, data):
+        if self._json_ld_parts is not None:
+            self._json_ld_parts.append(data)
+        for element in self._text_props:
+            element.payload[2].append(data)
+
+
+def collect_structured_data(page_html):
+    """Parse raw HTML into {"json_ld": [...], "microdata": [...], "meta": {...}}."""
+    parser = StructuredDataParser()
+    try:
+        parser.feed(page_html)
+        parser.close()
+    except Exception as e:
+        print(f"Error parsing HTML for structured data: {e}")
+    return {"json_ld": parser.json_ld, "microdata": parser.microdata, "meta": parser.meta}